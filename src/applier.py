@@ -0,0 +1,239 @@
+import log
+
+'''
+This module holds the Applier class, which applies the desired states compiled by
+PowerProfile with the minimal ordered set of writes, keeping a cached view of the
+actual cpu state so unchanged settings don't need to be re-read every time.
+'''
+
+# Settings of each cpufreq policy, cached as dicts of cpufreq policy: value
+POLICY_KEYS = ('governor', 'policy', 'freq_range')
+# Desired state keys, in application order
+APPLY_ORDER = ('cores_online', 'governor', 'policy', 'freq_range', 'perf_range', 'turbo', 'tdp_limits')
+
+
+class Applier:
+    '''
+    Desired-state diff engine
+    actual: cached view of the cpu state, keys missing from it are unknown and get read when needed
+            (POLICY_KEYS per active cpufreq policy, so each policy is written and verified on its own)
+    reads/writes: sysfs reads/writes performed by the last apply call
+    '''
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.actual = dict()
+        self.reads = 0
+        self.writes = 0
+        self.total_reads = 0
+        self.total_writes = 0
+        self.errors = 0
+
+    def invalidate(self, keys=None):
+        '''Forgets cached actual state of keys (all of them if None)'''
+        if keys is None:
+            self.actual.clear()
+        else:
+            for key in keys:
+                self.actual.pop(key, None)
+
+    def handle_uevent(self, action: str, uevent: dict):
+        '''Callback for cpu subsystem uevents, hotplugged cores have unknown state'''
+        if action in ['add', 'remove', 'online', 'offline']:
+            self.invalidate()
+
+    def enable_profiling(self, profiler):
+        '''Times each application step with profiler (profiling.Profiler)'''
+        for key in APPLY_ORDER:
+            method_name = '_apply_' + key
+            setattr(self, method_name, profiler.wrap('apply:' + key, getattr(self, method_name)))
+
+    def apply(self, desired: dict, verify: bool = False) -> tuple:
+        '''
+        Applies desired state, returns (reads, writes) performed
+        verify: re-read actual state instead of trusting the cached view
+        '''
+        self.reads = self.writes = 0
+        if verify:
+            self.invalidate()
+
+        try:
+            self._apply_cores_online(desired['cores_online'], desired['core_order'])
+            self._apply_governor(desired['governor'])
+            self._apply_policy(desired['policy'])
+            self._apply_freq_range(*desired['freq_range'])
+            self._apply_perf_range(*desired['perf_range'])
+            self._apply_turbo(desired['turbo'])
+            self._apply_tdp_limits(desired['tdp_limits'])
+        except OSError as err:
+            # The cached view can't be trusted after a partial application
+            self.errors += 1
+            self.invalidate()
+            log.warning(f'Profile application failed: {err}')
+
+        self.total_reads += self.reads
+        self.total_writes += self.writes
+        return self.reads, self.writes
+
+    # Cached state
+    def _actual(self, key: str):
+        if key not in self.actual:
+            self.actual[key] = self._read(key)
+        return self.actual[key]
+
+    def _read(self, key: str):
+        cpu = self.cpu
+        if key == 'cores_online':
+            # core 0 can't be turned off, so it doesn't need to be read
+            self.reads += cpu.spec.physical_cores - 1
+            return tuple(cpu.read_physical_core_status(core_num) for core_num in range(cpu.spec.physical_cores))
+        elif key == 'perf_range':
+            self.reads += 2
+            return cpu.read_perf_range()
+        elif key == 'turbo':
+            self.reads += 1
+            return cpu.read_turbo_state()
+        elif key == 'tdp_limits':
+            self.reads += 2
+            return cpu.read_tdp_limits()
+
+    def _actual_policies(self, key: str) -> dict:
+        '''Cached value of key for each active cpufreq policy (read if unknown)'''
+        actual = self.actual.setdefault(key, dict())
+        for cpufreq_policy in self._active_policies():
+            if cpufreq_policy not in actual:
+                actual[cpufreq_policy] = self._read_policy(key, cpufreq_policy)
+        return actual
+
+    def _read_policy(self, key: str, cpufreq_policy: str):
+        cpu = self.cpu
+        if key == 'governor':
+            self.reads += 1
+            return cpu.read_governor(cpufreq_policy)
+        elif key == 'policy':
+            self.reads += 1
+            return cpu.read_policy(cpufreq_policy)
+        elif key == 'freq_range':
+            self.reads += 2
+            return tuple(cpu.read_freq_range(cpufreq_policy))
+
+    def _online_core_ids(self) -> list:
+        thread_siblings = self.cpu.spec.thread_siblings
+        cores_online = self._actual('cores_online')
+        return sorted(core_id for core_num, online in enumerate(cores_online) if online
+                      for core_id in thread_siblings[core_num])
+
+    def _active_policies(self) -> list:
+        return self.cpu.cpufreq_policies(self._online_core_ids())
+
+    def _differing_policies(self, key: str, value) -> list:
+        '''Active cpufreq policies whose value of key differs from value'''
+        actual = self._actual_policies(key)
+        return [cpufreq_policy for cpufreq_policy in self._active_policies() if actual[cpufreq_policy] != value]
+
+    # Settings, in application order
+    def _apply_cores_online(self, num_cores: int, core_order: tuple):
+        '''core_order: physical core numbers in onlining order, see topology.core_order'''
+        assert 0 < num_cores and num_cores <= self.cpu.spec.physical_cores
+        cores_online = self._actual('cores_online')
+        online_cores = set(core_order[:num_cores])
+        desired = tuple(core_num in online_cores for core_num in range(self.cpu.spec.physical_cores))
+        if desired == cores_online:
+            return
+
+        for core_num, (online, desired_online) in enumerate(zip(cores_online, desired)):
+            if online != desired_online:
+                core_ids = self.cpu.spec.thread_siblings[core_num]
+                self.cpu.write_core_status(core_ids, online=desired_online)
+                self.writes += len(core_ids)
+        self.actual['cores_online'] = desired
+        # Settings of cpufreq policies with every cpu offline are unknown once they come back
+        active_policies = set(self._active_policies())
+        for key in POLICY_KEYS:
+            actual = self.actual.get(key, dict())
+            for cpufreq_policy in set(actual) - active_policies:
+                del actual[cpufreq_policy]
+
+    def _apply_governor(self, governor: str):
+        cpufreq_policies = self._differing_policies('governor', governor)
+        if cpufreq_policies:
+            self.cpu.write_policy_attribute('scaling_governor', governor, cpufreq_policies)
+            self.writes += len(cpufreq_policies)
+            actual_policy = self.actual.get('policy', dict())
+            for cpufreq_policy in cpufreq_policies:
+                self.actual['governor'][cpufreq_policy] = governor
+                # Governor changes might reset the energy performance preference
+                actual_policy.pop(cpufreq_policy, None)
+
+    def _apply_policy(self, policy: str):
+        if not self.cpu.spec.policies:
+            return
+        cpufreq_policies = self._differing_policies('policy', policy)
+        if cpufreq_policies:
+            self.cpu.write_policy_attribute('energy_performance_preference', policy, cpufreq_policies)
+            self.writes += len(cpufreq_policies)
+            for cpufreq_policy in cpufreq_policies:
+                self.actual['policy'][cpufreq_policy] = policy
+
+    def _apply_freq_range(self, min_freq: int, max_freq: int):
+        assert min_freq <= max_freq
+        actual = self._actual_policies('freq_range')
+        for cpufreq_policy in self._differing_policies('freq_range', (min_freq, max_freq)):
+            actual_min, actual_max = actual[cpufreq_policy]
+            writes = []
+            if min_freq != actual_min:
+                writes.append(('scaling_min_freq', min_freq))
+            if max_freq != actual_max:
+                writes.append(('scaling_max_freq', max_freq))
+            # Raising the range: max goes first so min is never written above the current max
+            if min_freq > actual_max:
+                writes.reverse()
+
+            for attribute, value in writes:
+                self.cpu.write_policy_attribute(attribute, value, [cpufreq_policy])
+                self.writes += 1
+            actual[cpufreq_policy] = (min_freq, max_freq)
+
+    def _apply_perf_range(self, min_perf_pct: int, max_perf_pct: int):
+        # This setting only exists for intel_pstate
+        assert min_perf_pct <= max_perf_pct
+        if self.cpu.spec.driver != 'intel_pstate':
+            return
+        actual_min, actual_max = self._actual('perf_range')
+        writes = []
+        if min_perf_pct != actual_min:
+            writes.append(('min', min_perf_pct))
+        if max_perf_pct != actual_max:
+            writes.append(('max', max_perf_pct))
+        if min_perf_pct > actual_max:
+            writes.reverse()
+
+        for bound, perf_pct in writes:
+            self.cpu.write_perf_pct(bound, perf_pct)
+            self.writes += 1
+        self.actual['perf_range'] = (min_perf_pct, max_perf_pct)
+
+    def _apply_turbo(self, turbo: bool):
+        if not self.cpu.spec.turbo_allowed:
+            return
+        if self._actual('turbo') != turbo:
+            self.cpu.write_turbo_state(turbo)
+            self.writes += 1
+            self.actual['turbo'] = turbo
+
+    def _apply_tdp_limits(self, tdp_limits: tuple):
+        '''tdp_limits: (PL1, PL2) or None to leave them untouched'''
+        if tdp_limits is None or self.cpu.tdp_limit_paths() is None:
+            return
+        actual = self._actual('tdp_limits')
+        constraints = [constraint for constraint in (0, 1) if tdp_limits[constraint] != actual[constraint]]
+        # Raising the limits: PL2 goes first so PL1 <= PL2 holds in between writes
+        if tdp_limits[0] > actual[1]:
+            constraints.reverse()
+
+        for constraint in constraints:
+            self.cpu.write_tdp_limit(constraint, tdp_limits[constraint])
+            self.writes += 2
+        self.actual['tdp_limits'] = tuple(tdp_limits)
+
+    def log_summary(self):
+        log.info(f'Profile applied with {self.reads} reads and {self.writes} writes.')
@@ -1,12 +1,22 @@
 #!/usr/bin/python3
 import os
 import configparser
-from time import time, sleep
 
 import log
 from shell import is_root
+from hardware import privileged
+from temperature import TEMP_SOURCES
+from thermal import THERMAL_ACTUATORS
+from topology import CORE_PREFERENCES, core_order
+from matcher import Trigger
 
 CONFIG_PATH = '/etc/powerplan.conf'
+# Keys added after config files were already in use, if missing from DEFAULT
+# they get filled in from the generated default profile instead of raising an error
+LATER_KEYS = ('temp_source', 'thermal_actuator', 'ac_pollingperiod_max', 'bat_pollingperiod_max',
+              'ac_timerslack', 'bat_timerslack', 'bat_boost', 'bat_boost_threshold', 'bat_boost_release',
+              'bat_boost_trigger', 'bat_boost_min_time', 'bat_boost_cooldown', 'ac_core_preference',
+              'bat_core_preference', 'isolate_cores')
 
 def generate_default_profile(system) -> dict:
     '''Generates a defaul profile depending on system specifications'''
@@ -36,8 +46,14 @@ def generate_default_profile(system) -> dict:
         priority=99,
         ac_pollingperiod=1000,
         bat_pollingperiod=2000,
+        ac_pollingperiod_max=4000,
+        bat_pollingperiod_max=8000,
+        ac_timerslack=0,
+        bat_timerslack=100,
         ac_cores_online=cpu_spec.physical_cores,
         bat_cores_online=cpu_spec.physical_cores,
+        ac_core_preference='performance' if cpu_spec.core_types else 'none',
+        bat_core_preference='efficiency' if cpu_spec.core_types else 'none',
         ac_templimit=cpu_spec.crit_temp - 5,
         bat_templimit=cpu_spec.crit_temp - 5,
         ac_minfreq=cpu_spec.minfreq // 1000,
@@ -54,10 +70,19 @@ def generate_default_profile(system) -> dict:
         bat_tdp_burst=0,
         ac_turbo=True,
         bat_turbo=False,
+        bat_boost=False,
+        bat_boost_threshold=70,
+        bat_boost_release=40,
+        bat_boost_trigger=4000,
+        bat_boost_min_time=10000,
+        bat_boost_cooldown=10000,
         ac_governor=preferred_available(default_ac_governor_preference[cpu_spec.driver], cpu_spec.governors),
         bat_governor=preferred_available(default_bat_governor_preference[cpu_spec.driver], cpu_spec.governors),
         ac_policy='balance_performance' if cpu_spec.policies else '',
         bat_policy='power' if cpu_spec.policies else '',
+        temp_source='package',
+        thermal_actuator='auto',
+        isolate_cores=0,
         triggerapps=''
     )
 
@@ -71,8 +96,16 @@ class PowerProfile:
         self.bat_governor = section['bat_governor']
         self.ac_policy = section['ac_policy']
         self.bat_policy = section['bat_policy']
-        self.triggerapps = [app.strip() for app in section['triggerapps'].split(',') if app]
+        self.ac_core_preference = section['ac_core_preference']
+        self.bat_core_preference = section['bat_core_preference']
+        self.temp_source = section['temp_source']
+        self.thermal_actuator = section['thermal_actuator']
+        self.triggerapps = [app.strip() for app in section['triggerapps'].split(',') if app.strip()]
         self.has_trigger = bool(self.triggerapps)
+        try:
+            self.triggers = [Trigger(app) for app in self.triggerapps]
+        except ValueError as err:
+            log.error(f'Invalid profile "{self.name}": triggerapps {err}.')
         self.system = system
         self.description = self._description()
 
@@ -82,6 +115,10 @@ class PowerProfile:
             (i, 'integer', 'priority'),
             (i, 'integer', 'ac_pollingperiod'),
             (i, 'integer', 'bat_pollingperiod'),
+            (i, 'integer', 'ac_pollingperiod_max'),
+            (i, 'integer', 'bat_pollingperiod_max'),
+            (i, 'integer', 'ac_timerslack'),
+            (i, 'integer', 'bat_timerslack'),
             (i, 'integer', 'ac_cores_online'),
             (i, 'integer', 'bat_cores_online'),
             (i, 'integer', 'ac_templimit'),
@@ -99,7 +136,14 @@ class PowerProfile:
             (i, 'integer', 'bat_tdp_sustained'),
             (i, 'integer', 'bat_tdp_burst'),
             (b, 'boolean', 'ac_turbo'),
-            (b, 'boolean', 'bat_turbo')
+            (b, 'boolean', 'bat_turbo'),
+            (b, 'boolean', 'bat_boost'),
+            (i, 'integer', 'bat_boost_threshold'),
+            (i, 'integer', 'bat_boost_release'),
+            (i, 'integer', 'bat_boost_trigger'),
+            (i, 'integer', 'bat_boost_min_time'),
+            (i, 'integer', 'bat_boost_cooldown'),
+            (i, 'integer', 'isolate_cores')
         )
 
         for (method, type_name, attr) in method_type_attr:
@@ -111,6 +155,9 @@ class PowerProfile:
         # Value checks
         self._validate()
         self._set_freqs_to_khz()
+        self.desired_states = {ac: self._desired_state(ac) for ac in (True, False)}
+        self.boosted_state = self._boosted_state() if self.bat_boost else None
+        self.isolated_cpus = {ac: self._isolated_cpus(ac) for ac in (True, False)}
 
     def _description(self) -> str:
         description = self.name
@@ -118,38 +165,66 @@ class PowerProfile:
             description += f'\t\ttriggered by {", ".join(self.triggerapps)}'
         return description
 
-    def apply(self, status):
-        ''' Applies profile configuration'''
-        cpu = self.system.cpu
-        if status['ac_power']:
-            cpu.set_physical_cores_online(self.ac_cores_online)
-            cpu.set_freq_range(self.ac_minfreq, self.ac_maxfreq)
-            cpu.set_perf_range(self.ac_minperf, self.ac_maxperf)
-            cpu.set_turbo_state(self.ac_turbo)
-            cpu.set_governor(self.ac_governor)
-            cpu.set_policy(self.ac_policy)
-            cpu.set_tdp_limits(self.ac_tdp_sustained, self.ac_tdp_burst)
-        else:
-            cpu.set_physical_cores_online(self.bat_cores_online)
-            cpu.set_freq_range(self.bat_minfreq, self.bat_maxfreq)
-            cpu.set_perf_range(self.bat_minperf, self.bat_maxperf)
-            cpu.set_turbo_state(self.bat_turbo)
-            cpu.set_governor(self.bat_governor)
-            cpu.set_policy(self.bat_policy)
-            cpu.set_tdp_limits(self.bat_tdp_sustained, self.bat_tdp_burst)
-
-    def triggerapp_present(self, procs: set) -> bool:
-        for app in self.triggerapps:
-            if app[:15] in procs:
-                return True
-        return False
-
-    def sleep(self, iteration_start, status):
-        if status['ac_power']:
-            pollingperiod = self.ac_pollingperiod / 1000
+    def _desired_state(self, ac: bool) -> dict:
+        '''Compiles the desired cpu state for ac (True) or battery (False) power'''
+        prefix = 'ac_' if ac else 'bat_'
+        setting = lambda name: getattr(self, prefix + name)
+        tdp_limits = (setting('tdp_sustained'), setting('tdp_burst'))
+        cpu_spec = self.system.cpu.spec
+        return dict(
+            cores_online=setting('cores_online'),
+            core_order=core_order(cpu_spec.thread_siblings, cpu_spec.core_types, setting('core_preference'),
+                                  cpu_spec.core_domains),
+            governor=setting('governor'),
+            policy=setting('policy'),
+            freq_range=(setting('minfreq'), setting('maxfreq')),
+            perf_range=(setting('minperf'), setting('maxperf')),
+            turbo=setting('turbo'),
+            # Zero values mean TDP limits are left untouched
+            tdp_limits=tdp_limits if all(tdp_limits) else None
+        )
+
+    def _boosted_state(self) -> dict:
+        '''Battery state with the core count, max freq/perf and turbo limits lifted to the ac ones'''
+        boosted_state = dict(self.desired_states[False])
+        boosted_state.update(
+            cores_online=max(self.bat_cores_online, self.ac_cores_online),
+            freq_range=(self.bat_minfreq, max(self.bat_maxfreq, self.ac_maxfreq)),
+            perf_range=(self.bat_minperf, max(self.bat_maxperf, self.ac_maxperf)),
+            turbo=self.bat_turbo or self.ac_turbo
+        )
+        return boosted_state
+
+    def _isolated_cpus(self, ac: bool) -> tuple:
+        '''Cpus dedicated to the trigger apps: threads of the fastest isolate_cores online cores, but cpu0's'''
+        if not self.isolate_cores:
+            return ()
+        cpu_spec = self.system.cpu.spec
+        desired_state = self.desired_states[ac]
+        online_cores = set(desired_state['core_order'][:desired_state['cores_online']])
+        fastest_cores = core_order(cpu_spec.thread_siblings, cpu_spec.core_types, 'performance', cpu_spec.core_domains)
+        # The first one is cpu0's core
+        cores = [core_num for core_num in fastest_cores[1:] if core_num in online_cores][:self.isolate_cores]
+        return tuple(sorted(core_id for core_num in cores for core_id in cpu_spec.thread_siblings[core_num]))
+
+    def apply(self, status, verify: bool = False, boosted: bool = False, thermal=None):
+        '''
+        Applies profile configuration
+        verify: re-read the actual cpu state instead of trusting the cached one
+        boosted: lift battery limits during a workload burst (see workload.WorkloadGovernor)
+        thermal: thermal.ThermalController capping the state to hold templimit
+        '''
+        ac_power = bool(status['ac_power'])
+        if boosted and not ac_power and self.boosted_state is not None:
+            desired_state = self.boosted_state
         else:
-            pollingperiod = self.bat_pollingperiod / 1000
-        sleep(max((0, pollingperiod - time() + iteration_start)))
+            desired_state = self.desired_states[ac_power]
+        if thermal is not None:
+            desired_state = thermal.limit(desired_state, self, ac_power)
+        errors = self.system.applier.errors
+        self.system.applier.apply(desired_state, verify=verify)
+        if thermal is not None:
+            thermal.applied(self.system.applier.errors == errors)
 
     def _set_freqs_to_khz(self):
         self.ac_minfreq *= 1000
@@ -179,10 +254,28 @@ class PowerProfile:
                                      (self.ac_pollingperiod, self.bat_pollingperiod)):
             if value <= 0:
                 log.error(f'Invalid profile "{self.name}": {value_name} must be greater than zero.')
+        self._check_value_order('ac_pollingperiod/ac_pollingperiod_max', self.ac_pollingperiod, self.ac_pollingperiod_max)
+        self._check_value_order('bat_pollingperiod/bat_pollingperiod_max', self.bat_pollingperiod, self.bat_pollingperiod_max)
+
+        # Timer slack
+        for value_name in ('ac_timerslack', 'bat_timerslack'):
+            if getattr(self, value_name) < 0:
+                log.error(f'Invalid profile "{self.name}": {value_name} must not be negative.')
 
         # Online Cores
         self._check_value_in_range('', self.ac_cores_online, [1, cpu_spec.physical_cores])
         self._check_value_in_range('', self.bat_cores_online, [1, cpu_spec.physical_cores])
+        for value_name in ('ac_core_preference', 'bat_core_preference'):
+            if getattr(self, value_name) not in CORE_PREFERENCES:
+                log.error(f'Invalid profile "{self.name}": {value_name} "{getattr(self, value_name)}" '
+                          f'must be one of {CORE_PREFERENCES}.')
+
+        # Trigger app isolation, at least one online core must be left for everything else
+        if self.isolate_cores:
+            if not self.has_trigger:
+                log.error(f'Invalid profile "{self.name}": isolate_cores needs trigger applications.')
+            self._check_value_in_range('isolate_cores', self.isolate_cores,
+                                       [0, min(self.ac_cores_online, self.bat_cores_online) - 1])
 
         # Freq ranges, check them as MHz so errors are not confusing
         allowed_freq_range = [cpu_spec.minfreq // 1000, cpu_spec.maxfreq // 1000]
@@ -202,6 +295,40 @@ class PowerProfile:
         self._check_value_in_range('bat_minperf', self.bat_minperf, allowed_perf_range)
         self._check_value_in_range('bat_maxperf', self.bat_maxperf, allowed_perf_range)
 
+        # Workload boost
+        if self.bat_boost:
+            for value_name in ('bat_boost_threshold', 'bat_boost_release'):
+                self._check_value_in_range(value_name, getattr(self, value_name), [0, 100])
+            self._check_value_order('bat_boost_release/bat_boost_threshold',
+                                    self.bat_boost_release, self.bat_boost_threshold)
+            for value_name in ('bat_boost_trigger', 'bat_boost_min_time', 'bat_boost_cooldown'):
+                if getattr(self, value_name) < 0:
+                    log.error(f'Invalid profile "{self.name}": {value_name} must not be negative.')
+
+        # Temperature limits, zero disables thermal control
+        # Out of range values were accepted before thermal control existed, so they get clamped
+        for value_name in ('ac_templimit', 'bat_templimit'):
+            templimit = getattr(self, value_name)
+            clamped = min(max(templimit, 1), cpu_spec.crit_temp)
+            if templimit and clamped != templimit:
+                log.warning(f'Profile "{self.name}": {value_name} {templimit} is outside [1, {cpu_spec.crit_temp}], '
+                            f'using {clamped}.')
+                setattr(self, value_name, clamped)
+
+        # Thermal actuator
+        if self.thermal_actuator not in THERMAL_ACTUATORS:
+            log.error(f'Invalid profile "{self.name}": thermal_actuator "{self.thermal_actuator}" '
+                      f'must be one of {THERMAL_ACTUATORS}.')
+        if self.thermal_actuator == 'perf' and cpu_spec.driver != 'intel_pstate':
+            log.error(f'Invalid profile "{self.name}": thermal_actuator perf needs the intel_pstate driver.')
+        # RAPL power limits can only be found with root privileges
+        if self.thermal_actuator == 'tdp' and privileged() and self.system.cpu.tdp_limit_paths() is None:
+            log.error(f'Invalid profile "{self.name}": thermal_actuator tdp needs RAPL power limits.')
+
+        # Temperature source
+        if self.temp_source not in TEMP_SOURCES:
+            log.error(f'Invalid profile "{self.name}": temp_source "{self.temp_source}" must be one of {TEMP_SOURCES}.')
+
         # TDP Limits PL1 <= PL2
         self._check_value_order('ac_tdp_sustain/ac_tdp_burst', self.ac_tdp_sustained, self.ac_tdp_burst)
         self._check_value_order('bat_tdp_sustain/bat_tdp_burst', self.bat_tdp_sustained, self.bat_tdp_burst)
@@ -256,7 +383,11 @@ def check_config_keys(config, default_profile):
     needed_default_keys = default_profile.keys()
     for needed_key in needed_default_keys:
         if needed_key not in provided_default_keys:
-            log.error(f'DEFAULT profile is missing the following key: {needed_key}.')
+            if needed_key in LATER_KEYS:
+                config['DEFAULT'][needed_key] = str(default_profile[needed_key])
+                log.info(f'DEFAULT profile is missing {needed_key}, using {default_profile[needed_key]}.')
+            else:
+                log.error(f'DEFAULT profile is missing the following key: {needed_key}.')
 
     # Look for invalid keys in every profile
     for profile_name in config:
@@ -1,13 +1,19 @@
 #!/usr/bin/python3
+import os
 import re
 import sys
+import json
 import time
+import hashlib
 from pathlib import Path
 
-import psutil
-
 import log
-from shell import shell, is_root, read, path_is_writable
+import hardware
+import temperature
+from temperature import TemperatureSensor
+from utilization import UtilizationSampler
+from topology import cpu_ranges_to_list, detect_core_types, detect_core_domains
+from hardware import read, read_text, write, exists, glob, is_writable, privileged
 
 '''
 This module holds the Cpu class (cpu configuration interface)
@@ -18,18 +24,17 @@ which also contains an instance of the CPUSpecification class
 SYSTEM_DIR = '/sys/devices/system/'
 CPU_DIR = SYSTEM_DIR + 'cpu/'
 CPUFREQ_DIR = CPU_DIR + 'cpu0/cpufreq/'
+CPUFREQ_POLICY_DIR = CPU_DIR + 'cpufreq/'
+RAPL_DIR = '/sys/class/powercap/'
 
+# CPUSpecification cache
+SPEC_CACHE_VERSION = 5
+SPEC_ATTRIBUTES = ('name', 'thread_siblings', 'physical_cores', 'logical_cores', 'minfreq', 'maxfreq',
+                   'basefreq', 'turbo_path', 'turbo_inverse', 'turbo_allowed', 'temp_sensors', 'temp_sensor',
+                   'temp_sensor_dirs', 'crit_temp', 'governors', 'policies', 'driver', 'driver_repr', 'min_perf_pct', 'max_perf_pct',
+                   'rapl_layers', 'cpufreq_policies', 'core_types', 'core_domains')
+PATH_ATTRIBUTES = ('turbo_path', 'min_perf_pct', 'max_perf_pct')
 
-def cpu_ranges_to_list(cpu_ranges: str) -> list:
-    '''Parses virtual cpu's (offline,online,present) files formatting '''
-    cpus = []
-    for cpu_range in cpu_ranges:
-        if '-' in cpu_range:
-            start, end = cpu_range.split('-')
-            cpus.extend(list(range(int(start), int(end)+1)))
-        else:
-            cpus.append(int(cpu_range))
-    return cpus
 
 def list_cores(status: str = 'present') -> list:
     """list coreid's with status: offline, online, present"""
@@ -45,20 +50,59 @@ def set_core_status(core_list: list, online: int):
     assert online in [0, 1]
     online = str(online)
     for core_id in core_list:
-        core_id_online_path = Path(CPU_DIR + f'cpu{core_id}/online')
-        if core_id_online_path.exists():
-            core_id_online_path.write_text(online)
+        core_id_online_path = CPU_DIR + f'cpu{core_id}/online'
+        if exists(core_id_online_path):
+            write(core_id_online_path, online)
 
 
 class CPUSpecification:
-    ''' Stores all static CPU attributes and paths (that vary between models and drivers) '''
+    '''
+    Stores all static CPU attributes and paths (that vary between models and drivers)
+    Probed attributes are cached on disk (if the hardware backend has a cache_dir), keyed by
+    boot id, kernel release, present cpus and cpu model/microcode. reprobe ignores the cache.
+    '''
+
+    def __init__(self, reprobe: bool = False):
+        cache_path = self.cache_path()
+        identity = self.identity() if cache_path else None
+        if identity is not None and not reprobe and self._load_cache(cache_path, identity):
+            log.info(f'CPU specification loaded from {cache_path}.')
+        else:
+            self._probe()
+            if identity is not None:
+                self._save_cache(cache_path, identity)
+        self._set_repr_strings()
 
-    def __init__(self):
+    @staticmethod
+    def cache_path() -> str:
+        cache_dir = hardware.backend.cache_dir
+        return None if cache_dir is None else cache_dir + 'cpuspec.json'
+
+    @staticmethod
+    def identity() -> dict:
+        '''Returns what the cached specification is valid for, None if unavailable'''
+        try:
+            identity = dict(
+                boot_id=read('/proc/sys/kernel/random/boot_id'),
+                kernel=read('/proc/sys/kernel/osrelease'),
+                present=read(CPU_DIR + 'present')
+            )
+            # First processor block of cpuinfo is enough to identify the model
+            for line in read_text('/proc/cpuinfo').split('\n\n', 1)[0].splitlines():
+                key, _, value = line.partition(':')
+                if key.strip() in ['vendor_id', 'cpu family', 'model', 'model name', 'stepping', 'microcode']:
+                    identity[key.strip()] = value.strip()
+        except OSError:
+            return None
+        return identity
+
+    def _probe(self):
+        '''Detects every attribute in SPEC_ATTRIBUTES'''
         # Check and warn if there are offline cores (when without root privilege and --system argument)
         cores_offline = list_cores('offline')
         if cores_offline:
             log.info('Offline cores detected: ' + read(CPU_DIR + 'offline'))
-            if is_root():
+            if privileged():
                 log.info('Setting all cores online to enable correct topology detection.')
                 set_core_status(list_cores('present'), online=1)
             elif '--system' in sys.argv:
@@ -66,13 +110,18 @@ class CPUSpecification:
                             ', since there are offline cores.')
 
         # Model
-        self.name = shell('grep "model name" /proc/cpuinfo').split(':')[-1].strip()
+        self.name = self._model_name()
         # Topology
         self.thread_siblings = self._thread_siblings()
         self.physical_cores = len(self.thread_siblings)
         self.logical_cores = len(list_cores())
+        self.cpufreq_policies = self._cpufreq_policies()
+        # Performance/efficiency core of each physical core, empty if not hybrid
+        self.core_types = detect_core_types(self.thread_siblings)
+        # (package, die, llc, cluster) of each physical core, for compact core parking
+        self.core_domains = detect_core_domains(self.thread_siblings)
         # Reset core status
-        if cores_offline and is_root():
+        if cores_offline and privileged():
             log.info('Setting cores back to initial offline status.')
             set_core_status(cores_offline, online=0)
 
@@ -80,13 +129,12 @@ class CPUSpecification:
         self.minfreq = read(CPUFREQ_DIR + 'cpuinfo_min_freq', dtype=int)
         self.maxfreq = read(CPUFREQ_DIR + 'cpuinfo_max_freq', dtype=int)
         self._set_turbo_variables()
-        self.temp_sensor = self._available_temp_sensor()
-        self.crit_temp = self._read_crit_temp(self.temp_sensor)
+        self._set_temperature_variables()
 
         # governors / policies
         self.governors = read(CPUFREQ_DIR + 'scaling_available_governors').split(' ')
-        epp_available = Path(CPUFREQ_DIR + 'energy_performance_available_preferences')
-        if epp_available.exists():
+        epp_available = CPUFREQ_DIR + 'energy_performance_available_preferences'
+        if exists(epp_available):
             self.policies = read(epp_available).split(' ')
         else:
             self.policies = []
@@ -108,20 +156,101 @@ class CPUSpecification:
             self.driver = 'cpufreq'
             # stuff unavailable in cpufreq drivers
             self.basefreq = ''
-
-        # Lastly generate some system info strings
+            self.min_perf_pct = None
+            self.max_perf_pct = None
 
         # all cpufreq drivers are treated the same, driver_repr differentiates them in logs/status
         self.driver_repr = driver
 
+        # RAPL layers
+        self.rapl_layers = glob(RAPL_DIR + 'intel-rapl:*')
+
+    def _save_cache(self, cache_path: str, identity: dict):
+        spec = {attribute: getattr(self, attribute) for attribute in SPEC_ATTRIBUTES}
+        for attribute in PATH_ATTRIBUTES:
+            if spec[attribute] is not None:
+                spec[attribute] = spec[attribute].as_posix()
+        spec_json = json.dumps(spec, sort_keys=True)
+        cache = dict(version=SPEC_CACHE_VERSION, identity=identity, spec=spec,
+                     checksum=hashlib.sha256(spec_json.encode()).hexdigest())
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Write and rename so a crash never leaves a partial cache behind
+            with open(cache_path + '.tmp', 'w') as file:
+                json.dump(cache, file)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as err:
+            log.info(f'CPU specification cache could not be written: {err.strerror}.')
+
+    @staticmethod
+    def _read_cache(cache_path: str) -> dict:
+        '''Returns cached spec dict if cache is readable and its checksum matches, else None'''
+        try:
+            with open(cache_path, 'r') as file:
+                cache = json.load(file)
+            spec_json = json.dumps(cache['spec'], sort_keys=True)
+            if cache['version'] != SPEC_CACHE_VERSION or \
+                    cache['checksum'] != hashlib.sha256(spec_json.encode()).hexdigest():
+                log.info('CPU specification cache is invalid.')
+                return None
+            return cache
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _load_cache(self, cache_path: str, identity: dict) -> bool:
+        cache = self._read_cache(cache_path)
+        if cache is None:
+            return False
+        if cache['identity'] != identity:
+            log.info('CPU specification cache is outdated (new boot, kernel or microcode).')
+            return False
+        spec = cache['spec']
+        if set(spec) != set(SPEC_ATTRIBUTES):
+            return False
+        for attribute, value in spec.items():
+            if attribute in PATH_ATTRIBUTES and value is not None:
+                value = Path(value)
+            setattr(self, attribute, value)
+        self.thread_siblings = [tuple(siblings) for siblings in self.thread_siblings]
+        self.cpufreq_policies = {name: tuple(cpus) for name, cpus in self.cpufreq_policies.items()}
+        self.core_domains = [tuple(domains) for domains in self.core_domains]
+        return True
+
+    def verify_cache(self) -> list:
+        '''Compares cached specification against a fresh probe, returns list of mismatching attributes'''
+        cache_path = self.cache_path()
+        cache = self._read_cache(cache_path) if cache_path else None
+        if cache is None:
+            return list(SPEC_ATTRIBUTES)
+        cached = CPUSpecification.__new__(CPUSpecification)
+        if not cached._load_cache(cache_path, cache['identity']):
+            return list(SPEC_ATTRIBUTES)
+        probed = CPUSpecification.__new__(CPUSpecification)
+        probed._probe()
+        mismatches = [attribute for attribute in SPEC_ATTRIBUTES
+                      if getattr(cached, attribute) != getattr(probed, attribute)]
+        if cache['identity'] != self.identity():
+            mismatches.append('identity')
+        return mismatches
+
+    def _set_repr_strings(self):
+        '''Lastly generate some system info strings'''
+
         # sibling_cores_repr
         sibling_group_list = []
         for sibling_group in self.thread_siblings:
             sibling_group_list.append('-'.join(map(str, sibling_group)))
         self.sibling_cores_repr = ' '.join(sibling_group_list)
 
+        # core_types_repr
+        if self.core_types:
+            self.core_types_repr = (f'{self.core_types.count("performance")} performance, '
+                                    f'{self.core_types.count("efficiency")} efficiency')
+        else:
+            self.core_types_repr = ''
+
         # temp_sensor_repr
-        temp_sensor_list = list(psutil.sensors_temperatures())
+        temp_sensor_list = list(self.temp_sensors)
         if self.temp_sensor:
             # Mark used temp sensor with an *
             used_sensor = temp_sensor_list.index(self.temp_sensor)
@@ -139,47 +268,50 @@ class CPUSpecification:
         if self.policies:
             log.info(f'Available policies: {self.policies_repr}')
 
+    @staticmethod
+    def _model_name() -> str:
+        for line in read_text('/proc/cpuinfo').splitlines():
+            if line.startswith('model name'):
+                return line.split(':', 1)[-1].strip()
+        return ''
+
     def _thread_siblings(self) -> list:
         # Physical core / Thread sibling detection#set_cores_online()
         siblings_set = set()
         # Read thread_siblings_list for each virtual cpu
         for core_id in list_cores():
-            thread_siblings_list = Path(f'{CPU_DIR}cpu{core_id}/topology/thread_siblings_list')
+            thread_siblings_list = f'{CPU_DIR}cpu{core_id}/topology/thread_siblings_list'
             # File won't exist if cpu is offline
-            if thread_siblings_list.exists():
+            if exists(thread_siblings_list):
                 # add sibling pair to a set
                 # thread_siblings_list can be formatted as "0,1" or "0-1" (no standard)
-                thread_siblings = re.split('[,-]', thread_siblings_list.read_text().strip())
+                thread_siblings = re.split('[,-]', read_text(thread_siblings_list).strip())
                 siblings = tuple(int(ths) for ths in thread_siblings)
                 siblings_set.add(siblings)
         return sorted(siblings_set)
 
-    def _available_temp_sensor(self) -> str:
-        '''Returns first available sensor in allowed_sensors, or None '''
-        temperature_sensors = psutil.sensors_temperatures()
-        # the order in this list embodies lookup priority
-        allowed_sensors = ['coretemp', 'k10temp', 'zenpower', 'acpitz', 'thinkpad']
-        for sensor in allowed_sensors:
-            if sensor in temperature_sensors:
-                return sensor
-        else:
-            msg = ("Couldn't detect a known CPU temperature sensor."
-                   f"\n\tKnown CPU temp sensors are: {allowed_sensors}"
-                   f"\n\tDetected sensors were: {temperature_sensors}"
-                   "\n\tPlease open an issue at https://www.github.org/haptein/powerplan")
-            log.warning(msg)
-            return None
-
-    def _read_crit_temp(self, temp_sensor: str) -> int:
-        '''Read critical temperature, default to 100 if unavailable'''
+    @staticmethod
+    def _cpufreq_policies() -> dict:
+        '''Returns dict of cpufreq policy name (policyN): related cpu ids, the cpus sharing its settings'''
+        cpufreq_policies = dict()
+        policy_dirs = glob(CPUFREQ_POLICY_DIR + 'policy*')
+        for policy_dir in sorted(policy_dirs, key=lambda policy_dir: int(policy_dir.rsplit('policy', 1)[-1])):
+            related_cpus = read(policy_dir + '/related_cpus').split()
+            cpufreq_policies[os.path.basename(policy_dir)] = tuple(int(cpu_id) for cpu_id in related_cpus)
+        return cpufreq_policies
+
+    def _set_temperature_variables(self):
+        '''Sets: temp_sensors, temp_sensor, temp_sensor_dirs, crit_temp'''
+        temperature_sensors = temperature.detect_sensors()
+        self.temp_sensors = list(temperature_sensors)
+        self.temp_sensor = temperature.preferred_sensor(temperature_sensors)
+        self.temp_sensor_dirs = temperature_sensors.get(self.temp_sensor, [])
+        # Read critical temperature, default to 100 if unavailable
+        self.crit_temp = 100
         if self.temp_sensor is not None:
-            critical_temp = psutil.sensors_temperatures()[self.temp_sensor][0].critical
-            if critical_temp is None:
-                return 100
-            else:
-                return int(critical_temp)
-        else:
-            return 100
+            critical_temp = TemperatureSensor(self.temp_sensor, self.temp_sensor_dirs).critical()
+            if critical_temp is not None:
+                self.crit_temp = critical_temp
 
     def _set_turbo_variables(self):
         '''Sets: turbo_allowed, turbo_file, turbo_inverse'''
@@ -188,23 +320,24 @@ class CPUSpecification:
         turbo_cpufreq = Path(CPU_DIR + 'cpufreq/boost')
         turbo_amd_legacy = Path(CPUFREQ_DIR + 'cpb')
 
-        if turbo_pstate.exists():
+        if exists(turbo_pstate):
             turbo_path = turbo_pstate
             turbo_inverse = True
-        elif turbo_cpufreq.exists():
+        elif exists(turbo_cpufreq):
             turbo_path = turbo_cpufreq
             turbo_inverse = False
-        elif turbo_amd_legacy.exists():
+        elif exists(turbo_amd_legacy):
             turbo_path = turbo_amd_legacy
             turbo_inverse = False
         else:
             turbo_path = None
+            turbo_inverse = False
             turbo_allowed = None
             log.info('Turbo boost is not available.')
 
         if turbo_path is not None:
-            turbo_allowed = path_is_writable(turbo_path)
-            if not turbo_allowed and is_root():
+            turbo_allowed = is_writable(turbo_path)
+            if not turbo_allowed and privileged():
                 log.info('Turbo (boost/core) is disabled on BIOS or not available.')
 
         self.turbo_path = turbo_path
@@ -252,10 +385,10 @@ class RaplLayer:
 
 
 class IntelRapl:
-    def __init__(self):
-        '''If exists and enabled, create RaplLayer objs for each layer found.'''
-        enabled_path = Path('/sys/class/powercap/intel-rapl/enabled')
-        if enabled_path.exists() and is_root():
+    def __init__(self, layer_paths: list):
+        '''If exists and enabled, create RaplLayer objs for each layer in layer_paths.'''
+        enabled_path = Path(RAPL_DIR + 'intel-rapl/enabled')
+        if exists(enabled_path) and privileged():
             self.enabled = read(enabled_path, bool)
         else:
             self.enabled = False
@@ -268,9 +401,8 @@ class IntelRapl:
 
         # If reached this point rapl exists and is enabled
         self.layers = dict()
-        layer_paths = Path('/sys/class/powercap/').glob('intel-rapl:*')
         for layer_path in layer_paths:
-            layer = RaplLayer(layer_path)
+            layer = RaplLayer(Path(layer_path))
             self.layers[layer.name] = layer
 
     def read_power(self, name: str = 'package-0'):
@@ -279,6 +411,12 @@ class IntelRapl:
         else:
             return None
 
+    def read_powers(self) -> dict:
+        '''Returns dict of layer name: power (W), reading every layer's counter back to back'''
+        if not self.enabled:
+            return dict()
+        return {name: layer.read_power() for name, layer in self.layers.items()}
+
 class Cpu:
     '''
     Cpu configuration I/O
@@ -287,14 +425,43 @@ class Cpu:
     rapl, RAPL interface
     a bunch of I/O methods
     '''
-    def __init__(self):
-        self.spec = CPUSpecification()
-        self.rapl = self.get_rapl()
+    def __init__(self, reprobe: bool = False):
+        self.spec = CPUSpecification(reprobe=reprobe)
+        # cpu0 can't go offline, so its cpufreq policy is always active
+        self.cpu0_policy = self.cpufreq_policies([0])[0]
+        self.rapl = self.get_rapl(self.spec)
+        if self.spec.temp_sensor is not None:
+            self.temperature = TemperatureSensor(self.spec.temp_sensor, self.spec.temp_sensor_dirs)
+        else:
+            self.temperature = None
+        self.utilization = UtilizationSampler(list_cores('present'))
+        self.utilization.sample()
+        # Core status lists, only cached if core status changes get notified (enable_core_status_cache)
+        self.core_status_cache = None
 
     # CPU STATUS
     def list_cores(self, status: str = 'present') -> list:
         """list coreid's with status: offline, online, present"""
-        return list_cores(status)
+        if self.core_status_cache is None:
+            return list_cores(status)
+        if status not in self.core_status_cache:
+            self.core_status_cache[status] = list_cores(status)
+        return list(self.core_status_cache[status])
+
+    def enable_core_status_cache(self):
+        '''Caches list_cores results until invalidate_core_status is called'''
+        self.core_status_cache = dict()
+
+    def invalidate_core_status(self):
+        if self.core_status_cache is not None:
+            self.core_status_cache.clear()
+
+    def handle_uevent(self, action: str, uevent: dict):
+        '''Callback for cpu subsystem uevents (hotplug)'''
+        if action in ['add', 'remove', 'online', 'offline']:
+            self.invalidate_core_status()
+        if action in ['add', 'remove']:
+            log.warning(f'CPU {action} detected, restart powerplan to update the CPU topology.')
 
     def read_physical_core_status(self, core_num: int) -> bool:
         assert 0 <= core_num and core_num <= self.spec.physical_cores - 1
@@ -307,146 +474,112 @@ class Cpu:
             # not expecting a case where other processes turn off cores
             return bool(read(CPU_DIR + f'cpu{core_ids[0]}/online', int))
 
-    def set_physical_cores_online(self, num_cores: int):
-        '''Sets the number of online physical cores, turns off the rest'''
-        assert 0 < num_cores and num_cores <= self.spec.physical_cores
-        # Iterate over physical core_num and virtual core siblings
-        for core_num, core_ids in enumerate(self.spec.thread_siblings):
-            core_online = self.read_physical_core_status(core_num)
-            # not <= bc core_num starts from zero
-            if core_num < num_cores:
-                # Set to Online
-                if not core_online:
-                    for core_id in core_ids:
-                        Path(CPU_DIR + f'cpu{core_id}/online').write_text('1')
-            else:
-                # Set to offline
-                if core_online:
-                    for core_id in core_ids:
-                        Path(CPU_DIR + f'cpu{core_id}/online').write_text('0')
-
-    def read_cpu_utilization(self, mode='max'):
-        '''
-        CPU utilization
-        mode : str =  ['avg', 'max', 'all']
-        for mode in ['avg', 'max']
-            returns : float, in range [0.0-100.0]
-        for mode == 'all':
-            returns dict of floats with cpu_id:utilization pairs
-        '''
-        if mode == 'avg':
-            return psutil.cpu_percent()
-        elif mode == 'max':
-            return max(psutil.cpu_percent(percpu=True))
-        elif mode == 'all':
-            # Get online cores and return a dict from cpu_percent(percpu=True)
-            cores_online = list_cores('online')
-            percpu_utilization = psutil.cpu_percent(percpu=True)
-            return dict(zip(cores_online, percpu_utilization))
-
-    def read_temperature(self) -> float:
-        if self.spec.temp_sensor:
-            return psutil.sensors_temperatures()[self.spec.temp_sensor][0].current
+    def write_core_status(self, core_ids, online: bool):
+        '''Writes online status of core_ids without checking current state'''
+        for core_id in core_ids:
+            write(CPU_DIR + f'cpu{core_id}/online', str(int(online)))
+        self.invalidate_core_status()
+
+    def read_temperature(self, source: str = 'package') -> float:
+        '''source: package, max (hottest core) or first, see temperature.TEMP_SOURCES'''
+        if self.temperature is not None and self.temperature.package_input is not None:
+            return self.temperature.read(source)
         else:
             return -1
 
+    def read_core_temperatures(self) -> dict:
+        '''Returns dict of sensor label: temperature of per core sensors'''
+        if self.temperature is not None:
+            return self.temperature.read_cores()
+        else:
+            return dict()
+
     # CPU Freq Scaling
+    # governor, energy performance preference (policy) and frequency range are set per cpufreq
+    # policy, each one shared by its related cpus. Reads default to the cpufreq policy of cpu0.
+
+    def cpufreq_policies(self, core_ids=None) -> list:
+        '''Active cpufreq policies: the ones with any of core_ids (online cores if None) in them'''
+        core_ids = set(self.list_cores('online') if core_ids is None else core_ids)
+        return [name for name, cpus in self.spec.cpufreq_policies.items() if core_ids.intersection(cpus)]
+
+    def read_policy_attribute(self, attribute: str, cpufreq_policy: str = None, dtype=str):
+        return read(CPUFREQ_POLICY_DIR + f'{cpufreq_policy or self.cpu0_policy}/{attribute}', dtype)
 
-    def read_governor(self, core_id: int = 0) -> str:
-        return read(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_governor')
+    def write_policy_attribute(self, attribute: str, value, cpufreq_policies):
+        '''Writes value to cpufreq/policyN/attribute for every cpufreq policy in cpufreq_policies without checking current state'''
+        for cpufreq_policy in cpufreq_policies:
+            write(CPUFREQ_POLICY_DIR + f'{cpufreq_policy}/{attribute}', str(value))
 
-    def set_governor(self, governor):
-        assert governor in self.spec.governors
-        if self.read_governor() != governor:
-            for core_id in list_cores('online'):
-                Path(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_governor').write_text(governor)
+    def read_governor(self, cpufreq_policy: str = None) -> str:
+        return self.read_policy_attribute('scaling_governor', cpufreq_policy)
 
-    def read_policy(self, core_id: int = 0) -> str:
+    def read_policy(self, cpufreq_policy: str = None) -> str:
         if self.spec.policies:
-            return read(CPU_DIR + f'cpu{core_id}/cpufreq/energy_performance_preference')
+            return self.read_policy_attribute('energy_performance_preference', cpufreq_policy)
         else:
             return ''
 
-    def set_policy(self, policy):
-        if self.spec.policies:
-            assert policy in self.spec.policies
-            if policy != self.read_policy():
-                for core_id in list_cores('online'):
-                    Path(CPU_DIR + f'cpu{core_id}/cpufreq/energy_performance_preference').write_text(policy)
-
     def read_current_freq(self) -> dict:
         ''' Returns dict of core_id:cur_freq'''
         cores_online = self.list_cores('online')
-        cpuinfo = Path('/proc/cpuinfo')
-        cur_freqs = [int(float(line.split(':')[-1])) for line in cpuinfo.read_text().splitlines()
+        cur_freqs = [int(float(line.split(':')[-1])) for line in read_text('/proc/cpuinfo').splitlines()
                      if line.startswith('cpu M')]
         return dict(zip(cores_online, cur_freqs))
 
-    def read_freq_range(self, core_id: int = 0) -> list:
-        scaling_min_freq = read(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_min_freq', int)
-        scaling_max_freq = read(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_max_freq', int)
+    def read_freq_range(self, cpufreq_policy: str = None) -> list:
+        scaling_min_freq = self.read_policy_attribute('scaling_min_freq', cpufreq_policy, int)
+        scaling_max_freq = self.read_policy_attribute('scaling_max_freq', cpufreq_policy, int)
         return [scaling_min_freq, scaling_max_freq]
 
-    def set_freq_range(self, min_freq: int, max_freq: int):
-        # Preferred for cpufreq
-        assert min_freq <= max_freq
-        # Write new freq values if different from current
-        current_freq_range = self.read_freq_range()
-        for core_id in self.list_cores('online'):
-            if min_freq != current_freq_range[0]:
-                Path(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_min_freq').write_text(str(min_freq))
-            if max_freq != current_freq_range[1]:
-                Path(CPU_DIR + f'cpu{core_id}/cpufreq/scaling_max_freq').write_text(str(max_freq))
-
     def read_perf_range(self) -> tuple:
         if self.spec.driver == 'intel_pstate':
             return read(self.spec.min_perf_pct, int), read(self.spec.max_perf_pct, int)
 
-    def set_perf_range(self, min_perf_pct: int, max_perf_pct: int):
-        # This setting only exists for intel_pstate
-        assert max_perf_pct >= min_perf_pct
-        if self.spec.driver == 'intel_pstate':
-            current_perf_range = self.read_perf_range()
-            if min_perf_pct != current_perf_range[0]:
-                self.spec.min_perf_pct.write_text(str(min_perf_pct))
-            if max_perf_pct != current_perf_range[1]:
-                self.spec.max_perf_pct.write_text(str(max_perf_pct))
+    def write_perf_pct(self, bound: str, perf_pct: int):
+        '''Writes intel_pstate min_perf_pct or max_perf_pct (bound: min, max)'''
+        assert bound in ['min', 'max']
+        write(self.spec.min_perf_pct if bound == 'min' else self.spec.max_perf_pct, str(perf_pct))
 
     def read_turbo_state(self):
         '''Read existing turbo file and invert value if appropriate (intel_pstate/no_turbo).'''
         if self.spec.turbo_path is None:
             return None
         else:
-            return bool(int(self.spec.turbo_path.read_text())) ^ self.spec.turbo_inverse
+            return bool(read(self.spec.turbo_path, int)) ^ self.spec.turbo_inverse
 
-    def set_turbo_state(self, turbo_state: bool):
-        if self.spec.turbo_allowed and (turbo_state != self.read_turbo_state()):
-            self.spec.turbo_path.write_text(str(int(turbo_state ^ self.spec.turbo_inverse)))
+    def write_turbo_state(self, turbo_state: bool):
+        write(self.spec.turbo_path, str(int(turbo_state ^ self.spec.turbo_inverse)))
 
     # TDP control
 
     @staticmethod
-    def get_rapl():
+    def get_rapl(spec: CPUSpecification):
         ''' Returns an instance of appropriate Rapl Class'''
         # a more generic rapl interface might be needed if AMD enables one
         # if Path('/sys/class/powercap/intel-rapl/enabled').exists():
-        return IntelRapl()
+        return IntelRapl(spec.rapl_layers)
         #  elif amd_pstate's path exists:
         #      return AMDRapl()
 
-    def set_tdp_limits(self, PL1: int, PL2: int):
-        '''
-        Set PL1 and PL2 power limits (intel_pstate)
-        If PL1 or PL2 is zero, this does nothing.
-        '''
-        assert PL1 <= PL2
-        if self.rapl.enabled and PL1 and PL2:
-            PL1_path = Path('/sys/class/powercap/intel-rapl:0/constraint_0_power_limit_uw')
-            PL2_path = PL1_path.with_name('constraint_1_power_limit_uw')
-            if PL1_path.exists() and PL2_path.exists():
-                if PL1 > 0:
-                    PL1_path.write_text(str(PL1*1_000_000))
-                if PL2 > 0:
-                    PL2_path.write_text(str(PL2*1_000_000))
-                if PL1 > 0 or PL2 > 0:
-                    PL1_path.with_name('enabled').write_text('1')
+    def tdp_limit_paths(self) -> tuple:
+        '''Returns PL1 and PL2 power limit paths, or None if unavailable'''
+        PL1_path = Path('/sys/class/powercap/intel-rapl:0/constraint_0_power_limit_uw')
+        PL2_path = PL1_path.with_name('constraint_1_power_limit_uw')
+        if self.rapl.enabled and exists(PL1_path) and exists(PL2_path):
+            return PL1_path, PL2_path
+        else:
+            return None
+
+    def read_tdp_limits(self) -> tuple:
+        '''Returns current PL1 and PL2 power limits in Watt units, or None if unavailable'''
+        paths = self.tdp_limit_paths()
+        if paths is None:
+            return None
+        return tuple(read(path, int) // 1_000_000 for path in paths)
+
+    def write_tdp_limit(self, constraint: int, limit: int):
+        '''Writes power limit (Watt) of constraint (0: PL1, 1: PL2) and enables it'''
+        limit_path = self.tdp_limit_paths()[constraint]
+        write(limit_path, str(limit*1_000_000))
+        write(limit_path.with_name('enabled'), '1')
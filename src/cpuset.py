@@ -0,0 +1,169 @@
+import os
+import errno
+
+import log
+from hardware import ranges_repr
+
+'''
+This module holds the CpusetIsolator class, which moves the processes of a trigger app
+(and their descendants) into a cgroup v2 cpuset partition of dedicated cpus. A partition
+root takes its cpus exclusively from the rest of the hierarchy, so every other process is
+confined to the remaining cpus without touching the cgroups systemd manages.
+'''
+
+CGROUP_ROOT = '/sys/fs/cgroup/'
+PROC_DIR = '/proc/'
+ISOLATED_CGROUP = 'powerplan.isolated'
+
+
+class CpusetIsolator:
+    '''
+    Dedicated cpus for the processes of the triggered profile (see PowerProfile.isolate_cores)
+    root, proc_dir: cgroup v2 mount point and procfs, a fake tree can be used instead
+    origins: cgroup (relative to root) each moved pid came from, where it goes back on release
+    '''
+    def __init__(self, root: str = CGROUP_ROOT, proc_dir: str = PROC_DIR):
+        self.root = root
+        self.proc_dir = proc_dir
+        self.path = os.path.join(root, ISOLATED_CGROUP)
+        self.cpus = ()
+        self.origins = dict()
+        self.disabled = False
+
+    def available(self) -> bool:
+        '''Whether root is a cgroup v2 hierarchy with the cpuset controller'''
+        try:
+            return 'cpuset' in self._read(os.path.join(self.root, 'cgroup.controllers')).split()
+        except OSError:
+            return False
+
+    def active(self) -> bool:
+        return bool(self.cpus)
+
+    def update(self, cpus: tuple, pids: list):
+        '''
+        Confines pids and their descendants to cpus, releases the partition if either is empty
+        Only pids outside the partition get their descendants looked up, later forks inherit the cgroup
+        '''
+        if not cpus or not pids:
+            if self.active():
+                self.release()
+            return
+        if self.disabled:
+            return
+        try:
+            if not self.active():
+                self._create(cpus)
+            elif tuple(cpus) != self.cpus:
+                self._write(os.path.join(self.path, 'cpuset.cpus'), ranges_repr(cpus))
+                self.cpus = tuple(cpus)
+            new_pids = [pid for pid in pids if self._cgroup_of(pid) not in (None, '/' + ISOLATED_CGROUP)]
+            if new_pids:
+                self._move(self._with_descendants(new_pids))
+        except OSError as err:
+            log.warning(f'Could not isolate trigger application on cpus {ranges_repr(cpus)}: {err}')
+            self.release()
+            self.disabled = True
+
+    def _create(self, cpus: tuple):
+        if not self.available():
+            raise OSError(errno.ENOTSUP, 'cgroup v2 cpuset controller unavailable', self.root)
+        subtree_control = os.path.join(self.root, 'cgroup.subtree_control')
+        if 'cpuset' not in self._read(subtree_control).split():
+            self._write(subtree_control, '+cpuset')
+        os.makedirs(self.path, exist_ok=True)
+        self._write(os.path.join(self.path, 'cpuset.cpus'), ranges_repr(cpus))
+        self._write(os.path.join(self.path, 'cpuset.cpus.partition'), 'root')
+        self.cpus = tuple(cpus)
+        # The kernel reports why a partition couldn't be made, ie. "root invalid (...)"
+        partition = self._read(os.path.join(self.path, 'cpuset.cpus.partition')).strip()
+        if partition != 'root':
+            raise OSError(errno.EINVAL, f'cpuset partition is {partition}', self.path)
+        log.info(f'Isolating trigger application on cpus {ranges_repr(cpus)}.')
+
+    def _move(self, pids: list):
+        procs = os.path.join(self.path, 'cgroup.procs')
+        for pid in pids:
+            origin = self._cgroup_of(pid)
+            if origin is None or origin == '/' + ISOLATED_CGROUP:
+                continue
+            try:
+                self._write(procs, str(pid))
+            except ProcessLookupError:
+                continue
+            except OSError as err:
+                if err.errno == errno.ESRCH:
+                    continue
+                raise
+            self.origins[pid] = origin
+
+    def release(self):
+        '''Moves the remaining processes back to their cgroups and removes the partition'''
+        if not os.path.isdir(self.path):
+            self.cpus = ()
+            self.origins.clear()
+            return
+        try:
+            remaining = [int(pid) for pid in self._read(os.path.join(self.path, 'cgroup.procs')).split()]
+        except OSError:
+            remaining = []
+        for pid in remaining:
+            # Descendants forked after the move go where their ancestor came from
+            origin = self.origins.get(pid, next(iter(self.origins.values()), '/'))
+            for cgroup in (origin, '/'):
+                try:
+                    self._write(os.path.join(self.root, cgroup.lstrip('/'), 'cgroup.procs'), str(pid))
+                    break
+                except OSError:
+                    continue
+        try:
+            self._write(os.path.join(self.path, 'cpuset.cpus.partition'), 'member')
+            os.rmdir(self.path)
+            log.info('Trigger application isolation released.')
+        except OSError as err:
+            log.warning(f'Could not remove {self.path}: {err}')
+        self.cpus = ()
+        self.origins.clear()
+
+    # procfs
+    def _cgroup_of(self, pid: int) -> str:
+        '''cgroup v2 path of pid, None if it exited'''
+        try:
+            for line in self._read(os.path.join(self.proc_dir, str(pid), 'cgroup')).splitlines():
+                if line.startswith('0::'):
+                    return line[3:]
+        except OSError:
+            return None
+        return None
+
+    def _with_descendants(self, pids: list) -> list:
+        '''pids plus every process descending from them, parents first'''
+        children = dict()
+        for name in os.listdir(self.proc_dir):
+            if not name.isdigit():
+                continue
+            try:
+                stat = self._read(os.path.join(self.proc_dir, name, 'stat'))
+            except OSError:
+                continue
+            # comm can contain spaces and parentheses, ppid is the second field after it
+            ppid = int(stat.rsplit(')', 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(name))
+        found = list(pids)
+        seen = set(found)
+        for pid in found:
+            for child in children.get(pid, ()):
+                if child not in seen:
+                    seen.add(child)
+                    found.append(child)
+        return found
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path, 'r') as file:
+            return file.read()
+
+    @staticmethod
+    def _write(path: str, value: str):
+        with open(path, 'w') as file:
+            file.write(value)
@@ -0,0 +1,359 @@
+import signal
+import asyncio
+
+import psutil
+
+import log
+import monitor
+import process
+import uevent
+import instance
+import thermal
+import workload
+import scheduler
+import telemetry
+import profiling
+import metrics
+import snapshot
+import cpuset
+import systemstatus
+from __init__ import __version__
+from config import read_profiles
+
+'''
+This module holds the Daemon class, the asyncio core of the main loop. Every data source
+runs on its own cadence, publishing its fields into SystemStatus: the process scan and
+utilization on the (backed off) polling period, the temperature every TEMPERATURE_PERIOD
+while the thermal controller is engaged, ac_power on power supply uevents (polled without
+netlink, inotify never reports sysfs value changes). Uevents and process events are file
+descriptor readers of the same loop, the control and metrics sockets asyncio servers on it,
+and profile application is a reactive task woken by the changes, no threads.
+'''
+
+# Seconds between temperature reads while the thermal controller is engaged (near templimit)
+TEMPERATURE_PERIOD = 0.25
+# Seconds between fallback ac_power reads, when power supply uevents arrive over netlink
+POWER_PERIOD = 30
+# Seconds process events are batched for, so fork storms don't wake the loop for each one
+PROCESS_EVENT_DELAY = 0.05
+
+
+async def sleep_until(event: asyncio.Event, timeout: float) -> bool:
+    '''Sleeps up to timeout seconds (monotonic), returns True if event was set earlier, clearing it'''
+    try:
+        await asyncio.wait_for(event.wait(), max(timeout, 0))
+    except asyncio.TimeoutError:
+        return False
+    event.clear()
+    return True
+
+
+class Daemon:
+    '''
+    Runs the daemon on an asyncio event loop
+    args: parsed command line arguments (status, persistent, reload, record, metrics, profile_daemon, debug)
+    Sources flag what changed (switched, reapply, verify) and wake the apply task, which applies
+    the triggered profile once for all of them. The poll task also asks it for a status report.
+    '''
+    def __init__(self, system: systemstatus.System, args):
+        self.system = system
+        self.args = args
+        self.profiles = read_profiles(system)
+        self.event_source = process.default_event_source()
+        self.status = systemstatus.StatusDaemon(system, self.profiles, event_source=self.event_source)
+
+        # Burst detection, only sampled when a profile enables bat_boost
+        self.workload_governor = workload.WorkloadGovernor()
+        # Holds the profile's templimit
+        self.thermal_controller = thermal.ThermalController(system.cpu)
+        # Polling period, backing off while nothing changes
+        self.loop_scheduler = scheduler.Scheduler()
+
+        # Power supply changes and cpu hotplug
+        self.listener = uevent.UeventListener()
+        if self.listener.netlink:
+            system.cpu.enable_core_status_cache()
+        self.listener.subscribe('cpu', system.cpu.handle_uevent)
+        self.listener.subscribe('cpu', system.applier.handle_uevent)
+        self.listener.subscribe('power_supply', lambda action, properties: self._update_power())
+
+        # Per field and per application step timings
+        if args.profile_daemon:
+            self.profiler = profiling.Profiler()
+            self.status.enable_profiling(self.profiler)
+            system.applier.enable_profiling(self.profiler)
+        else:
+            self.profiler = None
+
+        # Streams status fields into telemetry segments every poll
+        self.recorder = telemetry.TelemetryRecorder() if args.record else None
+
+        # Metrics are rendered from the latest status values, scrapes don't read sysfs
+        self.counters = dict(profile_switches=0)
+        if args.metrics:
+            self.metrics_server = metrics.MetricsServer(
+                args.metrics, lambda: metrics.render(self.status, system.applier, self.counters))
+        else:
+            self.metrics_server = None
+
+        # Dedicated cpus for the trigger apps of profiles with isolate_cores
+        self.isolator = cpuset.CpusetIsolator()
+        # Leftovers of a killed instance
+        self.isolator.release()
+
+        # Status snapshots for monitor clients, published while one holds a lease
+        self.snapshot_writer = snapshot.SnapshotWriter(max_cpus=max(system.cpu.list_cores('present')) + 1)
+
+        # Control socket, lets other instances find and query this one
+        self.control_server = instance.ControlServer(info=dict(version=__version__,
+                                                               mode='status' if args.status else 'daemon',
+                                                               persistent=args.persistent))
+        self.control_server.register('snapshot', self.snapshot_writer.lease)
+        if self.profiler is not None:
+            self.control_server.register('profile', lambda request: self.profiler.stats())
+
+        self.renderer = monitor.StatusRenderer(system, monitor_mode=False) if args.status else None
+        self.running_process = psutil.Process() if args.debug else None
+
+        # Profile name and ac_power last applied
+        self.applied = None
+        # Set by sources, cleared by the apply task
+        self.reapply = False
+        self.log_apply = False
+        self.verify = False
+        self.report_due = False
+        # Something changed since the last poll, the polling period snaps back
+        self.activity = True
+        # Set in run, the events belong to its loop
+        self.loop = None
+        self.wake_apply = None
+        self.wake_poll = None
+
+    # Sources
+    def _profile(self):
+        return self.status['triggered_profile']
+
+    def _pollingperiod(self) -> float:
+        '''Polling period (s) of the triggered profile, without back off'''
+        prefix = 'ac_' if self.status['ac_power'] else 'bat_'
+        return getattr(self._profile(), prefix + 'pollingperiod') / 1000
+
+    def _utilization_needed(self) -> bool:
+        '''cpu_util_avg feeds the workload governor and the polling period back off'''
+        profile = self._profile()
+        return (any(other.bat_boost for other in self.profiles.values())
+                or profile.ac_pollingperiod_max > profile.ac_pollingperiod
+                or profile.bat_pollingperiod_max > profile.bat_pollingperiod)
+
+    def _notify(self, poll: bool = False):
+        '''Wakes the apply task and snaps back the polling period, poll: wakes the poll task right away too'''
+        self.activity = True
+        self.wake_apply.set()
+        if poll:
+            self.wake_poll.set()
+
+    def _update_processes(self):
+        self.status.partial_update(['triggered_profile'])
+        if self.status.changed(['triggered_profile']):
+            self._notify(poll=True)
+        else:
+            # New processes of the same profile may need isolating
+            self.wake_apply.set()
+
+    def _update_power(self):
+        self.status.partial_update(['ac_power'])
+        if self.status.changed(['ac_power']):
+            self._notify(poll=True)
+
+    def _update_utilization(self):
+        if not self._utilization_needed():
+            return
+        self.status.partial_update(['cpu_util_avg'])
+        self.workload_governor.update(self._profile(), self.status)
+        if self.workload_governor.changed:
+            self.reapply = self.log_apply = True
+            self._notify()
+        elif scheduler.load_changed(self.status):
+            self.activity = True
+
+    def _update_temperature(self) -> bool:
+        '''Steps the thermal controller, returns whether it's engaged'''
+        profile = self._profile()
+        ac_power = self.status['ac_power']
+        if self.thermal_controller.active(profile, ac_power):
+            self.status.partial_update(['temperature'])
+        # An inactive controller lifts its cap
+        if self.thermal_controller.update(profile, self.status):
+            self.reapply = True
+            self._notify()
+        return self.thermal_controller.engaged(profile, ac_power)
+
+    def _process_events_ready(self):
+        '''Process events fd reader, events get handled PROCESS_EVENT_DELAY later in one batch'''
+        self.loop.remove_reader(self.event_source.fileno())
+        self.loop.call_later(PROCESS_EVENT_DELAY, self._handle_process_events)
+
+    def _handle_process_events(self):
+        self._update_processes()
+        self.loop.add_reader(self.event_source.fileno(), self._process_events_ready)
+
+    # Tasks
+    async def _poll_task(self):
+        '''Processes (reconciliation only, with process events), hot reloading, persistent and reports'''
+        while True:
+            self.loop_scheduler.start_iteration()
+            if self.args.reload:  # profile hot-reloading
+                self.profiles = read_profiles(self.system)
+                self.status.reset(self.profiles)
+            self._update_processes()
+            if not self.listener.netlink:
+                self._update_power()
+            if self.args.persistent:
+                self.verify = True
+            self.report_due = True
+            self.wake_apply.set()
+
+            # Active boosts, thermal caps and monitor clients need the short period
+            changed = (self.activity or self.args.status
+                       or self.workload_governor.state() in ['pending', 'boosted']
+                       or self.thermal_controller.step != 0 or self.snapshot_writer.leased())
+            self.activity = False
+            # Changes found by this poll are already handled
+            self.wake_poll.clear()
+            self.loop_scheduler.schedule(self._profile(), self.status['ac_power'], changed)
+            await sleep_until(self.wake_poll, self.loop_scheduler.remaining())
+
+    async def _utilization_task(self):
+        '''Sampled on the poll task's current period, but on its own timer'''
+        while True:
+            self._update_utilization()
+            await asyncio.sleep(self.loop_scheduler.period or self._pollingperiod())
+
+    async def _temperature_task(self):
+        while True:
+            engaged = self._update_temperature()
+            await asyncio.sleep(TEMPERATURE_PERIOD if engaged else self._pollingperiod())
+
+    async def _power_task(self):
+        '''Fallback in case a power supply uevent is missed, without netlink the poll task reads ac_power'''
+        while True:
+            await asyncio.sleep(POWER_PERIOD)
+            self._update_power()
+
+    async def _apply_task(self):
+        while True:
+            await self.wake_apply.wait()
+            self.wake_apply.clear()
+            self._apply()
+            if self.report_due:
+                self.report_due = False
+                self._report()
+
+    # Profile application
+    def _apply(self):
+        status = self.status
+        profile = self._profile()
+        ac_power = status['ac_power']
+        if (profile.name, ac_power) != self.applied:
+            # Limits and caps of the previous profile don't carry over
+            if ac_power or not profile.bat_boost:
+                self.workload_governor.reset()
+            self._update_temperature()
+            # Log only on changes, even if --persistent is used (to avoid flooding journal)
+            log.info(f'Applying profile: {profile.name}-{"AC" if ac_power else "Battery"}')
+            self.counters['profile_switches'] += 1
+            profile.apply(status, boosted=self.workload_governor.boosted, thermal=self.thermal_controller)
+            self.system.applier.log_summary()
+            self.applied = (profile.name, ac_power)
+        elif self.reapply:
+            profile.apply(status, boosted=self.workload_governor.boosted, thermal=self.thermal_controller)
+            if self.log_apply:
+                self.system.applier.log_summary()
+        elif self.verify:
+            profile.apply(status, verify=True, boosted=self.workload_governor.boosted,
+                          thermal=self.thermal_controller)
+        self.reapply = self.log_apply = self.verify = False
+        # Moves new trigger app processes in, released once the profile isn't triggered anymore
+        self.isolator.update(profile.isolated_cpus[bool(ac_power)], status.process_reader.trigger_pids(profile))
+
+    def _report(self):
+        '''Updates the rest of fields to display/record/publish the status after the profile has been applied'''
+        status = self.status
+        profile = self._profile()
+        if not (self.renderer or self.recorder or self.metrics_server or self.snapshot_writer.leased()):
+            return
+        # Sources keep their own fields up to date
+        live = ['triggered_profile', 'ac_power']
+        if self._utilization_needed():
+            live.append('cpu_util_avg')
+        if self.thermal_controller.active(profile, status['ac_power']):
+            live.append('temperature')
+        status.partial_update([field for field in status.history if field not in live])
+
+        workload_state = self.workload_governor.state() if profile.bat_boost else ''
+        if self.renderer is not None:
+            self.renderer.render(status, workload_state)
+        if self.recorder is not None:
+            self.recorder.record(status)
+        if self.snapshot_writer.leased():
+            self.snapshot_writer.publish(status, workload_state)
+        if self.args.debug:
+            monitor.debug_runtime_info(self.running_process, profile, self.loop_scheduler.iteration_start,
+                                       self.system.applier, self.loop_scheduler)
+            if self.profiler is not None:
+                print(self.profiler.report())
+
+    # Event loop
+    async def run(self):
+        '''Runs until SIGTERM or SIGINT, or until a task fails'''
+        # get_event_loop, not get_running_loop, which needs python 3.7
+        loop = self.loop = asyncio.get_event_loop()
+        self.wake_apply = asyncio.Event()
+        self.wake_poll = asyncio.Event()
+        stop = loop.create_future()
+        # Ctrl+C too, a KeyboardInterrupt would skip the cleanup below
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+        servers = [self.control_server]
+        if self.metrics_server is not None:
+            servers.append(self.metrics_server)
+        for server in servers:
+            await server.start()
+        readers = []
+        if self.listener.fileno() is not None:
+            readers.append((self.listener.fileno(), self.listener.dispatch))
+        if self.event_source is not None and self.event_source.fileno() is not None:
+            readers.append((self.event_source.fileno(), self._process_events_ready))
+        for fd, callback in readers:
+            loop.add_reader(fd, callback)
+
+        # Sources go first, so the first report has their fields, they need these two
+        self.status.partial_update(['ac_power', 'triggered_profile'])
+        coroutines = [self._utilization_task(), self._temperature_task(), self._poll_task(), self._apply_task()]
+        if self.listener.netlink:
+            coroutines.append(self._power_task())
+        tasks = [loop.create_task(coroutine) for coroutine in coroutines]
+        try:
+            done, _ = await asyncio.wait(tasks + [stop], return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Reaped here, run_until_complete leaves cancelled tasks pending
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for fd, _ in readers:
+                loop.remove_reader(fd)
+            for server in servers:
+                server.close()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            self.close()
+
+    def close(self):
+        self.isolator.release()
+        if self.renderer is not None:
+            self.renderer.close()
+        if self.profiler is not None:
+            print(self.profiler.report())
@@ -0,0 +1,608 @@
+import os
+import time
+import errno
+import glob as globmodule
+from fnmatch import fnmatchcase
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import shell
+
+'''
+This module holds the hardware backends, every sysfs/procfs access in cpu, powersupply
+and process goes through the active one (module level functions below).
+RealBackend talks to the kernel, SimulatedBackend synthesizes a machine in memory.
+'''
+
+
+class Backend(ABC):
+    '''
+    Interface of hardware backends, paths can be str or Path
+    cache_dir: where probed hardware specifications can be cached, None disables caching
+    '''
+    cache_dir = None
+
+    @abstractmethod
+    def read(self, path) -> str:
+        '''Returns contents of an attribute (frequently read, may be cached)'''
+        pass
+
+    @abstractmethod
+    def read_text(self, path) -> str:
+        '''Returns whole contents of a file (one-off or large reads, never cached)'''
+        pass
+
+    @abstractmethod
+    def write(self, path, value: str):
+        pass
+
+    @abstractmethod
+    def exists(self, path) -> bool:
+        pass
+
+    @abstractmethod
+    def glob(self, pattern: str) -> list:
+        '''Returns sorted list of path strings matching pattern'''
+        pass
+
+    @abstractmethod
+    def readlink(self, path) -> str:
+        pass
+
+    @abstractmethod
+    def is_writable(self, path) -> bool:
+        pass
+
+    @abstractmethod
+    def privileged(self) -> bool:
+        '''Whether privileged interfaces (hotplug, rapl, ...) can be used'''
+        pass
+
+
+class RealBackend(Backend):
+    cache_dir = '/var/cache/powerplan/'
+
+    def read(self, path) -> str:
+        return shell.attribute_cache.read(path)
+
+    def read_text(self, path) -> str:
+        with open(path, 'r') as file:
+            return file.read()
+
+    def write(self, path, value: str):
+        shell.attribute_cache.write(path, value)
+
+    def exists(self, path) -> bool:
+        return os.path.exists(path)
+
+    def glob(self, pattern: str) -> list:
+        return sorted(globmodule.glob(pattern))
+
+    def readlink(self, path) -> str:
+        return os.readlink(path)
+
+    def is_writable(self, path) -> bool:
+        try:
+            self.write(path, self.read(path).strip())
+        except PermissionError:
+            return False
+        else:
+            return True
+
+    def privileged(self) -> bool:
+        return shell.is_root()
+
+
+def ranges_repr(ids) -> str:
+    '''Formats ids as a kernel cpu list (ie. "0-3,6")'''
+    ids = sorted(ids)
+    ranges = []
+    start = previous = None
+    for i in ids + [None]:
+        if start is not None and (i is None or i != previous + 1):
+            ranges.append(str(start) if start == previous else f'{start}-{previous}')
+            start = None
+        if start is None:
+            start = i
+        previous = i
+    return ','.join(ranges)
+
+
+class SimulatedBackend(Backend):
+    '''
+    In-memory sysfs/procfs of a synthetic machine
+    physical_cores, smt: topology, thread siblings are (n, n + physical_cores, ...) like on intel
+    driver: intel_pstate or acpi-cpufreq
+    cpus_per_policy: logical cpus sharing each cpufreq policy (consecutive cpu ids)
+    efficiency_cores: number of (last) physical cores that are intel hybrid E-cores, with a lower max frequency
+    packages: number of packages (sockets) the physical cores are evenly split into
+    cores_per_llc: physical cores sharing each L3 cache (like an AMD CCX), 0 for one L3 per package
+    battery: whether an AC adapter and battery are present
+    discharge_curve: callable(seconds since start) -> battery power draw (W), or a constant
+    rapl: whether intel-rapl layers exist, rapl_offset sets the initial counter to test wraps
+    processes: number of fake processes
+    clock: time source for counters, batteries, etc.
+    '''
+    CPU_DIR = '/sys/devices/system/cpu/'
+    RAPL_DIR = '/sys/class/powercap/'
+    POWER_SUPPLY_DIR = '/sys/class/power_supply/'
+
+    def __init__(self, physical_cores: int = 4, smt: int = 2, driver: str = 'intel_pstate', cpus_per_policy: int = 1,
+                 efficiency_cores: int = 0, packages: int = 1, cores_per_llc: int = 0,
+                 model_name: str = 'Simulated CPU', minfreq: int = 400_000, basefreq: int = 2_000_000,
+                 maxfreq: int = 4_000_000, battery: bool = True, ac_online: bool = True,
+                 battery_capacity: float = 50.0, discharge_curve=8.0, charge_power: float = 30.0,
+                 rapl: bool = True, package_power: float = 15.0, rapl_offset: int = 0,
+                 max_energy_range_uj: int = 262_143_328_850, processes: int = 1000, clock=time.monotonic):
+        assert driver in ['intel_pstate', 'acpi-cpufreq']
+        self.files = dict()                   # path: (getter, setter)
+        self.children = defaultdict(set)      # dir path: names
+        self.clock = clock
+        self.start_time = clock()
+
+        self.physical_cores = physical_cores
+        self.smt = smt
+        self.driver = driver
+        self.cpus_per_policy = cpus_per_policy
+        self.efficiency_cores = efficiency_cores
+        self.packages = packages
+        self.cores_per_llc = cores_per_llc
+        self.model_name = model_name
+        self.minfreq, self.basefreq, self.maxfreq = minfreq, basefreq, maxfreq
+        self.cpus = dict()
+        self._build_cpus()
+
+        self.package_power = package_power if rapl else 0.0
+        self._build_hwmon()
+
+        if rapl:
+            self.rapl_offset = rapl_offset
+            self.max_energy_range_uj = max_energy_range_uj
+            self._build_rapl()
+
+        if battery:
+            self.ac_online = ac_online
+            self.battery_capacity = battery_capacity  # Wh
+            self.battery_energy = battery_capacity    # Wh
+            self.charge_power = charge_power
+            self.discharge_curve = discharge_curve if callable(discharge_curve) else lambda t: discharge_curve
+            self.battery_time = clock()
+            self._build_power_supply()
+
+        self.pids = dict()
+        self.next_pid = 1000
+        for i in range(processes):
+            self.spawn(f'proc{i % 256}')
+
+    # Filesystem
+    def add(self, path: str, getter, setter=None):
+        '''Adds an attribute, getter can be a str for static values'''
+        if isinstance(getter, str):
+            value = getter
+            getter = lambda: value
+        self.files[path] = (getter, setter)
+        parent, name = path.rsplit('/', 1)
+        while parent:
+            self.children[parent].add(name)
+            parent, name = parent.rsplit('/', 1)
+        self.children['/'].add(name)
+
+    def remove(self, prefix: str):
+        '''Removes every attribute under prefix (a file or dir path)'''
+        for path in [path for path in self.files if path == prefix or path.startswith(prefix + '/')]:
+            del self.files[path]
+            parent, name = path.rsplit('/', 1)
+            # Prune empty dirs
+            while parent:
+                self.children[parent].discard(name)
+                if self.children[parent]:
+                    break
+                del self.children[parent]
+                parent, name = parent.rsplit('/', 1)
+
+    def _lookup(self, path) -> tuple:
+        path = os.fspath(path)
+        if path not in self.files:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return path, self.files[path]
+
+    def read(self, path) -> str:
+        path, (getter, _) = self._lookup(path)
+        return getter() + '\n'
+
+    read_text = read
+
+    def readlink(self, path) -> str:
+        '''Symlinks are attributes whose value is the target'''
+        path, (getter, _) = self._lookup(path)
+        return getter()
+
+    def write(self, path, value: str):
+        path, (_, setter) = self._lookup(path)
+        if setter is None:
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), path)
+        setter(str(value).strip())
+
+    def exists(self, path) -> bool:
+        path = os.fspath(path).rstrip('/') or '/'
+        return path in self.files or path in self.children
+
+    def glob(self, pattern: str) -> list:
+        matches = ['']
+        for part in pattern.strip('/').split('/'):
+            matched = []
+            for base in matches:
+                children = self.children.get(base or '/', ())
+                if globmodule.has_magic(part):
+                    matched.extend(f'{base}/{child}' for child in children if fnmatchcase(child, part))
+                elif part in children:
+                    matched.append(f'{base}/{part}')
+            matches = matched
+        return sorted(matches)
+
+    def is_writable(self, path) -> bool:
+        return self.exists(path) and self.files[os.fspath(path)][1] is not None
+
+    def privileged(self) -> bool:
+        return True
+
+    @staticmethod
+    def _invalid(path):
+        raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+
+    def elapsed(self) -> float:
+        return self.clock() - self.start_time
+
+    # CPU
+    def _build_cpus(self):
+        logical_cores = self.physical_cores * self.smt
+        self.governors = ['performance', 'powersave'] if self.driver == 'intel_pstate' else \
+            ['conservative', 'ondemand', 'userspace', 'powersave', 'performance', 'schedutil']
+        self.policies = ['default', 'performance', 'balance_performance', 'balance_power', 'power'] \
+            if self.driver == 'intel_pstate' else []
+        # cpufreq policies, named after their first cpu
+        self.cpufreq_policies = dict()
+        for policy_id in range(0, logical_cores, self.cpus_per_policy):
+            self.cpufreq_policies[policy_id] = dict(
+                cpus=list(range(policy_id, min(policy_id + self.cpus_per_policy, logical_cores))),
+                governor='powersave' if self.driver == 'intel_pstate' else 'schedutil',
+                policy='balance_performance',
+                min_freq=self.minfreq,
+                max_freq=self.maxfreq
+            )
+        for cpu_id in range(logical_cores):
+            core_num = cpu_id % self.physical_cores
+            self.cpus[cpu_id] = dict(
+                online=True,
+                siblings=[core_num + thread * self.physical_cores for thread in range(self.smt)],
+                policy_id=cpu_id - cpu_id % self.cpus_per_policy,
+                efficiency=core_num >= self.physical_cores - self.efficiency_cores,
+                # fraction of time busy, and of that, iowait
+                load=0.2,
+                iowait=0.01
+            )
+
+        cpu_dir = self.CPU_DIR
+        cpu_list = lambda online: ranges_repr([i for i in self.cpus if self.cpus[i]['online'] == online])
+        self.add(cpu_dir + 'present', ranges_repr(self.cpus))
+        self.add(cpu_dir + 'possible', ranges_repr(self.cpus))
+        self.add(cpu_dir + 'online', lambda: cpu_list(True))
+        self.add(cpu_dir + 'offline', lambda: cpu_list(False))
+        self.add('/proc/cpuinfo', self._cpuinfo)
+        self.add('/proc/stat', self._stat)
+        self.add('/proc/sys/kernel/random/boot_id', '00000000-0000-0000-0000-000000000000')
+        self.add('/proc/sys/kernel/osrelease', 'simulated')
+
+        if self.efficiency_cores:
+            core_type_cpus = lambda efficiency: ranges_repr([i for i in self.cpus if self.cpus[i]['efficiency'] == efficiency])
+            self.add('/sys/devices/cpu_core/cpus', core_type_cpus(False))
+            self.add('/sys/devices/cpu_atom/cpus', core_type_cpus(True))
+
+        for cpu_id in self.cpus:
+            if cpu_id != 0:
+                self.add(cpu_dir + f'cpu{cpu_id}/online', self._online_getter(cpu_id), self._online_setter(cpu_id))
+            self._add_cpu_attributes(cpu_id)
+
+        if self.driver == 'intel_pstate':
+            self.no_turbo = 0
+            self.min_perf_pct = 10
+            self.max_perf_pct = 100
+            pstate_dir = cpu_dir + 'intel_pstate/'
+            self.add(pstate_dir + 'status', 'active')
+            self.add(pstate_dir + 'no_turbo', lambda: str(self.no_turbo), self._attribute_setter('no_turbo', [0, 1]))
+            self.add(pstate_dir + 'min_perf_pct', lambda: str(self.min_perf_pct),
+                     self._attribute_setter('min_perf_pct', range(1, 101)))
+            self.add(pstate_dir + 'max_perf_pct', lambda: str(self.max_perf_pct),
+                     self._attribute_setter('max_perf_pct', range(1, 101)))
+        else:
+            self.boost = 1
+            self.add(cpu_dir + 'cpufreq/boost', lambda: str(self.boost), self._attribute_setter('boost', [0, 1]))
+
+    def _attribute_setter(self, name: str, allowed):
+        def setter(value: str):
+            if not value.isdigit() or int(value) not in allowed:
+                self._invalid(name)
+            setattr(self, name, int(value))
+        return setter
+
+    def _online_getter(self, cpu_id: int):
+        return lambda: str(int(self.cpus[cpu_id]['online']))
+
+    def _online_setter(self, cpu_id: int):
+        def setter(value: str):
+            if value not in ['0', '1']:
+                self._invalid(f'cpu{cpu_id}/online')
+            online = value == '1'
+            if online != self.cpus[cpu_id]['online']:
+                self.cpus[cpu_id]['online'] = online
+                if online:
+                    self._add_cpu_attributes(cpu_id)
+                else:
+                    # cpufreq and topology dirs go away on offline cpus
+                    self.remove(self.CPU_DIR + f'cpu{cpu_id}/cpufreq')
+                    self.remove(self.CPU_DIR + f'cpu{cpu_id}/topology')
+                    self.remove(self.CPU_DIR + f'cpu{cpu_id}/cache')
+                    policy_id = self.cpus[cpu_id]['policy_id']
+                    if not self._affected_cpus(policy_id):
+                        self.remove(self.CPU_DIR + f'cpufreq/policy{policy_id}')
+        return setter
+
+    def _domains(self, cpu_id: int) -> tuple:
+        '''(package, llc, cluster) of cpu_id, E-cores come in clusters of four'''
+        core_num = cpu_id % self.physical_cores
+        package = core_num * self.packages // self.physical_cores
+        llc = core_num // self.cores_per_llc if self.cores_per_llc else package
+        e_core_num = core_num - (self.physical_cores - self.efficiency_cores)
+        cluster = self.physical_cores + e_core_num // 4 if self.cpus[cpu_id]['efficiency'] else core_num
+        return package, llc, cluster
+
+    def _affected_cpus(self, policy_id: int) -> list:
+        return [cpu_id for cpu_id in self.cpufreq_policies[policy_id]['cpus'] if self.cpus[cpu_id]['online']]
+
+    def _add_cpu_attributes(self, cpu_id: int):
+        cpu = self.cpus[cpu_id]
+        policy_id = cpu['policy_id']
+        policy = self.cpufreq_policies[policy_id]
+        topology_dir = self.CPU_DIR + f'cpu{cpu_id}/topology/'
+        self.add(topology_dir + 'thread_siblings_list', ranges_repr(cpu['siblings']))
+        self.add(topology_dir + 'core_id', str(cpu_id % self.physical_cores))
+        self.add(topology_dir + 'physical_package_id', str(self._domains(cpu_id)[0]))
+        self.add(topology_dir + 'die_id', '0')
+        self.add(topology_dir + 'cluster_id', str(self._domains(cpu_id)[2]))
+        sharing = lambda level: ranges_repr([i for i in self.cpus if self._domains(i)[level] == self._domains(cpu_id)[level]])
+        self.add(topology_dir + 'cluster_cpus_list', sharing(2))
+        self.add(self.CPU_DIR + f'cpu{cpu_id}/cache/index3/level', '3')
+        self.add(self.CPU_DIR + f'cpu{cpu_id}/cache/index3/shared_cpu_list', sharing(1))
+
+        def cpufreq_setter(key, check):
+            def setter(value: str):
+                if not check(value):
+                    self._invalid(key)
+                policy[key] = int(value) if key.endswith('freq') else value
+            return setter
+
+        is_freq = lambda value: value.isdigit() and self.minfreq <= int(value) <= self.maxfreq
+        attributes = dict(
+            cpuinfo_min_freq=(str(self.minfreq), None),
+            cpuinfo_max_freq=(str(self.maxfreq * 3 // 4 if cpu['efficiency'] else self.maxfreq), None),
+            scaling_driver=(self.driver, None),
+            affected_cpus=(lambda: ' '.join(map(str, self._affected_cpus(policy_id))), None),
+            related_cpus=(' '.join(map(str, policy['cpus'])), None),
+            scaling_available_governors=(' '.join(self.governors), None),
+            scaling_governor=(lambda: policy['governor'],
+                              cpufreq_setter('governor', lambda value: value in self.governors)),
+            scaling_min_freq=(lambda: str(policy['min_freq']), cpufreq_setter('min_freq', is_freq)),
+            scaling_max_freq=(lambda: str(policy['max_freq']), cpufreq_setter('max_freq', is_freq)),
+            scaling_cur_freq=(lambda: str(self._cur_freq(policy_id)), None),
+        )
+        if self.driver == 'intel_pstate':
+            attributes.update(
+                base_frequency=(str(self.basefreq), None),
+                energy_performance_available_preferences=(' '.join(self.policies), None),
+                energy_performance_preference=(lambda: policy['policy'],
+                                               cpufreq_setter('policy', lambda value: value in self.policies)),
+            )
+        for name, (getter, setter) in attributes.items():
+            # cpuN/cpufreq is a symlink to the cpufreq/policyN dir of its policy
+            self.add(self.CPU_DIR + f'cpu{cpu_id}/cpufreq/{name}', getter, setter)
+            self.add(self.CPU_DIR + f'cpufreq/policy{policy_id}/{name}', getter, setter)
+
+    def _cur_freq(self, policy_id: int) -> int:
+        policy = self.cpufreq_policies[policy_id]
+        return (policy['min_freq'] + policy['max_freq']) // 2
+
+    def _cpuinfo(self) -> str:
+        entries = []
+        for cpu_id, cpu in self.cpus.items():
+            if cpu['online']:
+                entries.append(f'processor\t: {cpu_id}\nmodel name\t: {self.model_name}\n'
+                               f'microcode\t: 0x1\ncpu MHz\t\t: {self._cur_freq(cpu["policy_id"]) / 1000:.3f}\n')
+        return '\n'.join(entries)
+
+    def set_load(self, load: float, cpu_ids=None):
+        '''Sets busy fraction of cpu_ids (all by default)'''
+        for cpu_id in self.cpus if cpu_ids is None else cpu_ids:
+            self._stat_counters(cpu_id)  # account time at the previous load
+            self.cpus[cpu_id]['load'] = load
+
+    def _stat_counters(self, cpu_id: int) -> list:
+        '''Returns user nice system idle iowait irq softirq steal jiffies of cpu_id'''
+        cpu = self.cpus[cpu_id]
+        jiffies = int(self.elapsed() * 100)
+        counters = cpu.setdefault('counters', [0] * 8)
+        delta = jiffies - cpu.setdefault('jiffies', 0)
+        if cpu['online'] and delta > 0:
+            busy = int(delta * cpu['load'])
+            iowait = int(delta * cpu['iowait'])
+            counters[0] += busy * 3 // 4
+            counters[2] += busy - busy * 3 // 4
+            counters[4] += iowait
+            counters[3] += delta - busy - iowait
+        cpu['jiffies'] = jiffies
+        return counters
+
+    def _stat(self) -> str:
+        lines = []
+        cpu_lines = []
+        total = [0] * 8
+        for cpu_id, cpu in self.cpus.items():
+            counters = self._stat_counters(cpu_id)
+            total = [a + b for a, b in zip(total, counters)]
+            if cpu['online']:
+                cpu_lines.append(f'cpu{cpu_id} ' + ' '.join(map(str, counters)) + ' 0 0')
+        lines.append('cpu  ' + ' '.join(map(str, total)) + ' 0 0')
+        lines.extend(cpu_lines)
+        lines.append('intr 0')
+        lines.append(f'ctxt {int(self.elapsed() * 1000)}')
+        return '\n'.join(lines)
+
+    # Temperature
+    def _build_hwmon(self):
+        '''coretemp chip with package and per core inputs, plus an unrelated chip'''
+        hwmon_dir = '/sys/class/hwmon/hwmon0/'
+        self.add(hwmon_dir + 'name', 'nvme')
+        self.add(hwmon_dir + 'temp1_input', '38850')
+        hwmon_dir = '/sys/class/hwmon/hwmon1/'
+        self.add(hwmon_dir + 'name', 'coretemp')
+        self.add(hwmon_dir + 'temp1_label', 'Package id 0')
+        self.add(hwmon_dir + 'temp1_input', lambda: str(self.core_temperature(None)))
+        self.add(hwmon_dir + 'temp1_crit', '100000')
+        for core_num in range(self.physical_cores):
+            self.add(hwmon_dir + f'temp{core_num + 2}_label', f'Core {core_num}')
+            self.add(hwmon_dir + f'temp{core_num + 2}_input',
+                     lambda core_num=core_num: str(self.core_temperature(core_num)))
+
+    def core_temperature(self, core_num: int = None) -> int:
+        '''Temperature (m°C) of core_num, package if None, grows with package power'''
+        temperature = 35_000 + 2_500 * self.package_power
+        if core_num is not None:
+            temperature += 500 * (core_num % 4) - 1_000
+        return int(temperature)
+
+    # RAPL
+    def _build_rapl(self):
+        self.rapl_limits = [self.package_power * 10**6, self.package_power * 2 * 10**6]
+        self.add(self.RAPL_DIR + 'intel-rapl/enabled', '1')
+        layers = dict(zip(('intel-rapl:0', 'intel-rapl:0:0', 'intel-rapl:0:1'),
+                          (('package-0', 1.0), ('core', 0.7), ('uncore', 0.05))))
+        for layer, (name, share) in layers.items():
+            layer_dir = self.RAPL_DIR + layer + '/'
+            self.add(layer_dir + 'name', name)
+            self.add(layer_dir + 'enabled', '1', lambda value: None)
+            self.add(layer_dir + 'max_energy_range_uj', str(self.max_energy_range_uj))
+            self.add(layer_dir + 'energy_uj', self._energy_getter(share))
+        for constraint in (0, 1):
+            self.add(self.RAPL_DIR + f'intel-rapl:0/constraint_{constraint}_power_limit_uw',
+                     self._limit_getter(constraint), self._limit_setter(constraint))
+
+    def _energy_getter(self, share: float):
+        def getter():
+            energy = self.rapl_offset + share * self.package_power * self.elapsed() * 10**6
+            return str(int(energy) % (self.max_energy_range_uj + 1))
+        return getter
+
+    def _limit_getter(self, constraint: int):
+        return lambda: str(int(self.rapl_limits[constraint]))
+
+    def _limit_setter(self, constraint: int):
+        def setter(value: str):
+            if not value.isdigit():
+                self._invalid('power_limit_uw')
+            self.rapl_limits[constraint] = int(value)
+        return setter
+
+    # Power supply
+    def _build_power_supply(self):
+        ac_dir = self.POWER_SUPPLY_DIR + 'AC/'
+        bat_dir = self.POWER_SUPPLY_DIR + 'BAT0/'
+        self.add(ac_dir + 'type', 'Mains')
+        self.add(ac_dir + 'online', lambda: str(int(self.ac_online)))
+        self.add(bat_dir + 'type', 'Battery')
+        self.add(bat_dir + 'status', self._battery_status)
+        self.add(bat_dir + 'capacity', lambda: str(int(100 * self._battery_update() / self.battery_capacity)))
+        # energy in µWh, power in µW, voltage in µV
+        self.add(bat_dir + 'energy_full', str(int(self.battery_capacity * 10**6)))
+        self.add(bat_dir + 'energy_now', lambda: str(int(self._battery_update() * 10**6)))
+        self.add(bat_dir + 'power_now', lambda: str(int(self._battery_power() * 10**6)))
+        self.add(bat_dir + 'voltage_now', '11100000')
+
+    def set_ac_online(self, online: bool):
+        self._battery_update()
+        self.ac_online = online
+
+    def _battery_power(self) -> float:
+        '''Current battery power flow (W), positive while discharging'''
+        if self.ac_online:
+            return 0.0 if self.battery_energy >= self.battery_capacity else -self.charge_power
+        elif self.battery_energy <= 0:
+            return 0.0
+        return self.discharge_curve(self.elapsed())
+
+    def _battery_update(self) -> float:
+        '''Integrates battery energy (Wh) up to now and returns it'''
+        now = self.clock()
+        energy = self.battery_energy - self._battery_power() * (now - self.battery_time) / 3600
+        self.battery_energy = min(max(energy, 0.0), self.battery_capacity)
+        self.battery_time = now
+        return self.battery_energy
+
+    def _battery_status(self) -> str:
+        self._battery_update()
+        power = self._battery_power()
+        if power > 0:
+            return 'Discharging'
+        elif power < 0:
+            return 'Charging'
+        return 'Full' if self.ac_online else 'Unknown'
+
+    # Processes
+    def spawn(self, name: str, cmdline: str = None, exe: str = None, ppid: int = 1,
+              cgroup: str = '/user.slice') -> int:
+        '''Adds a fake process and returns its pid, cmdline defaults to name and exe to /usr/bin/name'''
+        pid = self.next_pid
+        self.next_pid += 1
+        self.pids[pid] = name
+        self.add(f'/proc/{pid}/comm', name[:15])
+        self.add(f'/proc/{pid}/cmdline', (cmdline or name).replace(' ', '\0') + '\0')
+        self.add(f'/proc/{pid}/exe', exe or f'/usr/bin/{name}')
+        self.add(f'/proc/{pid}/stat', f'{pid} ({name[:15]}) S {ppid} {pid} {pid}')
+        self.add(f'/proc/{pid}/cgroup', f'0::{cgroup}')
+        return pid
+
+    def kill(self, pid: int):
+        self.pids.pop(pid)
+        self.remove(f'/proc/{pid}')
+
+
+backend: Backend = RealBackend()
+
+def use(new_backend: Backend):
+    '''Sets the backend used by every hardware access'''
+    global backend
+    backend = new_backend
+
+def read(path, dtype=str):
+    '''Reads first line of path (str or Path), strips and converts to dtype.'''
+    data = backend.read(path).split('\n', 1)[0].strip()
+    return dtype(data)
+
+def read_text(path) -> str:
+    return backend.read_text(path)
+
+def write(path, value):
+    backend.write(path, value)
+
+def exists(path) -> bool:
+    return backend.exists(path)
+
+def glob(pattern: str) -> list:
+    return backend.glob(pattern)
+
+def readlink(path) -> str:
+    return backend.readlink(path)
+
+def is_writable(path) -> bool:
+    return backend.is_writable(path)
+
+def privileged() -> bool:
+    return backend.privileged()
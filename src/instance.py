@@ -0,0 +1,110 @@
+import os
+import json
+import fcntl
+import socket
+import asyncio
+
+import log
+
+'''
+This module holds the single-instance registry: a flock-held runtime lock file
+and a control socket where the running instance answers JSON requests.
+'''
+
+RUNTIME_DIR = '/run/powerplan/'
+LOCK_PATH = RUNTIME_DIR + 'powerplan.lock'
+SOCKET_PATH = RUNTIME_DIR + 'powerplan.sock'
+# Seconds a connection gets to send its request and read the response
+REQUEST_TIMEOUT = 0.5
+
+
+class InstanceLock:
+    '''Exclusive flock on the lock file, held for the lifetime of the process'''
+
+    def __init__(self, path: str = LOCK_PATH):
+        self.path = path
+        self.fd = None
+
+    def acquire(self) -> bool:
+        '''Returns False if another instance holds the lock'''
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f'{os.getpid()}\n'.encode(), 0)
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ControlServer:
+    '''
+    asyncio unix socket server, answers one JSON request per connection
+    requests: {"command": name, ...}, handlers: command -> callable(request) -> dict
+    '''
+    def __init__(self, info: dict, path: str = SOCKET_PATH):
+        self.path = path
+        self.info = dict(pid=os.getpid(), **info)
+        self.handlers = dict(info=lambda request: self.info)
+        self.server = None
+        # Only the lock holder gets here, so an existing socket is stale
+        if os.path.exists(path):
+            os.unlink(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(8)
+        self.socket.setblocking(False)
+
+    def register(self, command: str, handler):
+        self.handlers[command] = handler
+
+    async def start(self):
+        '''Serves on the running loop, each connection in its own task so slow clients don't stall it'''
+        self.server = await asyncio.start_unix_server(self._serve, sock=self.socket)
+
+    async def _serve(self, reader, writer):
+        try:
+            await asyncio.wait_for(self._answer(reader, writer), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.info('Control socket request timed out.')
+        except (OSError, ValueError) as err:
+            log.info(f'Control socket request failed: {err}')
+        finally:
+            writer.close()
+
+    async def _answer(self, reader, writer):
+        request = json.loads(await reader.readline() or '{}')
+        handler = self.handlers.get(request.get('command'))
+        if handler is None:
+            response = dict(error=f'unknown command: {request.get("command")}')
+        else:
+            response = handler(request)
+        writer.write((json.dumps(response) + '\n').encode())
+        await writer.drain()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def query(command: str = 'info', path: str = SOCKET_PATH, timeout: float = 2.0, **arguments) -> dict:
+    '''Sends a request to the running instance, returns its response or None if unreachable'''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall((json.dumps(dict(command=command, **arguments)) + '\n').encode())
+            return json.loads(client.makefile('r').readline())
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,136 @@
+import re
+
+import hardware
+
+'''
+This module holds the trigger matcher: triggerapps entries are parsed into Trigger
+conditions (process name, exe path, cmdline substring or regex, parent name, cgroup)
+and compiled into a TriggerIndex, a hash map from process name (comm) to the triggers
+of every profile, so only processes whose name passes it get their cmdline, exe, parent
+or cgroup read, and each match maps straight to the highest priority profile.
+'''
+
+# Max length of process names (comm) as reported by the kernel
+COMM_LENGTH = 15
+# key=value conditions of a triggerapps entry, besides the process name
+CONDITIONS = ('exe', 'cmdline', 'cmdline~', 'parent', 'cgroup')
+
+
+class Trigger:
+    '''
+    A triggerapps entry: "[name] [exe=PATH] [cmdline=TEXT] [cmdline~=REGEX] [parent=NAME] [cgroup=TEXT]"
+    name or exe is required, the process name is looked up first and exe defaults it (its basename)
+    '''
+    def __init__(self, entry: str):
+        self.entry = entry
+        self.comm = None
+        self.exe = None
+        self.cmdline = None
+        self.parent = None
+        self.cgroup = None
+        for token in entry.split():
+            key, separator, value = token.partition('=')
+            if not separator:
+                if self.comm is not None:
+                    raise ValueError(f'more than one process name in "{entry}"')
+                self.comm = token[:COMM_LENGTH]
+            elif key not in CONDITIONS or not value:
+                raise ValueError(f'invalid condition "{token}" in "{entry}", conditions are {CONDITIONS}')
+            elif key in ('cmdline', 'cmdline~'):
+                try:
+                    self.cmdline = re.compile(value if key == 'cmdline~' else re.escape(value))
+                except re.error as err:
+                    raise ValueError(f'invalid cmdline regex "{value}": {err}')
+            elif key == 'parent':
+                self.parent = value[:COMM_LENGTH]
+            else:
+                setattr(self, key, value)
+        if self.comm is None:
+            if self.exe is None:
+                raise ValueError(f'"{entry}" needs a process name or exe')
+            self.comm = self.exe.rsplit('/', 1)[-1][:COMM_LENGTH]
+
+    def matches(self, process) -> bool:
+        '''process: ProcessInfo whose comm already matched'''
+        if self.exe is not None and process.exe() != self.exe:
+            return False
+        if self.cmdline is not None and not self.cmdline.search(process.cmdline()):
+            return False
+        if self.parent is not None and process.parent_comm() != self.parent:
+            return False
+        if self.cgroup is not None and self.cgroup not in process.cgroup():
+            return False
+        return True
+
+
+class ProcessInfo:
+    '''Lazily read (and cached) procfs attributes of pid, empty if it exited'''
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cache = dict()
+
+    def _cached(self, name: str, reader):
+        if name not in self.cache:
+            try:
+                self.cache[name] = reader()
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                self.cache[name] = ''
+        return self.cache[name]
+
+    def cmdline(self) -> str:
+        '''Arguments joined by spaces'''
+        return self._cached('cmdline', lambda: hardware.read_text(f'/proc/{self.pid}/cmdline').replace('\0', ' ').strip())
+
+    def exe(self) -> str:
+        return self._cached('exe', lambda: hardware.readlink(f'/proc/{self.pid}/exe'))
+
+    def parent_comm(self) -> str:
+        def reader():
+            # comm can contain spaces and parentheses, ppid is the second field after it
+            ppid = hardware.read_text(f'/proc/{self.pid}/stat').rsplit(')', 1)[1].split()[1]
+            return hardware.read_text(f'/proc/{ppid}/comm').strip()
+        return self._cached('parent', reader)
+
+    def cgroup(self) -> str:
+        def reader():
+            for line in hardware.read_text(f'/proc/{self.pid}/cgroup').splitlines():
+                if line.startswith('0::'):
+                    return line[3:]
+            return ''
+        return self._cached('cgroup', reader)
+
+
+class TriggerIndex:
+    '''
+    Triggers of every profile, by process name
+    profiles: dict of PowerProfile sorted by priority, the first one has the highest
+    Each bucket holds (profile name, trigger) pairs, highest priority first
+    '''
+    def __init__(self, profiles: dict):
+        self.rank = {name: rank for rank, name in enumerate(profiles)}
+        self.buckets = dict()
+        for name, profile in profiles.items():
+            for trigger in profile.triggers:
+                self.buckets.setdefault(trigger.comm, []).append((name, trigger))
+
+    def __bool__(self) -> bool:
+        return bool(self.buckets)
+
+    def __contains__(self, comm: str) -> bool:
+        return comm in self.buckets
+
+    def match(self, pid: int, comm: str) -> str:
+        '''Name of the highest priority profile triggered by process pid named comm, None if none is'''
+        bucket = self.buckets.get(comm)
+        if bucket is None:
+            return None
+        # Attributes are read once, whichever triggers need them
+        process = ProcessInfo(pid)
+        for name, trigger in bucket:
+            if trigger.matches(process):
+                return name
+        return None
+
+    def best(self, names) -> str:
+        '''Highest priority profile name of names, None if empty'''
+        return min(names, key=self.rank.__getitem__, default=None)
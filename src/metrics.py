@@ -0,0 +1,136 @@
+import os
+import socket
+import asyncio
+
+import log
+from __init__ import __version__
+
+'''
+This module holds the MetricsServer class, which answers HTTP requests on a unix socket
+or a localhost TCP port with OpenMetrics text rendered from the latest SystemStatus values,
+so scrapes never read sysfs themselves.
+'''
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+# Seconds a connection gets to send its request and read the response
+REQUEST_TIMEOUT = 0.5
+# (status field, metric name, unit, help, scale to the metric unit)
+GAUGES = (
+    ('ac_power', 'powerplan_ac_power', '', 'Running on AC power.', 1),
+    ('cpu_util_avg', 'powerplan_cpu_utilization_ratio', 'ratio', 'Average CPU utilization.', 0.01),
+    ('frequency_avg', 'powerplan_cpu_frequency_average_hertz', 'hertz', 'Average CPU frequency.', 10**6),
+    ('frequency_max', 'powerplan_cpu_frequency_max_hertz', 'hertz', 'Highest CPU frequency.', 10**6),
+    ('package_power', 'powerplan_package_power_watts', 'watts', 'CPU package power.', 1),
+    ('battery_draw', 'powerplan_battery_draw_watts', 'watts', 'Battery power draw.', 1),
+    ('package_temp', 'powerplan_package_temperature_celsius', 'celsius', 'CPU package temperature.', 1),
+    ('temperature', 'powerplan_temperature_celsius', 'celsius', "Temperature of the profile's temp_source.", 1),
+    ('time', 'powerplan_last_update_timestamp_seconds', 'seconds', 'Time of the latest status update.', 1)
+)
+
+
+def parse_address(address: str) -> tuple:
+    '''Returns (family, address): a unix socket path, or a localhost port as "PORT" or "localhost:PORT"'''
+    port = address.rsplit(':', 1)[-1]
+    if port.isdigit() and address.split(':')[0] in (port, 'localhost', '127.0.0.1'):
+        return socket.AF_INET, ('127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render(status, applier, counters: dict) -> str:
+    '''OpenMetrics text of the latest status values, applier and main loop counters'''
+    # info families are named without the _info suffix of their sample
+    lines = ['# TYPE powerplan info',
+             '# HELP powerplan powerplan version.',
+             f'powerplan_info{{version="{__version__}"}} 1']
+
+    if 'triggered_profile' in status.fields:
+        profile = status.query('triggered_profile')
+        if profile is not None:
+            lines += ['# TYPE powerplan_profile_active gauge',
+                      '# HELP powerplan_profile_active Currently triggered profile.',
+                      f'powerplan_profile_active{{profile="{escape(profile.name)}"}} 1']
+
+    for field, name, unit, help_text, scale in GAUGES:
+        if field not in status.fields:
+            continue
+        value = status.query(field)
+        if value is None:
+            continue
+        lines.append(f'# TYPE {name} gauge')
+        if unit:
+            lines.append(f'# UNIT {name} {unit}')
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'{name} {float(value) * scale!r}')
+
+    for name, help_text, value in (
+            ('powerplan_profile_switches', 'Profile applications due to a profile or power source change.',
+             counters['profile_switches']),
+            ('powerplan_apply_writes', 'sysfs writes made applying profiles.', applier.total_writes),
+            ('powerplan_apply_reads', 'sysfs reads made applying profiles.', applier.total_reads),
+            ('powerplan_apply_errors', 'Failed profile applications.', applier.errors)):
+        lines += [f'# TYPE {name} counter',
+                  f'# HELP {name} {help_text}',
+                  f'{name}_total {value}']
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    '''
+    asyncio HTTP/1.0 server, every request gets the metrics returned by render()
+    address: see parse_address, TCP ports only listen on localhost
+    '''
+    def __init__(self, address: str, render):
+        self.render = render
+        self.family, self.address = parse_address(address)
+        self.scrapes = 0
+        self.server = None
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.socket = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.listen(8)
+        self.socket.setblocking(False)
+        log.info(f'Serving metrics at {address}.')
+
+    async def start(self):
+        '''Serves on the running loop, each connection in its own task so slow clients don't stall it'''
+        if self.family == socket.AF_UNIX:
+            self.server = await asyncio.start_unix_server(self._serve, sock=self.socket, limit=1024)
+        else:
+            self.server = await asyncio.start_server(self._serve, sock=self.socket, limit=1024)
+
+    async def _serve(self, reader, writer):
+        try:
+            await asyncio.wait_for(self._answer(reader, writer), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.info('Metrics request timed out.')
+        except (OSError, ValueError) as err:
+            log.info(f'Metrics request failed: {err}')
+        finally:
+            writer.close()
+
+    async def _answer(self, reader, writer):
+        request = (await reader.readline()).split()
+        if len(request) < 2 or request[0] not in (b'GET', b'HEAD'):
+            writer.write(b'HTTP/1.0 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n')
+        else:
+            body = self.render().encode()
+            header = (f'HTTP/1.0 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                      f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode()
+            writer.write(header if request[0] == b'HEAD' else header + body)
+            self.scrapes += 1
+        await writer.drain()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.socket.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
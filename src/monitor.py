@@ -1,16 +1,27 @@
-import subprocess
-from time import time
+import sys
+import shutil
+from time import monotonic
 
-import psutil
-from systemstatus import System, SystemStatus
+from shell import attribute_cache
+from systemstatus import System
 
-def show_system_status(system: System, status: SystemStatus, monitor_mode: bool):
-    '''Prints System status during runtime'''
-    cpu = system.cpu
-    cpu_spec = system.cpu.spec
+# Escape sequences
+CLEAR_SCREEN = '\x1b[2J\x1b[H'
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+# Width of a per cpu cell in the grid, including separation
+CPU_CELL_WIDTH = 23
 
-    time_now = status['time_stamp']
-    active_profile = f'{time_now}\t\tActive: {status["triggered_profile"].name}'
+
+def move_to(row: int, column: int) -> str:
+    return f'\x1b[{row + 1};{column + 1}H'
+
+
+def status_lines(status, cpu_spec, workload_state: str = None) -> list:
+    '''Summary lines of status (SystemStatus or snapshot.SnapshotView)'''
+    active_profile = f'{status["time_stamp"]}\t\tActive: {status["triggered_profile"].name}'
+    if workload_state:
+        active_profile += f'\tWorkload boost: {workload_state}'
 
     # governor/policy
     governor = status['governor']
@@ -31,46 +42,103 @@ def show_system_status(system: System, status: SystemStatus, monitor_mode: bool)
     if status['package_power']:
         power_status += f'\tPackage: {status["package_power"]:.2f}W'
 
-    cores_online = status['cores_online']
-    num_cores_online = len(cores_online)
-    # Per cpu stats
-    cpus = '\t'.join(['CPU'+str(coreid) for coreid in cores_online])
-    utils = '\t'.join([str(util) for util in psutil.cpu_percent(percpu=True)])
-
-    # Read current frequencies in MHz
-    freq_list = status['frequency'].values()
-    avg_freqs = int(sum(freq_list)/num_cores_online)
-    freqs = '\t'.join([str(freq) for freq in freq_list])
-
     # CPU average line
-    cpu_cores_turbo = '\t'.join([f'Cores online: {num_cores_online} ',
+    frequencies = status['frequency']
+    avg_freqs = int(sum(frequencies.values())/len(frequencies)) if frequencies else 0
+    cpu_cores_turbo = '\t'.join([f'Cores online: {len(status["cores_online"])} ',
                                  f"Turbo: {'enabled' if status['turbo'] else 'disabled'}"])
 
-    cpu_avg = '\t'.join([f"Avg. Usage: {cpu.read_cpu_utilization('avg')}%",
+    cpu_avg = '\t'.join([f"Avg. Usage: {status['cpu_util_avg']}%",
                          f'Avg. Freq.: {avg_freqs}MHz',
                          f'Package temp: {status["package_temp"]}°C'])
 
-    monitor_mode_indicator = '[MONITOR MODE]' if monitor_mode else '[ACTIVE MODE]'
-    status_lines = ['',
-                    active_profile,
-                    power_plan,
-                    power_status,
-                    cpu_cores_turbo,
-                    cpu_avg,
-                    '',
-                    cpus,
-                    utils,
-                    freqs]
-
-    subprocess.run('clear')
-    print(monitor_mode_indicator)
-    print(system.info)
-    print(*status_lines, sep='\n')
+    return [active_profile, power_plan, power_status, cpu_cores_turbo, cpu_avg]
+
+
+def cpu_cells(status) -> list:
+    '''Per cpu cell texts: id, frequency and utilization'''
+    frequencies = status['frequency']
+    utilization = status['cpu_util_all']
+    return [f'CPU{cpu_id:<4}{frequencies.get(cpu_id, 0):>5}MHz {utilization.get(cpu_id, 0.0):>5.1f}%'
+            for cpu_id in status['cores_online']]
+
+
+class StatusRenderer:
+    '''
+    Draws the system status in place with ANSI escape sequences
+    The static header (system info) is drawn once, then only cells whose text changed get rewritten.
+    Per cpu cells are laid out in a grid as wide as the terminal, clipped to its height
+    (the last cell tells how many cpus didn't fit).
+    Falls back to printing every frame if stdout isn't a terminal, or if it's too short for the summary.
+    '''
+    def __init__(self, system: System, monitor_mode: bool, output=sys.stdout):
+        self.cpu_spec = system.cpu.spec
+        self.output = output
+        self.interactive = output.isatty()
+        indicator = '[MONITOR MODE]' if monitor_mode else '[ACTIVE MODE]'
+        self.header = [indicator] + system.info.expandtabs().splitlines() + ['']
+        self.cells = dict()  # (row, column): text on screen
+        self.layout = None
+
+    def render(self, status, workload_state: str = None):
+        lines = [line.expandtabs() for line in status_lines(status, self.cpu_spec, workload_state)]
+        cpus = cpu_cells(status)
+        width, height = shutil.get_terminal_size()
+        first_row = len(self.header)
+        grid_row = first_row + len(lines) + 1
+        # The last row is left for the cursor
+        grid_rows = height - 1 - grid_row
+        if not self.interactive or grid_rows < 1:
+            self.close()
+            print(*self.header, *lines, '', *cpus, sep='\n', file=self.output, flush=True)
+            return
+
+        columns = max(1, width // CPU_CELL_WIDTH)
+        if len(cpus) > grid_rows * columns:
+            shown = grid_rows * columns - 1
+            cpus = cpus[:shown] + [f'+{len(cpus) - shown} more cpus']
+        layout = (width, height, columns, len(cpus))
+        frame = []
+        if layout != self.layout:
+            # Terminal resized or cpus went on/offline: redraw everything
+            frame = [HIDE_CURSOR, CLEAR_SCREEN, '\n'.join(self.header)]
+            self.cells = dict()
+            self.layout = layout
+
+        cells = {(first_row + row, 0): (line, width) for row, line in enumerate(lines)}
+        for index, text in enumerate(cpus):
+            row, column = divmod(index, columns)
+            cells[(grid_row + row, column * CPU_CELL_WIDTH)] = (text, CPU_CELL_WIDTH)
+
+        for position, (text, cell_width) in cells.items():
+            text = text[:cell_width - 1].ljust(cell_width - 1)
+            if self.cells.get(position) != text:
+                frame.append(move_to(*position) + text)
+                self.cells[position] = text
+        frame.append(move_to(grid_row + (len(cpus) + columns - 1) // columns, 0))
+        self.output.write(''.join(frame))
+        self.output.flush()
+
+    def close(self):
+        '''Shows the cursor again, the next frame gets fully redrawn'''
+        if self.interactive and self.layout is not None:
+            self.output.write(SHOW_CURSOR)
+            self.output.flush()
+        self.layout = None
+
 
 def read_process_cpu_mem(running_process):
     return running_process.cpu_percent(), running_process.memory_percent()
 
-def debug_runtime_info(process, profile, iteration_start):
+def debug_runtime_info(process, profile, iteration_start, applier=None, scheduler=None):
     process_util, process_mem = read_process_cpu_mem(process)
-    time_iter = (time() - iteration_start) * 1000  # ms
+    time_iter = (monotonic() - iteration_start) * 1000  # ms
     print(f'Process resources: CPU {process_util:.2f}%, Memory {process_mem:.2f}%, Time {time_iter:.3f}ms')
+    cache = attribute_cache.stats()
+    print(f'Attribute cache: {cache["hits"]} hits, {cache["opens"]} opens, {cache["reopens"]} reopens, '
+          f'{cache["evictions"]} evictions, {cache["open_handles"]} open handles')
+    if applier is not None:
+        print(f'Profile apply: {applier.reads} reads, {applier.writes} writes last time, '
+              f'{applier.total_reads} reads, {applier.total_writes} writes in total')
+    if scheduler is not None:
+        print(f'Scheduler: {scheduler.wakeups} wakeups, current period {scheduler.period or 0:.2f}s')
@@ -1,14 +1,17 @@
 #!/usr/bin/python3
+import asyncio
 from sys import exit
-from time import time
+from time import monotonic, sleep
 from argparse import ArgumentParser, SUPPRESS
 
-import psutil
-
 import log
 import shell
+import daemon
 import monitor
-import process
+import instance
+import telemetry
+import profiling
+import snapshot
 import systemstatus
 from cpu import Cpu
 from __init__ import __version__
@@ -23,6 +26,14 @@ argparser.add_argument('-r', '--reload', action='store_true', help='enable confi
 argparser.add_argument('-s', '--status', action='store_true', help="display system status periodically")
 argparser.add_argument('--daemon', action='store_true', help='install and enable as a system daemon (systemd)')
 argparser.add_argument('--log', action='store_true', help='print daemon log')
+argparser.add_argument('--record', action='store_true', help='record status telemetry')
+argparser.add_argument('--metrics', metavar='ADDRESS',
+                       help='serve OpenMetrics at a unix socket path or a localhost port')
+argparser.add_argument('--export', metavar='FILE', help='export recorded telemetry as CSV and exit')
+argparser.add_argument('--reprobe', action='store_true', help='re-detect cpu specification, ignoring its cache')
+argparser.add_argument('--verify-cache', action='store_true', help='check cached cpu specification and exit')
+argparser.add_argument('--profile-daemon', action='store_true',
+                       help='time status reads and profile application, or show the running instance timings')
 argparser.add_argument('--persistent', action='store_true', help='use this if your profile is reset by your computer')
 argparser.add_argument('--system', action='store_true', help='show system info and exit')
 argparser.add_argument('--uninstall', action='store_true', help='uninstall program')
@@ -33,60 +44,60 @@ argparser.add_argument('--version', action='store_true', help='show program vers
 def single_activation(profile: str, system: systemstatus.System):
     profiles = read_profiles(system)
     if profile in profiles:
-        status = systemstatus.StatusMinimal(system, profiles)
+        if ARGS.status:
+            status = systemstatus.StatusMonitor(system, profiles)
+        else:
+            status = systemstatus.StatusMinimal(system, profiles)
         status.update()
         profiles[profile].apply(status)
         if ARGS.status:
-            monitor.show_system_status(profiles[ARGS.profile], monitor_mode=True)
+            status.update()
+            renderer = monitor.StatusRenderer(system, monitor_mode=True)
+            try:
+                renderer.render(status)
+            finally:
+                renderer.close()
         else:
             print(f'Profile {profile} active.')
     else:
         log.error(f'Profile "{ARGS.profile}" not found in config file.')
 
-def main_loop(monitor_mode: bool, system: systemstatus.System):
-    profiles = read_profiles(system)
-
-    # Get status object and needed fields at iteration start
-    if ARGS.status:
-        status = systemstatus.StatusMonitor(system, profiles)
-        partials = ['time_stamp', 'ac_power', 'triggered_profile']
-    else:
-        status = systemstatus.StatusMinimal(system, profiles)
-        partials = ['ac_power', 'triggered_profile']
-
-    if ARGS.debug:
-        running_process = psutil.Process()
-
-    while True:
-        # we need this to time the sleeps periods
-        iteration_start = time()
-
-        if ARGS.reload:  # profile hot-reloading
-            profiles = read_profiles(system)
-            status.reset()
-
-        status.partial_update(partials)
-
-        # Profile application
-        profile = status['triggered_profile']
-        if not monitor_mode:
-            if status.changed(['ac_power', 'triggered_profile']):
-                # Log only on changes, even if --persistent is used (to avoid flooding journal)
-                log.info(f'Applying profile: {profile.name}-{"AC" if status["ac_power"] else "Battery"}')
-                profile.apply(status)
-            elif ARGS.persistent:
-                profile.apply(status)
-
-        if ARGS.status:
-            # Update the rest of fields here in order to display
-            # the status after the profile has been applied
-            status.partial_update()
-            monitor.show_system_status(system, status, monitor_mode)
-        if ARGS.debug:
-            monitor.debug_runtime_info(running_process, profile, iteration_start)
-
-        # Then sleep needed time
-        profile.sleep(iteration_start=iteration_start, status=status)
+def monitor_loop(system: systemstatus.System):
+    '''Displays the status snapshot published by the running instance, reads no sysfs files itself'''
+    reader = None
+    lease_renewal = 0
+    renderer = monitor.StatusRenderer(system, monitor_mode=True)
+    try:
+        while True:
+            iteration_start = monotonic()
+            # Keep the running instance publishing snapshots
+            if iteration_start >= lease_renewal:
+                lease = instance.query('snapshot')
+                if lease is None or 'error' in lease:
+                    log.error('The running instance does not publish status snapshots.')
+                lease_renewal = iteration_start + lease['lease'] / 2
+                if reader is None:
+                    try:
+                        reader = snapshot.SnapshotReader(lease['path'])
+                    except (OSError, ValueError) as err:
+                        log.error(f'Could not map status snapshot: {err}')
+
+            view = reader.read()
+            if view is not None:
+                renderer.render(view, view['workload_state'] or None)
+            elif not reader.writer_alive():
+                log.error('The running instance stopped.')
+            sleep(max(0, snapshot.MONITOR_PERIOD - monotonic() + iteration_start))
+    finally:
+        renderer.close()
+
+def main_loop(system: systemstatus.System):
+    # asyncio.run needs python 3.7
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(daemon.Daemon(system, ARGS).run())
+    finally:
+        loop.close()
 
 
 if __name__ == '__main__':
@@ -112,8 +123,21 @@ if __name__ == '__main__':
         log.print_log()
         exit(0)
 
+    if ARGS.export:
+        records = telemetry.export_csv(ARGS.export)
+        print(f'{records} telemetry records exported to {ARGS.export}.')
+        exit(0)
+
     # Initialize system interface
-    system = systemstatus.System(cpu=Cpu(), powersupply=PowerSupply())
+    system = systemstatus.System(cpu=Cpu(reprobe=ARGS.reprobe), powersupply=PowerSupply())
+
+    if ARGS.verify_cache:
+        mismatches = system.cpu.spec.verify_cache()
+        if mismatches:
+            log.error(f'Cached CPU specification does not match the hardware: {", ".join(mismatches)}. '
+                      'Run with --reprobe to update it.')
+        print('Cached CPU specification matches the hardware.')
+        exit(0)
 
     if ARGS.system:
         print(system.info)
@@ -134,19 +158,32 @@ if __name__ == '__main__':
         shell.enable_daemon()
         exit(0)
 
-    # Check if already running and define monitor mode accordingly
-    if process.already_running():
+    # Check if already running (instance lock is held) and define monitor mode accordingly
+    instance_lock = instance.InstanceLock()
+    if not instance_lock.acquire():
+        running_instance = instance.query('info')
+        if running_instance is not None:
+            log.info(f'Instance running: pid {running_instance["pid"]}, v{running_instance["version"]}, '
+                     f'{running_instance["mode"]} mode.')
+        # Timings of the running instance
+        if ARGS.profile_daemon and not ARGS.status:
+            stats = instance.query('profile')
+            if stats is None or 'error' in stats:
+                log.error('The running instance was not started with --profile-daemon.')
+            print(profiling.Profiler().report(stats))
+            exit(0)
         # Monitor mode
         if ARGS.status:
-            monitor_mode = True
+            try:
+                monitor_loop(system)
+            except KeyboardInterrupt:
+                exit(0)
         elif ARGS.profile:
             # Profile will be overriden
             log.warning('Single profile activation will get overwritten by the already running instance.')
         else:
             log.error('An instance is already running. '
                       'You can monitor system status with: powerplan --status.')
-    else:
-        monitor_mode = False
 
     # Activate profile and exit
     if ARGS.profile:
@@ -154,6 +191,6 @@ if __name__ == '__main__':
         exit(0)
 
     try:
-        main_loop(monitor_mode, system=system)
+        main_loop(system=system)
     except KeyboardInterrupt:
         exit(0)
@@ -4,8 +4,9 @@ from pathlib import Path
 from abc import ABC, abstractmethod
 
 import log
-from shell import read, shell
-from systemstatus import History
+from shell import shell
+from hardware import read, exists, glob
+from ringbuffer import RingStore
 
 
 class PowerSupplyDevice(ABC):
@@ -62,11 +63,11 @@ class PowerSupplyDevice(ABC):
 
     def _available(self, path: Path) -> bool:
         '''Check if path exists and returns values properly'''
-        exists = path.exists()
-        reading = self._read(path) if exists else None
-        if exists and reading is None:
+        path_exists = exists(path)
+        reading = self._read(path) if path_exists else None
+        if path_exists and reading is None:
             log.info(f'Battery interface "{path.name}" detected but doesn\'t work.')
-        return exists and reading is not None
+        return path_exists and reading is not None
 
 
 class ACAdapter(PowerSupplyDevice):
@@ -171,18 +172,20 @@ class Battery(PowerSupplyDevice):
         log.info(f'Power method selected: {method}')
         # Prepare history objs if needed
         if method == 'EnergyDelta':
-            self.time_history = History(maxlen=history_len)
-            self.energy_history = History(maxlen=history_len)
+            self.history = RingStore(dict(time='d', energy='d'), length=history_len)
+            self.time_history = self.history['time']
+            self.energy_history = self.history['energy']
         elif method == 'ChargeDeltaVoltage':
-            self.time_history = History(maxlen=history_len)
-            self.charge_history = History(maxlen=history_len)
+            self.history = RingStore(dict(time='d', charge='d'), length=history_len)
+            self.time_history = self.history['time']
+            self.charge_history = self.history['charge']
 
     def _power_unavailable(self):
         return None
 
     def _power_read(self):
         power = self._read(self.power_now, int)  # µW
-        if power is None:
+        if power is not None:
             return power / 10**6
         else:
             return None
@@ -193,8 +196,7 @@ class Battery(PowerSupplyDevice):
         if energy is not None:
             # only update history if value changed
             if not self.energy_history or energy != self.energy_history[-1]:
-                self.time_history.update(read_time)
-                self.energy_history.update(energy)
+                self.history.append(time=read_time, energy=energy)
 
             energy_delta = self.energy_history.delta()
             if energy_delta is None:
@@ -205,8 +207,8 @@ class Battery(PowerSupplyDevice):
             return None
 
     def _power_current_voltage(self):
-        current = read(self.current_now, int)  # µA
-        voltage = read(self.voltage_now, int)  # µV
+        current = self._read(self.current_now, int)  # µA
+        voltage = self._read(self.voltage_now, int)  # µV
         if current is None or voltage is None:
             return None
         else:
@@ -218,8 +220,7 @@ class Battery(PowerSupplyDevice):
         if charge is not None:
             # only update history if value changed
             if not self.charge_history or charge != self.charge_history[-1]:
-                self.time_history.update(read_time)
-                self.charge_history.update(charge)
+                self.history.append(time=read_time, charge=charge)
 
             voltage = self._read(self.voltage_now, int)  # µV
             charge_delta = self.charge_history.delta()   # mAh
@@ -242,18 +243,18 @@ class PowerSupply():
         # /type values: "Battery", "UPS", "Mains", "USB", "Wireless"
 
         # AC detection
-        for dev_type in power_supply_dir.glob('A*/type'):
+        for dev_type in map(Path, glob(f'{power_supply_dir}/A*/type')):
             # If type Mains and needed interface exists stop looking
-            if read(dev_type) == 'Mains' and dev_type.with_name('online').exists():
+            if read(dev_type) == 'Mains' and exists(dev_type.with_name('online')):
                 ac_path = Path(dev_type).parent
                 break
         else:
             ac_path = None
 
         # Batery detection
-        for dev_type in power_supply_dir.glob('BAT*/type'):
+        for dev_type in map(Path, glob(f'{power_supply_dir}/BAT*/type')):
             # If type Battery and needed interface exists stop looking
-            if read(dev_type) == 'Battery' and dev_type.with_name('status').exists():
+            if read(dev_type) == 'Battery' and exists(dev_type.with_name('status')):
                 bat_path = Path(dev_type).parent
                 break
         else:
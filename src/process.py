@@ -1,82 +1,278 @@
-from glob import glob
+import os
+import errno
+import socket
+import struct
+from time import monotonic
+from collections import deque
+from abc import ABC, abstractmethod
 
+import log
 import shell
 import config
+import matcher
+import hardware
+
+# Process events
+FORK = 'fork'
+EXEC = 'exec'
+COMM = 'comm'
+EXIT = 'exit'
+
+# Netlink proc connector constants (linux/netlink.h, linux/connector.h, linux/cn_proc.h)
+NETLINK_CONNECTOR = 11
+NLMSG_DONE = 3
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_COMM = 0x00000200
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct('=IHHII')    # len, type, flags, seq, pid
+CN_MSG = struct.Struct('=IIIIHH')     # idx, val, seq, ack, len, flags
+PROC_EVENT = struct.Struct('=IIQ')    # what, cpu, timestamp_ns
+EVENT_DATA_OFFSET = NLMSGHDR.size + CN_MSG.size + PROC_EVENT.size
+
+
+class ProcEventSource(ABC):
+    '''
+    Base class for process event sources used by ProcessReader
+    read_events() returns a list of (event, pid, comm) tuples, comm can be None
+    lost_events must be set to True if events were dropped, so a full scan is made
+    '''
+    lost_events = False
+
+    def fileno(self):
+        return None
+
+    @abstractmethod
+    def read_events(self) -> list:
+        pass
+
+    def close(self):
+        pass
+
+
+class ScriptedProcEvents(ProcEventSource):
+    '''In-process event source, events get queued with push() and drained by read_events()'''
+
+    def __init__(self, events=()):
+        self.queue = deque(events)
+        self.lost_events = False
+
+    def push(self, event: str, pid: int, comm: str = None):
+        assert event in (FORK, EXEC, COMM, EXIT)
+        self.queue.append((event, pid, comm))
+
+    def read_events(self) -> list:
+        events = list(self.queue)
+        self.queue.clear()
+        return events
+
+
+class NetlinkProcEvents(ProcEventSource):
+    '''
+    Process events from the kernel's proc connector (needs CAP_NET_ADMIN)
+    Only thread group leaders (processes) are reported, threads are ignored
+    '''
+
+    def __init__(self):
+        self.lost_events = False
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            self.socket.bind((0, CN_IDX_PROC))
+            self.socket.setblocking(False)
+            self._send_op(PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self.socket.close()
+            raise
+
+    def _send_op(self, op: int):
+        payload = struct.pack('=I', op)
+        cn_msg = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+        length = NLMSGHDR.size + len(cn_msg) + len(payload)
+        nlmsghdr = NLMSGHDR.pack(length, NLMSG_DONE, 0, 0, os.getpid())
+        self.socket.send(nlmsghdr + cn_msg + payload)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def read_events(self) -> list:
+        events = []
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                # Socket buffer overran, events were lost
+                self.lost_events = True
+                continue
+            events.extend(self._parse(data))
+        return events
+
+    @staticmethod
+    def _parse(data: bytes) -> list:
+        events = []
+        offset = 0
+        while offset + EVENT_DATA_OFFSET <= len(data):
+            length = NLMSGHDR.unpack_from(data, offset)[0]
+            if length < EVENT_DATA_OFFSET:
+                break
+            what = PROC_EVENT.unpack_from(data, offset + NLMSGHDR.size + CN_MSG.size)[0]
+            event_data = offset + EVENT_DATA_OFFSET
+            if what == PROC_EVENT_FORK:
+                child_pid, child_tgid = struct.unpack_from('=II', data, event_data + 8)
+                if child_pid == child_tgid:
+                    events.append((FORK, child_tgid, None))
+            elif what == PROC_EVENT_EXEC:
+                pid, tgid = struct.unpack_from('=II', data, event_data)
+                events.append((EXEC, tgid, None))
+            elif what == PROC_EVENT_COMM:
+                pid, tgid, comm = struct.unpack_from('=II16s', data, event_data)
+                if pid == tgid:
+                    events.append((COMM, tgid, comm.split(b'\0', 1)[0].decode('utf-8', 'replace')))
+            elif what == PROC_EVENT_EXIT:
+                pid, tgid = struct.unpack_from('=II', data, event_data)
+                if pid == tgid:
+                    events.append((EXIT, tgid, None))
+            # NLMSG_ALIGN
+            offset += (length + 3) & ~3
+        return events
+
+    def close(self):
+        try:
+            self._send_op(PROC_CN_MCAST_IGNORE)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def default_event_source() -> ProcEventSource:
+    '''Returns a NetlinkProcEvents instance if available, None otherwise (polling fallback)'''
+    if not shell.is_root():
+        return None
+    try:
+        event_source = NetlinkProcEvents()
+    except OSError as err:
+        log.info(f'Process connector unavailable ({err.strerror}), polling /proc instead.')
+        return None
+    log.info('Listening to process events from the kernel process connector.')
+    return event_source
 
 
 class ProcessReader:
     '''
     Keeps track of previously found pids and avoids re-reading those
     comm files if not of interest
+    Processes whose comm is in the trigger index (see matcher.TriggerIndex) get matched
+    against its triggers, pid_profiles keeps the profile each matching pid triggers
+    If an event_source is provided, pid_profiles is kept up to date from process events
+    and the /proc scan is only used as a reconciliation pass every reconcile_period seconds,
+    timed rather than counted as updates also come from event batches
     '''
 
-    def __init__(self, profiles=None):
-        self.triggerapps = self._get_triggerapps(profiles)
-        self.triggerapps_found = set()
-        self.profiles = profiles
-        self.pid_names = dict()
+    def __init__(self, profiles=None, event_source: ProcEventSource = None, reconcile_period: float = 30,
+                 clock=monotonic):
+        self.profiles = config.read_profiles() if profiles is None else profiles
+        self.index = matcher.TriggerIndex(self.profiles)
+        self.pid_profiles = dict()
         self.pids_last = set()
-        self.update()
+        self.event_source = event_source
+        self.reconcile_period = reconcile_period
+        self.clock = clock
+        self.last_scan = None
+        self.scan()
 
     def update(self):
+        if self.event_source is None:
+            self.scan()
+            return
+
+        events = self.event_source.read_events()
+        if self.event_source.lost_events or self.clock() - self.last_scan >= self.reconcile_period:
+            if self.event_source.lost_events:
+                log.info('Process events were lost, rescanning /proc.')
+            self.event_source.lost_events = False
+            self.scan()
+        else:
+            for event, pid, comm in events:
+                self._handle_event(event, pid, comm)
+
+    def _handle_event(self, event: str, pid: int, comm: str = None):
+        '''Incremental bookkeeping of a single process event'''
+        self.pids_last.discard(pid)
+        if event == EXIT:
+            self.pid_profiles.pop(pid, None)
+            return
+
+        # fork/exec events don't carry the process name
+        if comm is None:
+            comm = self._read_comm(pid)
+        self._match(pid, comm)
+
+    def _match(self, pid: int, comm: str) -> bool:
+        '''Updates the profile pid triggers, returns whether comm passed the index prefilter'''
+        profile_name = self.index.match(pid, comm) if comm in self.index else None
+        if profile_name is None:
+            self.pid_profiles.pop(pid, None)
+        else:
+            self.pid_profiles[pid] = profile_name
+        return comm in self.index
+
+    @staticmethod
+    def _read_comm(pid: int) -> str:
+        '''Returns process name of pid, None if it has already exited'''
+        try:
+            return hardware.read_text(f'/proc/{pid}/comm').strip()
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+
+    def scan(self):
+        '''Full /proc scan'''
         # ensure previously identified pids are checked
         pids_new = set()
-        comms = glob('/proc/[0-9]*/comm')
-        for comm in comms + [f'/proc/{pid}/comm' for pid in self.pid_names]:
+        comms = hardware.glob('/proc/[0-9]*/comm')
+        for comm in comms + [f'/proc/{pid}/comm' for pid in self.pid_profiles]:
             pid = int(comm.split('/')[2])
 
-            # If pid was seen last time but wasn't of interest
-            if pid in self.pids_last and pid not in self.pid_names:
+            # If pid was seen last time but didn't pass the prefilter
+            if pid in self.pids_last and pid not in self.pid_profiles:
                 pids_new.add(pid)
                 continue
 
-            try:
-                with open(comm, 'r') as file:
-                    proc_name = file.readline().strip()
-                    if proc_name in self.triggerapps:
-                        self.pid_names[pid] = proc_name
-            except (FileNotFoundError, ProcessLookupError):
-                # FileNotFoundError : process exited before being read
-                # ProcessLookupError: process exited while being open, before readline()
-                if pid in self.pid_names:
-                    _ = self.pid_names.pop(pid)
-            else:
+            proc_name = self._read_comm(pid)
+            if proc_name is None:
+                # process exited before being read
+                self.pid_profiles.pop(pid, None)
+            # Processes of interest get matched again, their cmdline may have changed (exec)
+            elif not self._match(pid, proc_name):
                 pids_new.add(pid)
 
         self.pids_last = pids_new
-        self.triggerapps_found = set(self.pid_names.values())
+        self.last_scan = self.clock()
 
     def reset(self, profiles):
         '''
-        Updates self.triggerapps and clears self.pids_last
+        Rebuilds the trigger index and clears self.pids_last
         useful for hot-reloading profiles
         '''
-        self.__init__(profiles=profiles)
+        self.__init__(profiles=profiles, event_source=self.event_source, reconcile_period=self.reconcile_period,
+                      clock=self.clock)
 
-    def _get_triggerapps(self, profiles=None) -> set:
-        if profiles is None:
-            profiles = config.read_profiles()
-        triggerapps = set()
-        for profile_name in profiles:
-            triggerapps.update([p[:15] for p in profiles[profile_name].triggerapps])
-        return triggerapps
+    def trigger_pids(self, profile: config.PowerProfile) -> list:
+        '''Pids of the running processes that trigger profile'''
+        return [pid for pid, profile_name in self.pid_profiles.items() if profile_name == profile.name]
 
     def triggered_profile(self) -> config.PowerProfile:
         '''Returns triggered PowerProfile object according to running processes'''
-        # Check running processes
-        if self.triggerapps:
-            self.update()
-
-            # check profile trigger apps against procs
-            for profile in self.profiles.values():
-                if profile.triggerapp_present(self.triggerapps_found):
-                    return profile
-            else:
-                return self.profiles['DEFAULT']
-        else:
+        if not self.index:
             return self.profiles['DEFAULT']
-
-
-def already_running(name: str = 'powerplan') -> bool:
-    process_instances = shell.shell("grep -sh . /proc/[0-9]*/comm").splitlines().count(name)
-    return process_instances > 1
+        self.update()
+        # Each pid maps to its highest priority profile already
+        profile_name = self.index.best(set(self.pid_profiles.values()))
+        return self.profiles['DEFAULT' if profile_name is None else profile_name]
@@ -0,0 +1,72 @@
+import time
+from functools import wraps, partial
+
+from ringbuffer import RingStore
+
+'''
+This module holds the Profiler class, which times status field methods and profile
+application steps (wall and cpu time) over a rolling window of calls, so the sysfs read
+or process scan that dominates an iteration on a given machine can be pinned down.
+'''
+
+# Calls kept per timed function
+PROFILE_WINDOW = 1024
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    '''Nearest rank percentile of an already sorted list'''
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Profiler:
+    '''Rolling wall/cpu time samples of named functions'''
+    def __init__(self, window: int = PROFILE_WINDOW):
+        self.window = window
+        self.samples = dict()  # name: RingStore with wall and cpu columns (s)
+
+    def add(self, name: str, wall: float, cpu: float):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = RingStore(dict(wall='d', cpu='d'), length=self.window)
+        samples.append(wall=wall, cpu=cpu)
+
+    def wrap(self, name: str, function):
+        '''Returns function timed under name'''
+        # time.thread_time needs python 3.7
+        thread_time = partial(time.clock_gettime, time.CLOCK_THREAD_CPUTIME_ID)
+        perf_counter, add = time.perf_counter, self.add
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            wall_start, cpu_start = perf_counter(), thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(name, perf_counter() - wall_start, thread_time() - cpu_start)
+        return timed
+
+    def stats(self) -> dict:
+        '''Returns dict of name: dict(calls, wall and cpu p50/p95/max in ms)'''
+        stats = dict()
+        for name, samples in self.samples.items():
+            entry = dict(calls=samples.count)
+            for column in ('wall', 'cpu'):
+                values = sorted(samples[column].window())
+                entry[column] = dict(p50=percentile(values, 0.5) * 1000,
+                                     p95=percentile(values, 0.95) * 1000,
+                                     max=values[-1] * 1000)
+            stats[name] = entry
+        return stats
+
+    def report(self, stats: dict = None) -> str:
+        '''Table of stats (this profiler's if None), slowest p95 wall time first'''
+        stats = self.stats() if stats is None else stats
+        lines = [f'{"":<28}{"calls":>8}  {"wall p50/p95/max (ms)":>24}  {"cpu p50/p95/max (ms)":>24}']
+        for name in sorted(stats, key=lambda name: -stats[name]['wall']['p95']):
+            entry = stats[name]
+            wall, cpu = entry['wall'], entry['cpu']
+            lines.append(f'{name:<28}{entry["calls"]:>8}  '
+                         f'{wall["p50"]:>7.3f} {wall["p95"]:>7.3f} {wall["max"]:>8.3f}  '
+                         f'{cpu["p50"]:>7.3f} {cpu["p95"]:>7.3f} {cpu["max"]:>8.3f}')
+        return '\n'.join(lines)
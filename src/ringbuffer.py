@@ -0,0 +1,191 @@
+import math
+from array import array
+
+'''
+This module holds the RingStore class, a fixed length columnar ring buffer: one typed
+array per numeric column (a plain list for object columns) sharing a single write index,
+so appending a sample never allocates and windows are read straight from the columns.
+'''
+
+# array typecode -> value stored for None
+MISSING = {'d': math.nan, 'q': -2**63, 'b': -1}
+# Typecode of columns holding arbitrary python objects
+OBJECT = 'O'
+
+
+class Column:
+    '''
+    A column of RingStore, indexed like a sequence: 0 is the oldest value, -1 the latest
+    typecode: 'd' (float), 'q' (int), 'b' (bool) or 'O' (object), None values are supported
+    '''
+    def __init__(self, store, name: str, typecode: str):
+        self.store = store
+        self.name = name
+        self.typecode = typecode
+        if typecode == OBJECT:
+            self.data = [None] * store.length
+        else:
+            self.data = array(typecode, [MISSING[typecode]]) * store.length
+
+    def _encode(self, value):
+        if self.typecode == OBJECT:
+            return value
+        return MISSING[self.typecode] if value is None else value
+
+    def _decode(self, value):
+        typecode = self.typecode
+        if typecode == 'd':
+            return None if value != value else value
+        elif typecode == 'b':
+            return None if value < 0 else bool(value)
+        elif typecode == 'q' and value == MISSING['q']:
+            return None
+        return value
+
+    def __len__(self):
+        return self.store.size
+
+    def __bool__(self):
+        return self.store.size > 0
+
+    def __getitem__(self, index: int):
+        return self._decode(self.data[self.store.slot(index)])
+
+    def __iter__(self):
+        return iter(self.window())
+
+    def __repr__(self):
+        return f'Column({self.window()})'
+
+    def window(self, length: int = None) -> list:
+        '''Returns the last length values (every stored value if None), oldest first'''
+        size = self.store.size
+        length = size if length is None else min(length, size)
+        if not length:
+            return []
+        first = self.store.slot(-length)
+        data = self.data
+        if first + length <= self.store.length:
+            raw = data[first:first + length]
+        else:
+            raw = data[first:] + data[:first + length - self.store.length]
+        if self.typecode == OBJECT:
+            return list(raw)
+        decode = self._decode
+        return [decode(value) for value in raw]
+
+    def update(self, value):
+        '''Stream value into the column (see RingStore.write)'''
+        self.store.write(self, value)
+
+    def delta(self, window: int = None):
+        '''Returns the difference between the last and first value of window (the whole buffer if None)'''
+        size = self.store.size
+        window = size if window is None else min(window, size)
+        if window > 1:
+            last, first = self[-1], self[-window]
+            if last is not None and first is not None:
+                return last - first
+        return None
+
+    def changed(self) -> bool:
+        '''Returns true if field's last value is different from the second last one'''
+        if self.store.size > 1:
+            return self[-1] != self[-2]
+        else:
+            return None
+
+    def mean(self, window: int = None) -> float:
+        '''Mean of the non None values in window'''
+        values = [value for value in self.window(window) if value is not None]
+        return sum(values) / len(values) if values else None
+
+    def slope(self, window: int = None, x=None) -> float:
+        '''
+        Least squares slope of the values in window
+        x: column of the same store (e.g. time) to take the slope against, sample index if None
+        '''
+        values = self.window(window)
+        xs = range(len(values)) if x is None else x.window(len(values))
+        points = [(xi, value) for xi, value in zip(xs, values) if value is not None and xi is not None]
+        if len(points) < 2:
+            return None
+        x_mean = sum(xi for xi, _ in points) / len(points)
+        y_mean = sum(value for _, value in points) / len(points)
+        variance = sum((xi - x_mean) ** 2 for xi, _ in points)
+        if not variance:
+            return None
+        return sum((xi - x_mean) * (value - y_mean) for xi, value in points) / variance
+
+
+class RingStore:
+    '''
+    Columns of length samples sharing one write index (head)
+    A row is a sample of every column, values not written in a row carry over from the previous one
+    '''
+    def __init__(self, columns: dict, length: int):
+        '''columns: dict of name: typecode (see Column)'''
+        assert length > 0
+        self.length = length
+        self.count = 0  # total rows appended
+        self.head = -1  # slot of the latest row
+        self.row_fields = set()
+        self.columns = {name: Column(self, name, typecode) for name, typecode in columns.items()}
+
+    def __getitem__(self, name: str) -> Column:
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    @property
+    def size(self) -> int:
+        '''Number of rows stored'''
+        return min(self.count, self.length)
+
+    def slot(self, index: int) -> int:
+        '''Returns the array slot of row index (0: oldest, -1: latest)'''
+        size = self.size
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('RingStore index out of range')
+        return (self.head - size + 1 + index) % self.length
+
+    def advance(self):
+        '''Starts a new row, carrying the latest values over'''
+        previous = self.head
+        self.head = (self.head + 1) % self.length
+        self.count += 1
+        if self.count > 1:
+            head = self.head
+            for column in self.columns.values():
+                column.data[head] = column.data[previous]
+        self.row_fields.clear()
+
+    def write(self, column, value):
+        '''Writes value into the current row, a new row starts if column was already written in it'''
+        if not isinstance(column, Column):
+            column = self.columns[column]
+        if self.count == 0 or column.name in self.row_fields:
+            self.advance()
+        column.data[self.head] = column._encode(value)
+        self.row_fields.add(column.name)
+
+    def append(self, **values):
+        '''Appends a new row with values'''
+        self.advance()
+        for name, value in values.items():
+            column = self.columns[name]
+            column.data[self.head] = column._encode(value)
+            self.row_fields.add(name)
+
+    def rows(self):
+        '''Yields rows as tuples, oldest first'''
+        columns = list(self.columns.values())
+        for index in range(self.size):
+            slot = self.slot(index)
+            yield tuple(column._decode(column.data[slot]) for column in columns)
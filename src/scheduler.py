@@ -0,0 +1,78 @@
+import time
+import ctypes
+import ctypes.util
+
+import log
+
+'''
+This module holds the Scheduler class, which times the daemon's polls on monotonic
+deadlines (immune to wall clock jumps) and stretches the polling period exponentially
+while nothing changes, so an idle system isn't woken up at a fixed rate for hours.
+'''
+
+PR_SET_TIMERSLACK = 29
+# Utilization change (percentage points) between iterations considered a load change
+LOAD_TOLERANCE = 10
+
+
+def set_timer_slack(slack_ns: int) -> bool:
+    '''Sets this thread's timer slack, letting the kernel coalesce its wakeups (0: default slack)'''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return libc.prctl(PR_SET_TIMERSLACK, ctypes.c_ulong(slack_ns), 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+class Scheduler:
+    '''
+    Polling period between pollingperiod and pollingperiod_max of the active profile
+    Doubles on every stable iteration, snaps back to pollingperiod on any change
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.iteration_start = clock()
+        self.period = None
+        self.deadline = None
+        self.timer_slack = None
+        self.wakeups = 0
+
+    def start_iteration(self) -> float:
+        '''Returns the monotonic time the iteration started at'''
+        self.iteration_start = self.clock()
+        self.wakeups += 1
+        return self.iteration_start
+
+    def schedule(self, profile, ac_power: bool, changed: bool) -> float:
+        '''
+        Sets the deadline of the next iteration, returns the polling period (s)
+        changed: something changed during this iteration
+        '''
+        prefix = 'ac_' if ac_power else 'bat_'
+        pollingperiod = getattr(profile, prefix + 'pollingperiod') / 1000
+        pollingperiod_max = getattr(profile, prefix + 'pollingperiod_max') / 1000
+        if changed or self.period is None:
+            self.period = pollingperiod
+        else:
+            self.period = min(max(self.period * 2, pollingperiod), pollingperiod_max)
+        self.deadline = self.iteration_start + self.period
+        self._set_timer_slack(getattr(profile, prefix + 'timerslack'))
+        return self.period
+
+    def _set_timer_slack(self, timer_slack: int):
+        '''timer_slack in ms, only changed through prctl when it differs'''
+        if timer_slack != self.timer_slack:
+            if not set_timer_slack(timer_slack * 1_000_000):
+                log.info(f'Could not set timer slack to {timer_slack}ms.')
+            self.timer_slack = timer_slack
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - self.clock())
+
+
+def load_changed(status) -> bool:
+    '''True if cpu_util_avg moved more than LOAD_TOLERANCE since the previous update'''
+    if 'cpu_util_avg' not in status.fields:
+        return False
+    delta = status.history['cpu_util_avg'].delta(2)
+    return delta is not None and abs(delta) >= LOAD_TOLERANCE
@@ -1,4 +1,8 @@
+import os
 import time
+import errno
+import resource
+from collections import OrderedDict
 from os import getuid
 from subprocess import PIPE, run
 
@@ -10,19 +14,103 @@ def shell(command: str, return_stdout: bool = True) -> str:
 def is_root():
     return getuid() == 0
 
+# Cached handles per cpu: online and the cpufreq attributes, opened for reading and writing
+ATTRIBUTES_PER_CPU = 10
+# Cached handles of attributes that aren't per cpu (hwmon, RAPL, power supply, intel_pstate)
+SHARED_ATTRIBUTES = 64
+
+def default_max_handles() -> int:
+    '''Room for every cpu's attributes, the soft RLIMIT_NOFILE gets raised if they don't fit in half of it'''
+    wanted = (os.cpu_count() or 1) * ATTRIBUTES_PER_CPU + SHARED_ATTRIBUTES
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or 2 * wanted <= soft:
+        return wanted
+    try:
+        soft = 2 * wanted if hard == resource.RLIM_INFINITY else min(2 * wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    except (ValueError, OSError):
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    # The other half is left for sockets, pipes and regular files
+    return min(wanted, soft // 2)
+
+class AttributeCache:
+    '''
+    Keeps sysfs attributes open, re-reads them with pread and writes them with pwrite.
+    Handles are invalidated on errors and reopened once on ENODEV/ENOENT (hotplugged cpus).
+    The least recently used handle is closed past max_handles (default_max_handles if None).
+    '''
+    def __init__(self, max_handles: int = None):
+        self.max_handles = default_max_handles() if max_handles is None else max_handles
+        self.handles = OrderedDict()  # (path, flags): fd, least recently used first
+        self.hits = 0
+        self.opens = 0
+        self.reopens = 0
+        self.evictions = 0
+
+    def _handle(self, path: str, flags: int) -> tuple:
+        '''Returns (fd, cached)'''
+        key = (path, flags)
+        fd = self.handles.get(key)
+        if fd is not None:
+            self.hits += 1
+            self.handles.move_to_end(key)
+            return fd, True
+
+        fd = os.open(path, flags | os.O_CLOEXEC)
+        self.opens += 1
+        if len(self.handles) >= self.max_handles:
+            # Drop the least recently used handle to stay well below RLIMIT_NOFILE
+            _, oldest = self.handles.popitem(last=False)
+            os.close(oldest)
+            self.evictions += 1
+        self.handles[key] = fd
+        return fd, False
+
+    def invalidate(self, path=None, flags: int = None):
+        '''Closes handles of path (all flags if None), or every handle if path is None'''
+        if path is None:
+            keys = list(self.handles)
+        else:
+            path = os.fspath(path)
+            keys = [key for key in self.handles if key[0] == path and flags in (None, key[1])]
+        for key in keys:
+            os.close(self.handles.pop(key))
+
+    def _io(self, path, flags: int, operation):
+        path = os.fspath(path)
+        fd, cached = self._handle(path, flags)
+        try:
+            return operation(fd)
+        except OSError as err:
+            self.invalidate(path, flags)
+            if cached and err.errno in (errno.ENODEV, errno.ENOENT):
+                # Stale handle (e.g. cpu went offline and back online), retry with a fresh one
+                self.reopens += 1
+                return self._io(path, flags, operation)
+            raise
+
+    def read(self, path, size: int = 4096) -> str:
+        return self._io(path, os.O_RDONLY, lambda fd: os.pread(fd, size, 0)).decode('utf-8')
+
+    def write(self, path, value: str):
+        data = str(value).encode('utf-8')
+        self._io(path, os.O_WRONLY, lambda fd: os.pwrite(fd, data, 0))
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, opens=self.opens, reopens=self.reopens,
+                    evictions=self.evictions, open_handles=len(self.handles))
+
+
+attribute_cache = AttributeCache()
+
 def read(path, dtype=str):
     '''Reads first line of path (str or Path), strips and converts to dtype.'''
-    with open(path, "r") as file:
-        data = file.readline().strip()
+    data = attribute_cache.read(path).split('\n', 1)[0].strip()
     return dtype(data)
 
-def path_is_writable(path) -> bool:
-    try:
-        path.write_text(path.read_text())
-    except PermissionError:
-        return False
-    else:
-        return True
+def write(path, value):
+    '''Writes value to path (str or Path) through the attribute cache.'''
+    attribute_cache.write(path, value)
 
 def wait_on_boot(t=10):
     '''Make sure t seconds have passed since boot'''
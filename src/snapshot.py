@@ -0,0 +1,193 @@
+import os
+import mmap
+import time
+import struct
+from datetime import datetime
+from collections import namedtuple
+
+'''
+This module holds the status snapshot shared by the daemon with monitor clients: a fixed
+layout shared memory segment written once per iteration under a seqlock (the sequence
+number is odd while a write is in progress), so readers never see a torn snapshot and
+don't need to read sysfs or /proc themselves.
+
+Layout (little endian):
+    header      magic, version, sequence, max_cpus, writer pid
+    status      time, ac_power, turbo, package power, battery draw, package temp, average utilization,
+                profile name, governor, policy, workload boost state
+    cpus        max_cpus records of online flag, frequency (MHz), utilization (%), indexed by cpu id
+'''
+
+SNAPSHOT_PATH = '/run/powerplan/status'
+MAGIC = b'PPSNAP\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIII')
+STATUS = struct.Struct('<dbbxxffff64s32s32s16s')
+CPU = struct.Struct('<bxxxIf')
+STATUS_OFFSET = 64
+CPUS_OFFSET = STATUS_OFFSET + STATUS.size
+SEQUENCE_OFFSET = 12
+# Seconds a monitor client lease lasts, see SnapshotWriter.lease
+SNAPSHOT_LEASE = 10
+# Reader retries while a write is in progress
+READ_RETRIES = 100
+# Seconds between monitor client redraws
+MONITOR_PERIOD = 1.0
+
+# Stands in for the triggered PowerProfile of SystemStatus
+ProfileView = namedtuple('ProfileView', ['name'])
+
+
+def segment_size(max_cpus: int) -> int:
+    return CPUS_OFFSET + max_cpus * CPU.size
+
+
+def _text(value: str, size: int) -> bytes:
+    return (value or '').encode()[:size]
+
+
+class SnapshotWriter:
+    '''
+    Publishes SystemStatus fields into the shared memory segment at path
+    Only worth doing while a monitor client holds a lease (see lease/leased)
+    '''
+    def __init__(self, max_cpus: int, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self.max_cpus = max_cpus
+        self.lease_end = 0.0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        os.ftruncate(fd, segment_size(max_cpus))
+        self.map = mmap.mmap(fd, segment_size(max_cpus))
+        os.close(fd)
+        self.sequence = 0
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.sequence, max_cpus, os.getpid())
+
+    def lease(self, request=None) -> dict:
+        '''Control socket handler, a client asks for snapshots during the next SNAPSHOT_LEASE seconds'''
+        self.lease_end = time.monotonic() + SNAPSHOT_LEASE
+        return dict(path=self.path, version=VERSION, lease=SNAPSHOT_LEASE)
+
+    def leased(self) -> bool:
+        return time.monotonic() < self.lease_end
+
+    def publish(self, status, workload_state: str = ''):
+        '''Writes the latest values of status, under the seqlock'''
+        query = status.query
+        profile = query('triggered_profile')
+        turbo = query('turbo')
+        ac_power = query('ac_power')
+        values = (query('time') or time.time(),
+                  -1 if ac_power is None else ac_power,
+                  -1 if turbo is None else turbo,
+                  *(float('nan') if query(field) is None else query(field)
+                    for field in ('package_power', 'battery_draw', 'package_temp', 'cpu_util_avg')),
+                  _text(profile.name if profile is not None else '', 64),
+                  _text(query('governor'), 32),
+                  _text(query('policy'), 32),
+                  _text(workload_state, 16))
+        frequencies = query('frequency') or dict()
+        utilization = query('cpu_util_all') or dict()
+        cores_online = set(query('cores_online') or ())
+
+        self._set_sequence(self.sequence + 1)  # odd: write in progress
+        STATUS.pack_into(self.map, STATUS_OFFSET, *values)
+        for cpu_id in range(self.max_cpus):
+            CPU.pack_into(self.map, CPUS_OFFSET + cpu_id * CPU.size, cpu_id in cores_online,
+                          frequencies.get(cpu_id, 0), utilization.get(cpu_id, 0.0))
+        self._set_sequence(self.sequence + 1)
+
+    def _set_sequence(self, sequence: int):
+        self.sequence = sequence & 0xffffffff
+        struct.pack_into('<I', self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        self.map.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class SnapshotView:
+    '''
+    A consistent copy of the snapshot fields, accessed like SystemStatus
+    fields: time, time_stamp, triggered_profile, ac_power, turbo, package_power, battery_draw,
+    package_temp, cpu_util_avg, governor, policy, workload_state, cores_online, frequency, cpu_util_all
+    '''
+    def __init__(self, values: dict):
+        self.values = values
+        self.fields = set(values)
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    def query(self, field):
+        return self.values.get(field)
+
+
+class SnapshotReader:
+    '''Maps the snapshot segment read-only'''
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.max_cpus, self.pid = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or len(self.map) < segment_size(self.max_cpus):
+            self.map.close()
+            raise ValueError(f'{path} is not a version {VERSION} status snapshot')
+        self.view = memoryview(self.map)
+
+    def sequence(self) -> int:
+        return struct.unpack_from('<I', self.map, SEQUENCE_OFFSET)[0]
+
+    def read(self) -> SnapshotView:
+        '''Returns the latest complete snapshot, None if there's none yet or the writer is stuck'''
+        for _ in range(READ_RETRIES):
+            sequence = self.sequence()
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0.0001)
+                continue
+            status = STATUS.unpack_from(self.view, STATUS_OFFSET)
+            cpus = list(CPU.iter_unpack(self.view[CPUS_OFFSET:CPUS_OFFSET + self.max_cpus * CPU.size]))
+            if self.sequence() == sequence:
+                return self._view(status, cpus)
+        return None
+
+    @staticmethod
+    def _view(status: tuple, cpus: list) -> SnapshotView:
+        (time_, ac_power, turbo, package_power, battery_draw, package_temp, cpu_util_avg,
+         profile, governor, policy, workload_state) = status
+        nan_to_none = lambda value: None if value != value else value
+        text = lambda value: value.rstrip(b'\x00').decode(errors='replace')
+        cores_online = [cpu_id for cpu_id, (online, _, _) in enumerate(cpus) if online]
+        return SnapshotView(dict(
+            time=time_,
+            time_stamp=datetime.fromtimestamp(time_).strftime('%H:%M:%S.%f')[:-3],
+            triggered_profile=ProfileView(text(profile)),
+            ac_power=None if ac_power < 0 else bool(ac_power),
+            turbo=None if turbo < 0 else bool(turbo),
+            package_power=nan_to_none(package_power),
+            battery_draw=nan_to_none(battery_draw),
+            package_temp=nan_to_none(package_temp),
+            cpu_util_avg=nan_to_none(cpu_util_avg),
+            governor=text(governor),
+            policy=text(policy),
+            workload_state=text(workload_state),
+            cores_online=cores_online,
+            frequency={cpu_id: cpus[cpu_id][1] for cpu_id in cores_online},
+            cpu_util_all={cpu_id: round(cpus[cpu_id][2], 1) for cpu_id in cores_online}
+        ))
+
+    def writer_alive(self) -> bool:
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def close(self):
+        self.view.release()
+        self.map.close()
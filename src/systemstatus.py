@@ -2,14 +2,40 @@ import csv
 import platform
 from time import time
 from statistics import mean
-from collections import deque
 from datetime import datetime
 import psutil
 
 import log
 from cpu import Cpu
+from applier import Applier
 from __init__ import __version__
 from process import ProcessReader
+from utilization import UtilizationSampler
+from ringbuffer import RingStore, OBJECT
+
+# History column typecodes of numeric builtin fields, the rest are stored as objects
+FIELD_TYPES = dict(
+    time='d',
+    ac_power='b',
+    battery_draw='d',
+    battery_charge_left='d',
+    battery_energy_left='d',
+    package_temp='d',
+    core_temp_max='d',
+    temperature='d',
+    package_power='d',
+    core_power='d',
+    dram_power='d',
+    uncore_power='d',
+    turbo='b',
+    cpu_util_avg='d',
+    cpu_util_max='d',
+    cpu_iowait='d',
+    cpu_irq='d',
+    frequency_range_max='q',
+    frequency_avg='q',
+    frequency_max='q'
+)
 
 def time_stamp():
     return datetime.now().strftime('%H:%M:%S.%f')[:-3]
@@ -18,6 +44,7 @@ class System:
     def __init__(self, cpu: Cpu, powersupply):
         self.cpu = cpu
         self.powersupply = powersupply
+        self.applier = Applier(cpu)
         self.info = self.system_info(self.cpu.spec, self.powersupply)
 
     def system_info(self, cpuspec, powersupply) -> str:
@@ -29,6 +56,7 @@ class System:
             f'powerplan:\t\t{__version__} running on Python{platform.python_version()} with psutil{psutil.__version__}',
             f'CPU model:\t\t{cpuspec.name}',
             f'Core configuraton:\t{cpuspec.physical_cores}/{cpuspec.logical_cores}  {cpuspec.sibling_cores_repr}',
+            f'Core types:\t\t{cpuspec.core_types_repr}' if cpuspec.core_types else None,
             f'Frequency range:\t{cpuspec.freq_range_repr}',
             f'Driver:\t\t{cpuspec.driver_repr}',
             f'Turbo:\t\t{cpuspec.turbo_path}',
@@ -41,59 +69,35 @@ class System:
         return info
 
 
-class History(deque):
-    '''
-    A double ended queue with methods for streaming data,
-    change detection and delta computation
-    '''
-    def __init__(self, maxlen=2):
-        super().__init__(maxlen=maxlen)
-
-    def update(self, value):
-        '''Stream value into deque'''
-        if self.__len__() == self.maxlen:
-            _ = self.popleft()
-            self.append(value)
-        else:
-            self.append(value)
-
-    def delta(self):
-        '''Returns the difference between the last and first value'''
-        if self.__len__() > 1:
-            return self[-1] - self[0]
-        else:
-            return None
-
-    def changed(self) -> bool:
-        '''Returns true if field's last value is different from the second last one'''
-        if self.__len__() > 1:
-            return self[-1] != self[-2]
-        else:
-            return None
-
-
 class SystemStatus():
 
     def __init__(self, system: System, profiles: dict,
-                 fields: list, custom_fields: dict = None, history_len=2):
+                 fields: list, custom_fields: dict = None, history_len=2, event_source=None):
         '''
-        Initializes dict of deques of length history_len
+        Initializes a RingStore with a column of length history_len per field
+        event_source: optional process.ProcEventSource for the internal ProcessReader
         '''
-        assert history_len > 0 or history_len is None
+        assert history_len > 0
         # Hardware components
         self.system = system
         self.cpu: Cpu = system.cpu
         self.rapl = system.cpu.rapl
         self.powersupply = system.powersupply
         self.battery = system.powersupply.battery
-        self.process_reader = ProcessReader(profiles=profiles)
+        self.process_reader = ProcessReader(profiles=profiles, event_source=event_source)
         # Setup fields' history objects
         self._check_custom_fields(custom_fields)
+        self.sources = self._get_sources()
         self.field_methods = self._get_field_methods(fields=fields, custom_fields=custom_fields)
         self.fields = set(self.field_methods.keys())
-        self.history = {field: History(maxlen=history_len) for field in self.field_methods}
+        self.field_sources = self._resolve_sources()
+        self.history = RingStore({field: FIELD_TYPES.get(field, OBJECT) for field in self.field_methods},
+                                 length=history_len)
         self.history_len = history_len
         self.partially_updated = set()
+        # Latest value of each source, and the fields already computed from it
+        self.samples = dict()
+        self.sample_readers = dict()
 
     def __getitem__(self, field):
         '''Get latest value of field'''
@@ -102,55 +106,114 @@ class SystemStatus():
 
     def _check_custom_fields(self, custom_fields: dict):
         '''
-        check that custom fields are correct
+        check that custom fields are correct: dict{field: (callable, kwargs)} read on their own,
+        or dict{field: (callable, kwargs, depends)} computed from the values of depends
+        (names of sources or fields, see _get_sources and _get_field_methods)
         '''
         if custom_fields is None:
             return
         if type(custom_fields) is not dict:
             log.error('custom_fields must be of type dict.')
-        for key in custom_fields:
-            value = custom_fields[key]
-            if (type(value) is not tuple) or (len(value) != 2) or (not callable(value[1])):
-                log.error(f'Value of {key} in custom_fields must be a tuple of length 2 (name, callable).')
-            if type(value[0]) is not str:
+        for key, value in custom_fields.items():
+            if type(key) is not str:
                 log.error('Keys in custom_fields must be of type str.')
+            if ((type(value) is not tuple) or (len(value) not in (2, 3))
+                    or (not callable(value[0])) or (type(value[1]) is not dict)):
+                log.error(f'Value of {key} in custom_fields must be a tuple (callable, kwargs) '
+                          'or (callable, kwargs, depends).')
+
+    def _get_sources(self) -> dict:
+        '''
+        Raw sources, dict{source: (function, kwargs)}
+        Each one is sampled at most once per update and shared by the fields derived from it
+        '''
+        return dict(
+            cpuinfo=(self.cpu.read_current_freq, {}),
+            proc_stat=(self._sample_utilization, {}),
+            rapl=(self.rapl.read_powers, {}),
+            freq_range=(self.cpu.read_freq_range, {})
+        )
+
+    def _sample_utilization(self) -> UtilizationSampler:
+        self.cpu.utilization.sample()
+        return self.cpu.utilization
 
     def _get_field_methods(self, fields: list, custom_fields: dict) -> dict:
-        # dict{field:(function, kwargs)}
+        '''
+        Returns dict{field: (function, kwargs, depends)} of fields, also keeps every builtin
+        and custom field in self.nodes (derived fields can depend on fields not in fields)
+        Fields with depends get the values of those sources or fields as positional arguments
+        '''
         builtin_fields = dict(
-            time=(time, {}),
-            time_stamp=(time_stamp, {}),
-            triggered_profile=(self.process_reader.triggered_profile, {}),
+            time=(time, {}, ()),
+            time_stamp=(time_stamp, {}, ()),
+            triggered_profile=(self.process_reader.triggered_profile, {}, ()),
             # Battery
-            ac_power=(self.powersupply.ac_power, {}),
-            battery_draw=(self.battery.power_draw, {}),
-            battery_charge_left=(self.battery.charge_left, {}),
-            battery_energy_left=(self.battery.energy_left, {}),
-            # RAPL
-            package_temp=(self.cpu.read_temperature, {}),
-            package_power=(self.rapl.read_power, {}),
-            core_power=(self.rapl.read_power, {'name': 'core'}),
-            dram_power=(self.rapl.read_power, {'name': 'dram'}),
-            uncore_power=(self.rapl.read_power, {'name': 'uncore'}),
+            ac_power=(self.powersupply.ac_power, {}, ()),
+            battery_draw=(self.battery.power_draw, {}, ()),
+            battery_charge_left=(self.battery.charge_left, {}, ()),
+            battery_energy_left=(self.battery.energy_left, {}, ()),
+            # Temperature
+            package_temp=(self.cpu.read_temperature, {}, ()),
+            core_temp_max=(self.cpu.read_temperature, {'source': 'max'}, ()),
+            core_temps=(self.cpu.read_core_temperatures, {}, ()),
+            temperature=(self._profile_temperature, {}, ()),
+            # RAPL, every layer read at once
+            package_power=(lambda powers: powers.get('package-0'), {}, ('rapl',)),
+            core_power=(lambda powers: powers.get('core'), {}, ('rapl',)),
+            dram_power=(lambda powers: powers.get('dram'), {}, ('rapl',)),
+            uncore_power=(lambda powers: powers.get('uncore'), {}, ('rapl',)),
             # Configurables
-            frequency=(self.cpu.read_current_freq, {}),
-            governor=(self.cpu.read_governor, {}),
-            policy=(self.cpu.read_policy, {}),
-            cores_online=(self.cpu.list_cores, {'status': 'online'}),
-            turbo=(self.cpu.read_turbo_state, {}),
-            cpu_util_all=(self.cpu.read_cpu_utilization, {'mode': 'all'}),
-            cpu_util_avg=(self.cpu.read_cpu_utilization, {'mode': 'avg'}),
-            cpu_util_max=(self.cpu.read_cpu_utilization, {'mode': 'max'}),
+            frequency=(lambda frequencies: frequencies, {}, ('cpuinfo',)),
+            governor=(self.cpu.read_governor, {}, ()),
+            policy=(self.cpu.read_policy, {}, ()),
+            cores_online=(self.cpu.list_cores, {'status': 'online'}, ()),
+            turbo=(self.cpu.read_turbo_state, {}, ()),
+            # Utilization, views of the same /proc/stat sample
+            cpu_util_all=(UtilizationSampler.per_cpu, {}, ('proc_stat',)),
+            cpu_util_avg=(UtilizationSampler.average, {}, ('proc_stat',)),
+            cpu_util_max=(UtilizationSampler.maximum, {}, ('proc_stat',)),
+            cpu_iowait=(lambda sampler: round(sampler.iowait_average, 1), {}, ('proc_stat',)),
+            cpu_irq=(lambda sampler: round(sampler.irq_average, 1), {}, ('proc_stat',)),
             # Split read freq range in min and max
-            frequency_range_max=(lambda: self.cpu.read_freq_range()[1], {}),
-            frequency_avg=(lambda: int(mean(self.cpu.read_current_freq().values())), {}),
-            frequency_max=(lambda: int(max(self.cpu.read_current_freq().values())), {})
+            frequency_range_max=(lambda freq_range: freq_range[1], {}, ('freq_range',)),
+            frequency_avg=(lambda frequencies: int(mean(frequencies.values())), {}, ('frequency',)),
+            frequency_max=(lambda frequencies: int(max(frequencies.values())), {}, ('frequency',))
         )
-
-        field_methods = {key: builtin_fields[key] for key in builtin_fields if key in fields}
         if custom_fields is not None:
-            field_methods.update(custom_fields)
-        return field_methods
+            builtin_fields.update({key: tuple(value) + ((),) * (3 - len(value)) for key, value in custom_fields.items()})
+        self.nodes = builtin_fields
+        return {key: self.nodes[key] for key in self.nodes if key in fields or key in (custom_fields or ())}
+
+    def _resolve_sources(self) -> dict:
+        '''Returns dict{field: set of the sources it's derived from}, fields must form a DAG'''
+        resolved = dict()
+
+        def resolve(name: str, path: tuple) -> set:
+            if name in path:
+                log.error(f'Circular field dependency: {" -> ".join(path + (name,))}.')
+            if name not in resolved:
+                if name in self.sources:
+                    resolved[name] = {name}
+                elif name in self.nodes:
+                    depends = self.nodes[name][2]
+                    resolved[name] = set().union(*(resolve(depend, path + (name,)) for depend in depends))
+                else:
+                    log.error(f'Field {path[-1]} depends on unknown field or source {name}.')
+            return resolved[name]
+        return {field: resolve(field, ()) for field in self.field_methods}
+
+    def enable_profiling(self, profiler):
+        '''Times every field method and source with profiler (profiling.Profiler)'''
+        for field, (function, kwargs, depends) in self.field_methods.items():
+            self.nodes[field] = self.field_methods[field] = (profiler.wrap('field:' + field, function), kwargs, depends)
+        for source, (function, kwargs) in self.sources.items():
+            self.sources[source] = (profiler.wrap('source:' + source, function), kwargs)
+
+    def _profile_temperature(self) -> float:
+        '''Temperature read from the triggered profile's temp_source'''
+        profile = self.query('triggered_profile') if 'triggered_profile' in self.fields else None
+        return self.cpu.read_temperature('package' if profile is None else profile.temp_source)
 
     def reset(self, profiles=None):
         '''Resets internal processReader, needed for hot reloading'''
@@ -158,13 +221,39 @@ class SystemStatus():
             self.process_reader.reset(profiles)
         self.partially_updated = set()
 
+    def _sample_sources(self, fields, resample: bool = False):
+        '''
+        Samples the sources fields are derived from, unless resample is False and their
+        last sample hasn't been used by any of fields yet (fields updated separately share it)
+        '''
+        for source in set().union(*(self.field_sources[field] for field in fields)):
+            if resample or source not in self.samples or not self.sample_readers[source].isdisjoint(fields):
+                function, kwargs = self.sources[source]
+                self.samples[source] = function(**kwargs)
+                self.sample_readers[source] = set()
+            self.sample_readers[source].update(field for field in fields if source in self.field_sources[field])
+
+    def _value(self, name: str, values: dict):
+        '''Value of a source or field, fields computed during this update are kept in values'''
+        if name in self.sources:
+            return self.samples[name]
+        if name not in values:
+            function, kwargs, depends = self.nodes[name]
+            values[name] = function(*(self._value(depend, values) for depend in depends), **kwargs)
+        return values[name]
+
+    def _update_fields(self, fields, resample: bool = False):
+        self._sample_sources(fields, resample)
+        values = dict()
+        for key in fields:
+            self.history[key].update(self._value(key, values))
+
     def update(self):
         '''
-        Updates all fielfds' history
+        Updates all fielfds' history, sampling every source again
         '''
-        for key in self.history:
-            func, kwargs = self.field_methods[key]
-            self.history[key].update(func(**kwargs))
+        self.history.advance()
+        self._update_fields(list(self.history), resample=True)
         self.partially_updated = set()
 
     def partial_update(self, fields: list = None):
@@ -182,9 +271,7 @@ class SystemStatus():
                 self.partially_updated = set()
 
         # Update status of fields
-        for key in fields:
-            func, kwargs = self.field_methods[key]
-            self.history[key].update(func(**kwargs))
+        self._update_fields(fields)
 
     def manual_partial_update(self, field_values: dict):
         '''Updates fields' with provided values'''
@@ -215,6 +302,14 @@ class SystemStatus():
         else:
             return None
 
+    def mean(self, field, window: int = None) -> float:
+        '''Mean of field over the last window samples (whole history if None)'''
+        return self.history[field].mean(window)
+
+    def slope(self, field, window: int = None) -> float:
+        '''Rate of change of field per second over the last window samples, needs the time field'''
+        return self.history[field].slope(window, x=self.history['time'])
+
     def save(self, file_name: str):
         '''
         Saves history as a CSV file
@@ -222,21 +317,24 @@ class SystemStatus():
         with open(file_name, 'w', newline='') as file:
             writer = csv.writer(file, delimiter=',')
             # Write header
-            writer.writerow(self.history.keys())
-            # and data
-            writer.writerows(zip(*self.history.values()))
+            writer.writerow(self.history.columns.keys())
+            # and data, row by row straight from the columns
+            writer.writerows(self.history.rows())
 
 class StatusMinimal(SystemStatus):
-    def __init__(self, system: System, profiles: dict):
-        fields = ('triggered_profile', 'ac_power')
-        super().__init__(system, profiles, fields)
+    def __init__(self, system: System, profiles: dict, event_source=None):
+        fields = ('triggered_profile', 'ac_power', 'cpu_util_avg', 'temperature')
+        super().__init__(system, profiles, fields, event_source=event_source)
 
 class StatusMonitor(SystemStatus):
-    def __init__(self, system: System, profiles: dict):
+    def __init__(self, system: System, profiles: dict, event_source=None):
         fields = ['time_stamp',
                   'frequency',
                   'triggered_profile',
                   'ac_power',
+                  'cpu_util_all',
+                  'cpu_util_avg',
+                  'temperature',
                   'governor',
                   'policy',
                   'cores_online',
@@ -244,14 +342,24 @@ class StatusMonitor(SystemStatus):
                   'package_power',
                   'battery_draw',
                   'package_temp']
-        super().__init__(system, profiles, fields)
+        super().__init__(system, profiles, fields, event_source=event_source)
 
-class StatusLog(SystemStatus):
-    def __init__(self, system: System, profiles: dict):
+class StatusDaemon(SystemStatus):
+    '''
+    Every field the daemon may need: monitoring, telemetry, metrics and the status snapshot
+    Each field gets updated by the source that needs it, on its own cadence (see daemon.Daemon)
+    '''
+    def __init__(self, system: System, profiles: dict, event_source=None):
         fields = ['time',
-                  'cores_online',
-                  'frequency',
+                  'time_stamp',
+                  'triggered_profile',
                   'ac_power',
+                  'cpu_util_all',
+                  'cpu_util_avg',
+                  'temperature',
+                  'frequency',
+                  'frequency_avg',
+                  'frequency_max',
                   'governor',
                   'policy',
                   'cores_online',
@@ -259,4 +367,19 @@ class StatusLog(SystemStatus):
                   'package_power',
                   'battery_draw',
                   'package_temp']
-        super().__init__(system, profiles, fields)
+        super().__init__(system, profiles, fields, event_source=event_source)
+
+class StatusLog(SystemStatus):
+    '''Telemetry fields (see telemetry.SCHEMA), long history: one hour at the default 1s polling period'''
+    def __init__(self, system: System, profiles: dict, history_len=3600, event_source=None):
+        fields = ['time',
+                  'triggered_profile',
+                  'ac_power',
+                  'cpu_util_avg',
+                  'frequency_avg',
+                  'frequency_max',
+                  'package_power',
+                  'battery_draw',
+                  'package_temp',
+                  'temperature']
+        super().__init__(system, profiles, fields, history_len=history_len, event_source=event_source)
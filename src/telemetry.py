@@ -0,0 +1,234 @@
+import os
+import csv
+import mmap
+import math
+import time
+import zlib
+import struct
+
+import log
+
+'''
+This module holds the telemetry recorder, which streams status fields into fixed schema
+binary segment files (preallocated and memory-mapped, rotated by size and age), and the
+streaming reader used to export them as CSV.
+
+Segment layout:
+    [0, 256)    file header: magic, version, record size, capacity, schema ("field:code,...")
+    [256, 320)  two commit slots: sequence, count, first and last record time, crc32
+    [512, ...)  capacity fixed size records
+Records are written before their commit slot, slots are written alternately,
+so a crash in between leaves at least the previous commit intact.
+'''
+
+TELEMETRY_DIR = '/var/lib/powerplan/telemetry/'
+MAGIC = b'PPLOG\x00\x00\x00'
+VERSION = 1
+# field, struct code (d/f: float, b: bool). Missing values are stored as NaN (-1 for bools)
+SCHEMA = (
+    ('time', 'd'),
+    ('ac_power', 'b'),
+    ('cpu_util_avg', 'f'),
+    ('frequency_avg', 'f'),
+    ('frequency_max', 'f'),
+    ('package_power', 'f'),
+    ('battery_draw', 'f'),
+    ('package_temp', 'f'),
+    ('temperature', 'f')
+)
+# One day per segment at 1Hz, four weeks of segments
+SEGMENT_RECORDS = 86400
+SEGMENT_SECONDS = 86400
+MAX_SEGMENTS = 28
+# Records between msync calls
+SYNC_RECORDS = 60
+
+FILE_HEADER = struct.Struct('<8sHHI240s')
+COMMIT_SLOT = struct.Struct('<QIddI')
+COMMIT_OFFSET = FILE_HEADER.size
+DATA_OFFSET = 512
+
+
+def schema_string(schema) -> str:
+    return ','.join(f'{field}:{code}' for field, code in schema)
+
+
+def parse_schema(schema: str) -> tuple:
+    return tuple(tuple(column.split(':')) for column in schema.split(','))
+
+
+def record_struct(schema) -> struct.Struct:
+    return struct.Struct('<' + ''.join(code for _, code in schema))
+
+
+def _slot_crc(sequence, count, first_time, last_time) -> int:
+    return zlib.crc32(COMMIT_SLOT.pack(sequence, count, first_time, last_time, 0)[:-4])
+
+
+class TelemetryRecorder:
+    '''
+    Streams the SCHEMA fields of a SystemStatus into segment files of directory
+    A new segment starts after segment_records records or segment_seconds seconds,
+    only the last max_segments segments are kept
+    '''
+    def __init__(self, directory: str = TELEMETRY_DIR, segment_records: int = SEGMENT_RECORDS,
+                 segment_seconds: int = SEGMENT_SECONDS, max_segments: int = MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.record_struct = record_struct(SCHEMA)
+        self.segment_path = None
+        self.file = None
+        self.map = None
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _new_segment(self, now: float):
+        self.close()
+        self.segment_path = os.path.join(self.directory, f'segment-{int(now * 1000)}.ppl')
+        size = DATA_OFFSET + self.segment_records * self.record_struct.size
+        fd = os.open(self.segment_path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o644)
+        try:
+            # Reserve the blocks now, so the segment can't run out of disk space later on
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            os.ftruncate(fd, size)
+        self.file = os.fdopen(fd, 'r+b')
+        self.map = mmap.mmap(fd, size)
+        self.map[:FILE_HEADER.size] = FILE_HEADER.pack(MAGIC, VERSION, self.record_struct.size,
+                                                       self.segment_records, schema_string(SCHEMA).encode())
+        self.sequence = 0
+        self.records = 0
+        self.first_time = now
+        self._commit(now)
+        self.map.flush()
+        self._remove_old_segments()
+
+    def _commit(self, last_time: float):
+        '''Writes the record count into the oldest commit slot'''
+        self.sequence += 1
+        offset = COMMIT_OFFSET + (self.sequence % 2) * COMMIT_SLOT.size
+        crc = _slot_crc(self.sequence, self.records, self.first_time, last_time)
+        self.map[offset:offset + COMMIT_SLOT.size] = COMMIT_SLOT.pack(self.sequence, self.records,
+                                                                      self.first_time, last_time, crc)
+
+    def _remove_old_segments(self):
+        segments = list_segments(self.directory)
+        for path in segments[:max(0, len(segments) - self.max_segments)]:
+            try:
+                os.unlink(path)
+            except OSError as err:
+                log.info(f'Could not remove telemetry segment {path}: {err}')
+
+    def record(self, status):
+        '''Appends the latest values of status' SCHEMA fields, fields status doesn't have are missing'''
+        now = time.time()
+        if (self.map is None or self.records >= self.segment_records
+                or now - self.first_time >= self.segment_seconds):
+            self._new_segment(now)
+
+        values = []
+        for field, code in SCHEMA:
+            value = now if field == 'time' else (status.query(field) if field in status.fields else None)
+            if code == 'b':
+                values.append(-1 if value is None else bool(value))
+            else:
+                values.append(math.nan if value is None else value)
+        offset = DATA_OFFSET + self.records * self.record_struct.size
+        self.record_struct.pack_into(self.map, offset, *values)
+        self.records += 1
+        self._commit(now)
+        if self.records % SYNC_RECORDS == 0:
+            self.map.flush()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = self.file = None
+
+
+# Reader
+
+def list_segments(directory: str = TELEMETRY_DIR) -> list:
+    '''Returns segment paths of directory, oldest first'''
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = [name for name in names if name.startswith('segment-') and name.endswith('.ppl')]
+    segments.sort(key=lambda name: int(name[8:-4]))
+    return [os.path.join(directory, name) for name in segments]
+
+
+def read_header(data) -> tuple:
+    '''Returns (schema, capacity, committed record count) of a segment, None if it isn't valid'''
+    if len(data) < DATA_OFFSET:
+        return None
+    magic, version, record_size, capacity, schema = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    schema = parse_schema(schema.rstrip(b'\x00').decode())
+    if record_struct(schema).size != record_size:
+        return None
+    count = None
+    sequence = -1
+    for slot in range(2):
+        slot_values = COMMIT_SLOT.unpack_from(data, COMMIT_OFFSET + slot * COMMIT_SLOT.size)
+        if slot_values[-1] == _slot_crc(*slot_values[:-1]) and slot_values[0] > sequence:
+            sequence, count = slot_values[0], slot_values[1]
+    if count is None:
+        return None
+    count = min(count, capacity, (len(data) - DATA_OFFSET) // record_size)
+    return schema, capacity, count
+
+
+def read_segment(path: str):
+    '''Yields (schema, record tuples) of the committed records of a segment file'''
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < DATA_OFFSET:
+            log.warning(f'Skipping truncated telemetry segment {path}.')
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header = read_header(data)
+            if header is None:
+                log.warning(f'Skipping invalid telemetry segment {path}.')
+                return
+            schema, _, count = header
+            unpack = record_struct(schema)
+            end = DATA_OFFSET + count * unpack.size
+            for record in unpack.iter_unpack(data[DATA_OFFSET:end]):
+                yield schema, record
+
+
+def read_records(directory: str = TELEMETRY_DIR, start: float = None, end: float = None):
+    '''Yields records of every segment as dicts of field: value (None if missing), oldest first'''
+    for path in list_segments(directory):
+        for schema, record in read_segment(path):
+            record = {field: _decode(value, code) for (field, code), value in zip(schema, record)}
+            if start is not None and record['time'] < start:
+                continue
+            if end is not None and record['time'] > end:
+                return
+            yield record
+
+
+def _decode(value, code):
+    if code == 'b':
+        return None if value < 0 else bool(value)
+    return None if value != value else value
+
+
+def export_csv(file_name: str, directory: str = TELEMETRY_DIR, start: float = None, end: float = None) -> int:
+    '''Writes records as CSV (columns from the current SCHEMA), returns the number of records'''
+    fields = [field for field, _ in SCHEMA]
+    records = 0
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter=',')
+        writer.writerow(fields)
+        for record in read_records(directory, start, end):
+            writer.writerow(['' if record.get(field) is None else record[field] for field in fields])
+            records += 1
+    return records
@@ -0,0 +1,88 @@
+import re
+
+import log
+from hardware import read, exists, glob
+
+'''
+This module holds the TemperatureSensor class, which reads the temp*_input files of a
+single hwmon chip (resolved once) instead of enumerating every hwmon device each time.
+'''
+
+HWMON_DIR = '/sys/class/hwmon/'
+# the order in this list embodies lookup priority
+KNOWN_SENSORS = ['coretemp', 'k10temp', 'zenpower', 'acpitz', 'thinkpad']
+# temp*_label prefixes of package and per core (or per CCD) temperatures
+PACKAGE_LABELS = ('Package id', 'Tctl', 'Tdie')
+CORE_LABELS = ('Core', 'Tccd')
+# package: package temperature, max: hottest core, first: first input of the chip
+TEMP_SOURCES = ['package', 'max', 'first']
+
+
+def detect_sensors() -> dict:
+    '''Returns dict of hwmon chip name: list of hwmon dirs (a chip can have one per package)'''
+    sensors = dict()
+    for name_path in glob(HWMON_DIR + 'hwmon*/name'):
+        sensors.setdefault(read(name_path), []).append(name_path.rsplit('/', 1)[0])
+    return sensors
+
+
+def preferred_sensor(sensors: dict) -> str:
+    '''Returns first available sensor in KNOWN_SENSORS, or None'''
+    for sensor in KNOWN_SENSORS:
+        if sensor in sensors:
+            return sensor
+    else:
+        msg = ("Couldn't detect a known CPU temperature sensor."
+               f"\n\tKnown CPU temp sensors are: {KNOWN_SENSORS}"
+               f"\n\tDetected sensors were: {list(sensors)}"
+               "\n\tPlease open an issue at https://www.github.org/haptein/powerplan")
+        log.warning(msg)
+        return None
+
+
+class TemperatureSensor:
+    '''
+    Temperature inputs of a hwmon chip, read through the attribute cache
+    name: chip name, hwmon_dirs: the chip's hwmon dirs
+    '''
+    def __init__(self, name: str, hwmon_dirs: list):
+        self.name = name
+        self.inputs = dict()  # label: temp*_input path
+        for hwmon_dir in hwmon_dirs:
+            input_paths = glob(hwmon_dir + '/temp*_input')
+            # Sort by input number, not lexicographically (temp10 after temp9)
+            input_paths.sort(key=lambda path: int(re.search(r'temp(\d+)_input$', path).group(1)))
+            for input_path in input_paths:
+                label_path = input_path.replace('_input', '_label')
+                label = read(label_path) if exists(label_path) else input_path.rsplit('/', 1)[-1][:-6]
+                # Keep labels unique on multi-package systems
+                while label in self.inputs:
+                    label += "'"
+                self.inputs[label] = input_path
+
+        self.first_input = next(iter(self.inputs.values()), None)
+        self.package_input = next((path for label, path in self.inputs.items()
+                                   if label.startswith(PACKAGE_LABELS)), self.first_input)
+        self.core_inputs = {label: path for label, path in self.inputs.items() if label.startswith(CORE_LABELS)}
+
+    def critical(self) -> int:
+        '''Returns critical temperature of the package input, None if unavailable'''
+        if self.package_input is None:
+            return None
+        crit_path = self.package_input.replace('_input', '_crit')
+        if exists(crit_path):
+            return read(crit_path, int) // 1000
+        return None
+
+    def read(self, source: str = 'package') -> float:
+        '''Returns temperature (°C) according to source (see TEMP_SOURCES)'''
+        if source == 'max' and self.core_inputs:
+            return max(self.read_cores().values())
+        elif source == 'first':
+            return read(self.first_input, int) / 1000
+        else:
+            return read(self.package_input, int) / 1000
+
+    def read_cores(self) -> dict:
+        '''Returns dict of label: temperature of per core inputs'''
+        return {label: read(path, int) / 1000 for label, path in self.core_inputs.items()}
@@ -0,0 +1,154 @@
+from time import monotonic
+
+import log
+
+'''
+This module holds the ThermalController class, a PID controller that holds the
+temperature at the profile's templimit by capping one actuator (max frequency,
+intel_pstate max perf or RAPL PL1) smoothly, before the hardware throttles on PROCHOT.
+'''
+
+# freq: scaling_max_freq, perf: intel_pstate max_perf_pct, tdp: RAPL PL1
+THERMAL_ACTUATORS = ['auto', 'freq', 'perf', 'tdp']
+# Gains, the controller output is a throttle fraction in [0, 1] of the actuator's range
+KP = 0.04   # per °C above target
+KI = 0.004  # per °C·s
+KD = 0.02   # per °C/s of temperature rise
+# Max throttle change per second
+SLEW_RATE = 0.2
+# Actuator granularity, avoids a sysfs write on every tiny output change
+FREQ_STEP = 100_000  # kHz
+# PL1 never gets capped below this fraction of its ceiling
+TDP_FLOOR = 0.25
+# °C under target from which the temperature needs fast sampling
+ENGAGE_MARGIN = 10
+
+
+class ThermalController:
+    '''
+    PID controller with anti-windup (conditional integration) and output slew-rate limiting
+    throttle: 0 leaves the profile untouched, 1 caps the actuator at the bottom of its range
+    '''
+    def __init__(self, cpu, clock=monotonic):
+        self.cpu = cpu
+        self.clock = clock
+        # PL1/PL2 found at start, ceiling for profiles that leave tdp limits untouched
+        self.tdp_limits = cpu.read_tdp_limits()
+        # A PL1 cap was written and hasn't been restored yet, outlives reset()
+        self.tdp_capped = False
+        self.capping_tdp = False
+        self.reset()
+
+    def reset(self):
+        self.throttle = 0.0
+        self.integral = 0.0
+        self.last_temperature = None
+        self.last_time = None
+        self.step = 0
+
+    def actuator(self, profile) -> str:
+        '''Resolves profile.thermal_actuator, auto picks max_perf_pct on intel_pstate'''
+        if profile.thermal_actuator != 'auto':
+            return profile.thermal_actuator
+        return 'perf' if self.cpu.spec.driver == 'intel_pstate' else 'freq'
+
+    def active(self, profile, ac_power: bool) -> bool:
+        '''Thermal control is disabled by a zero templimit or a missing temperature sensor'''
+        return bool(profile.ac_templimit if ac_power else profile.bat_templimit) and self.cpu.temperature is not None
+
+    def engaged(self, profile, ac_power: bool) -> bool:
+        '''Whether the temperature needs fast sampling: within ENGAGE_MARGIN of target, or throttling'''
+        if not self.active(profile, ac_power) or self.last_temperature is None:
+            return False
+        target = profile.ac_templimit if ac_power else profile.bat_templimit
+        return self.throttle > 0 or self.last_temperature >= target - ENGAGE_MARGIN
+
+    def update(self, profile, status) -> bool:
+        '''
+        Steps the controller with the latest temperature of status
+        returns True if the actuator cap changed and the profile needs to be re-applied
+        '''
+        ac_power = status['ac_power']
+        temperature = status['temperature'] if self.active(profile, ac_power) else -1
+        if temperature < 0:
+            changed = self.step != 0
+            self.reset()
+            return changed
+
+        now = self.clock()
+        target = profile.ac_templimit if ac_power else profile.bat_templimit
+        error = temperature - target
+        dt = 0.0 if self.last_time is None else now - self.last_time
+        rise = 0.0 if not dt else (temperature - self.last_temperature) / dt
+        self.last_time, self.last_temperature = now, temperature
+
+        # Anti-windup: don't integrate further into a saturated output
+        proportional = KP * error
+        unclamped = proportional + self.integral + KI * error * dt + KD * rise
+        if 0.0 < unclamped < 1.0 or (unclamped >= 1.0) != (error > 0):
+            self.integral = min(max(self.integral + KI * error * dt, 0.0), 1.0)
+        output = min(max(proportional + self.integral + KD * rise, 0.0), 1.0)
+
+        # Slew-rate limit, the first sample can't move the output at all
+        max_change = SLEW_RATE * dt
+        self.throttle += min(max(output - self.throttle, -max_change), max_change)
+
+        step = self._quantize(profile, ac_power)
+        changed = step != self.step
+        if changed and self.step == 0:
+            log.info(f'Temperature {temperature}°C approaching target {target}°C, capping {self.actuator(profile)}.')
+        elif changed and step == 0:
+            log.info(f'Temperature {temperature}°C under control, {self.actuator(profile)} cap lifted.')
+        self.step = step
+        return changed
+
+    def _quantize(self, profile, ac_power: bool) -> int:
+        '''Returns the throttle as a number of actuator steps below the profile's maximum'''
+        prefix = 'ac_' if ac_power else 'bat_'
+        actuator = self.actuator(profile)
+        if actuator == 'freq':
+            span = getattr(profile, prefix + 'maxfreq') - getattr(profile, prefix + 'minfreq')
+            return int(self.throttle * span) // FREQ_STEP
+        elif actuator == 'perf':
+            span = getattr(profile, prefix + 'maxperf') - getattr(profile, prefix + 'minperf')
+            return int(self.throttle * span)
+        else:
+            ceiling = self._tdp_ceiling(profile, ac_power)
+            return 0 if ceiling is None else int(self.throttle * ceiling * (1 - TDP_FLOOR))
+
+    def _tdp_ceiling(self, profile, ac_power: bool) -> int:
+        prefix = 'ac_' if ac_power else 'bat_'
+        # Zero limits mean the profile leaves them untouched
+        if getattr(profile, prefix + 'tdp_sustained') and getattr(profile, prefix + 'tdp_burst'):
+            return getattr(profile, prefix + 'tdp_sustained')
+        return None if self.tdp_limits is None else self.tdp_limits[0]
+
+    def limit(self, desired_state: dict, profile, ac_power: bool) -> dict:
+        '''
+        Returns desired_state with the actuator capped by the current throttle
+        Profiles leaving tdp limits untouched get the limits found at start back after a PL1 cap
+        '''
+        actuator = self.actuator(profile)
+        self.capping_tdp = bool(self.step) and actuator not in ('freq', 'perf')
+        if not self.capping_tdp and self.tdp_capped and desired_state['tdp_limits'] is None:
+            desired_state = dict(desired_state, tdp_limits=self.tdp_limits)
+        if not self.step:
+            return desired_state
+        desired_state = dict(desired_state)
+        if actuator == 'freq':
+            min_freq, max_freq = desired_state['freq_range']
+            desired_state['freq_range'] = (min_freq, max(min_freq, max_freq - self.step * FREQ_STEP))
+        elif actuator == 'perf':
+            min_perf, max_perf = desired_state['perf_range']
+            desired_state['perf_range'] = (min_perf, max(min_perf, max_perf - self.step))
+        else:
+            PL1, PL2 = desired_state['tdp_limits'] or self.tdp_limits
+            desired_state['tdp_limits'] = (max(1, PL1 - self.step), PL2)
+        return desired_state
+
+    def applied(self, success: bool):
+        '''Called after the state returned by limit() got applied, success: without errors'''
+        if self.capping_tdp:
+            self.tdp_capped = True
+        elif success:
+            self.tdp_capped = False
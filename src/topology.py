@@ -0,0 +1,128 @@
+from hardware import read, exists
+
+'''
+This module holds the cpu topology helpers: cpu list parsing, core type detection on
+hybrid cpus (intel P/E cores, arm big.LITTLE) and cache domain detection (package, die,
+last level cache, cluster). Both decide the order physical cores get onlined in, so a
+reduced cores_online keeps the core type the profile prefers and the online cores packed
+in as few cache domains as possible, letting the emptied ones reach deep idle states.
+'''
+
+CPU_DIR = '/sys/devices/system/cpu/'
+# Intel hybrid cpus register one PMU per core type, each listing its cpus
+INTEL_CORE_CPUS = '/sys/devices/cpu_core/cpus'
+INTEL_ATOM_CPUS = '/sys/devices/cpu_atom/cpus'
+# Per cpu attributes telling core types apart, in lookup order
+CORE_TYPE_ATTRIBUTES = ('cpu_capacity', 'cpufreq/cpuinfo_max_freq')
+# Max/min ratio of the attribute above which cores are considered of different types,
+# so favored cores (slightly higher max frequency) of an homogeneous cpu aren't taken as hybrid
+HYBRID_RATIO = 1.25
+CORE_PREFERENCES = ('none', 'performance', 'efficiency')
+
+
+def cpu_ranges_to_list(cpu_ranges: str) -> list:
+    '''Parses virtual cpu's (offline,online,present) files formatting '''
+    cpus = []
+    for cpu_range in cpu_ranges:
+        if '-' in cpu_range:
+            start, end = cpu_range.split('-')
+            cpus.extend(list(range(int(start), int(end)+1)))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def detect_core_types(thread_siblings: list) -> list:
+    '''
+    Returns the type (performance or efficiency) of each physical core in thread_siblings,
+    an empty list if all cores are of the same type
+    '''
+    first_cpus = [siblings[0] for siblings in thread_siblings]
+    if exists(INTEL_CORE_CPUS) and exists(INTEL_ATOM_CPUS):
+        atom_cpus = set(cpu_ranges_to_list(read(INTEL_ATOM_CPUS).split(',')))
+        core_types = ['efficiency' if cpu_id in atom_cpus else 'performance' for cpu_id in first_cpus]
+        return core_types if len(set(core_types)) > 1 else []
+
+    for attribute in CORE_TYPE_ATTRIBUTES:
+        paths = [CPU_DIR + f'cpu{cpu_id}/{attribute}' for cpu_id in first_cpus]
+        if not all(exists(path) for path in paths):
+            continue
+        values = _cluster_maximum(first_cpus, [read(path, int) for path in paths])
+        if min(values) * HYBRID_RATIO > max(values):
+            return []
+        # Middle tier cores (of tri-cluster cpus) are closer to the big ones
+        threshold = (min(values) + max(values)) / 2
+        return ['performance' if value > threshold else 'efficiency' for value in values]
+    return []
+
+
+def _cluster_maximum(cpu_ids: list, values: list) -> list:
+    '''
+    Evens out values within each topology cluster whose values are close (favored cores),
+    DynamIQ clusters mix big and little cores, so their values are kept apart
+    '''
+    paths = [CPU_DIR + f'cpu{cpu_id}/topology/cluster_id' for cpu_id in cpu_ids]
+    if not all(exists(path) for path in paths):
+        return values
+    clusters = [read(path, int) for path in paths]
+    cluster_values = dict()
+    for cluster, value in zip(clusters, values):
+        cluster_values.setdefault(cluster, []).append(value)
+    return [max(cluster_values[cluster]) if min(cluster_values[cluster]) * HYBRID_RATIO > max(cluster_values[cluster])
+            else value for cluster, value in zip(clusters, values)]
+
+
+def _first_cpu(cpu_list_path: str, default: int) -> int:
+    '''Lowest cpu id of a cpu list file, which identifies the domain the list spans'''
+    if not exists(cpu_list_path):
+        return default
+    return min(cpu_ranges_to_list(read(cpu_list_path).split(',')))
+
+
+def _llc_cpus_path(cpu_id: int) -> str:
+    '''shared_cpu_list path of the last level (L3) cache of cpu_id, None if it has none'''
+    cache_dir = CPU_DIR + f'cpu{cpu_id}/cache/'
+    for index in range(3, 8):
+        level_path = cache_dir + f'index{index}/level'
+        if exists(level_path) and read(level_path, int) == 3:
+            return cache_dir + f'index{index}/shared_cpu_list'
+    return None
+
+
+def detect_core_domains(thread_siblings: list) -> list:
+    '''
+    Returns (package, die, llc, cluster) domain ids of each physical core in thread_siblings
+    Domains are identified by package and die ids and the first cpu of the llc and cluster cpu lists,
+    ids only need to be unique within the domain above. Missing levels (older kernels, no L3) count as one domain
+    '''
+    core_domains = []
+    for siblings in thread_siblings:
+        cpu_id = siblings[0]
+        topology_dir = CPU_DIR + f'cpu{cpu_id}/topology/'
+        package = read(topology_dir + 'physical_package_id', int) if exists(topology_dir + 'physical_package_id') else 0
+        die = read(topology_dir + 'die_id', int) if exists(topology_dir + 'die_id') else 0
+        llc_cpus = _llc_cpus_path(cpu_id)
+        llc = -1 if llc_cpus is None else _first_cpu(llc_cpus, -1)
+        cluster = _first_cpu(topology_dir + 'cluster_cpus_list', cpu_id)
+        core_domains.append((package, die, llc, cluster))
+    return core_domains
+
+
+def core_order(thread_siblings: list, core_types: list, preference: str, core_domains: list = None) -> tuple:
+    '''
+    Order physical cores get onlined in: the core of cpu0 (which can't go offline),
+    then cores of the preferred type, then the rest.
+    Within those, cores fill the domains of cpu0 first and then one domain after another
+    (see detect_core_domains), so the online set stays compact and whole domains are parked.
+    '''
+    assert preference in CORE_PREFERENCES
+    cpu0_core = next(core_num for core_num, siblings in enumerate(thread_siblings) if 0 in siblings)
+    cpu0_domains = core_domains[cpu0_core] if core_domains else ()
+
+    def key(core_num):
+        not_preferred = preference != 'none' and bool(core_types) and core_types[core_num] != preference
+        # (not in cpu0's domain, domain id) for each level
+        domains = [] if not core_domains else \
+            [(domain != cpu0_domain, domain) for domain, cpu0_domain in zip(core_domains[core_num], cpu0_domains)]
+        return core_num != cpu0_core, not_preferred, domains, core_num
+    return tuple(sorted(range(len(thread_siblings)), key=key))
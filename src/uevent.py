@@ -0,0 +1,191 @@
+import os
+import errno
+import ctypes
+import select
+import socket
+import struct
+import time
+from collections import deque, defaultdict
+
+import log
+
+'''
+This module holds the UeventListener class, which wakes the main loop on kernel
+uevents (power supply changes, cpu hotplug) instead of waiting for the next poll.
+'''
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+# inotify fallback (sys/inotify.h)
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+# sysfs attribute value changes (ie. an AC adapter going online) never raise inotify events,
+# only cpus being added or removed can be watched
+INOTIFY_WATCHES = {'/sys/devices/system/cpu': 'cpu'}
+
+
+def parse_uevent(message: bytes) -> dict:
+    '''
+    Parses a kernel uevent message ("action@devpath\\0KEY=VALUE\\0...")
+    Returns dict of properties, None if message isn't a kernel uevent
+    '''
+    fields = message.rstrip(b'\0').split(b'\0')
+    if not fields or b'@' not in fields[0]:
+        # libudev messages or garbage
+        return None
+    properties = dict()
+    for field in fields[1:]:
+        key, _, value = field.decode('utf-8', 'replace').partition('=')
+        properties[key] = value
+    if 'ACTION' not in properties:
+        properties['ACTION'] = fields[0].split(b'@', 1)[0].decode('utf-8', 'replace')
+    return properties
+
+
+class UeventListener:
+    '''
+    Dispatches kernel uevents to callbacks subscribed per subsystem
+    callback signature: callback(action: str, properties: dict)
+    Uses the kobject netlink socket, or inotify on sysfs dirs if it's unavailable.
+    The inotify fallback only reports cpus being added or removed, power supply
+    changes have to be polled unless netlink is True.
+    Synthetic messages can be injected with inject() (ie. for testing).
+    '''
+    def __init__(self, netlink: bool = True, inotify: bool = True):
+        self.callbacks = defaultdict(list)
+        self.injected = deque()
+        self.socket = None
+        self.inotify_fd = None
+        self.inotify_watches = dict()  # wd: subsystem
+        self.dispatched = 0  # total relevant uevents
+        if netlink:
+            self._open_netlink()
+        if self.socket is None and inotify:
+            self._open_inotify()
+
+    def _open_netlink(self):
+        try:
+            self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self.socket.bind((0, UEVENT_KERNEL_GROUP))
+            self.socket.setblocking(False)
+        except OSError as err:
+            log.info(f'Kernel uevents unavailable ({err.strerror}).')
+            if self.socket is not None:
+                self.socket.close()
+            self.socket = None
+        else:
+            log.info('Listening to kernel uevents.')
+
+    @property
+    def netlink(self) -> bool:
+        '''Whether every subscribed uevent gets delivered (kobject netlink socket in use)'''
+        return self.socket is not None
+
+    def _open_inotify(self):
+        '''Fallback: sysfs only reports device creation/removal through inotify'''
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (OSError, AttributeError) as err:
+            log.info(f'inotify unavailable ({err}).')
+            return
+
+        for path, subsystem in INOTIFY_WATCHES.items():
+            wd = libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_DELETE)
+            if wd >= 0:
+                self.inotify_watches[wd] = subsystem
+        if self.inotify_watches:
+            self.inotify_fd = fd
+            log.info('Watching sysfs with inotify.')
+        else:
+            os.close(fd)
+
+    def subscribe(self, subsystem: str, callback):
+        self.callbacks[subsystem].append(callback)
+
+    def inject(self, message: bytes):
+        '''Queues a synthetic uevent message, it gets dispatched like kernel ones'''
+        self.injected.append(message)
+
+    def fileno(self):
+        if self.socket is not None:
+            return self.socket.fileno()
+        return self.inotify_fd
+
+    def _receive(self) -> list:
+        '''Returns list of pending uevent property dicts'''
+        uevents = [parse_uevent(message) for message in self.injected]
+        self.injected.clear()
+
+        while self.socket is not None:
+            try:
+                uevents.append(parse_uevent(self.socket.recv(16384)))
+            except BlockingIOError:
+                break
+            except OSError as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                # Some uevents were lost, assume everything changed
+                uevents.extend({'SUBSYSTEM': subsystem, 'ACTION': 'change'} for subsystem in self.callbacks)
+
+        while self.inotify_fd is not None:
+            try:
+                data = os.read(self.inotify_fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size + length
+                action = 'add' if mask & IN_CREATE else 'remove' if mask & IN_DELETE else 'change'
+                uevents.append({'SUBSYSTEM': self.inotify_watches.get(wd), 'ACTION': action})
+
+        return [uevent for uevent in uevents if uevent is not None]
+
+    def dispatch(self) -> int:
+        '''Dispatches pending uevents to subscribers, returns number of relevant uevents'''
+        dispatched = 0
+        for uevent in self._receive():
+            subsystem = uevent.get('SUBSYSTEM')
+            if subsystem in self.callbacks:
+                dispatched += 1
+                for callback in self.callbacks[subsystem]:
+                    callback(uevent['ACTION'], uevent)
+        self.dispatched += dispatched
+        return dispatched
+
+    def wait(self, timeout: float, fds=()) -> bool:
+        '''
+        Sleeps up to timeout seconds or until a relevant uevent arrives
+        fds: other file descriptors (or objects with fileno) that also end the wait when readable
+        Returns True if woken up by a uevent or fds
+        '''
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            if self.injected and self.dispatch():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            fd = self.fileno()
+            if fd is None and not fds:
+                time.sleep(remaining)
+                return bool(self.dispatch())
+            readable, _, _ = select.select([fd] + list(fds) if fd is not None else list(fds), [], [], remaining)
+            if any(readable_fd != fd for readable_fd in readable):
+                self.dispatch()
+                return True
+            if readable and self.dispatch():
+                return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
@@ -0,0 +1,113 @@
+from array import array
+
+from hardware import read_text
+
+'''
+This module holds the UtilizationSampler class, which reads /proc/stat once per sample
+into preallocated arrays and computes per cpu utilization of the last interval,
+so any number of consumers can share the same snapshot.
+'''
+
+# /proc/stat cpu line columns used (guest time is already included in user/nice)
+USER, NICE, SYSTEM, IDLE, IOWAIT, IRQ, SOFTIRQ, STEAL = range(8)
+COLUMNS = 8
+
+
+class UtilizationSampler:
+    '''
+    Per cpu busy/iowait/irq percentages between the last two samples
+    Cpus are indexed by their id, so offline cpus never shift online ones
+    '''
+    def __init__(self, cpu_ids: list):
+        size = max(cpu_ids) + 1
+        self.size = size
+        self.previous = array('Q', bytes(8 * COLUMNS * size))
+        self.current = array('Q', bytes(8 * COLUMNS * size))
+        # 1 if cpu is present in a sample
+        self.previous_seen = array('b', bytes(size))
+        self.current_seen = array('b', bytes(size))
+        # Per cpu column deltas of the last sample
+        self.deltas = array('q', bytes(8 * COLUMNS * size))
+        self.busy = array('d', bytes(8 * size))
+        self.iowait = array('d', bytes(8 * size))
+        self.irq = array('d', bytes(8 * size))
+        # cpu ids with valid deltas in the last sample
+        self.cpu_ids = []
+        self.busy_average = 0.0
+        self.iowait_average = 0.0
+        self.irq_average = 0.0
+        self.samples = 0
+
+    def sample(self):
+        '''Reads /proc/stat and computes utilization since the previous sample'''
+        # Swap buffers instead of allocating new ones
+        self.previous, self.current = self.current, self.previous
+        self.previous_seen, self.current_seen = self.current_seen, self.previous_seen
+        current, current_seen = self.current, self.current_seen
+        for i in range(self.size):
+            current_seen[i] = 0
+
+        for line in read_text('/proc/stat').splitlines():
+            if not line.startswith('cpu') or line[3] == ' ':
+                # Only per cpu lines, the aggregated one counts offline cpus too
+                if line.startswith('intr'):
+                    break
+                continue
+            values = line.split()
+            cpu_id = int(values[0][3:])
+            if cpu_id >= self.size:
+                continue
+            offset = cpu_id * COLUMNS
+            for column in range(COLUMNS):
+                current[offset + column] = int(values[column + 1])
+            current_seen[cpu_id] = 1
+
+        self.samples += 1
+        self._compute()
+
+    def _compute(self):
+        previous, current, deltas = self.previous, self.current, self.deltas
+        cpu_ids = []
+        busy_sum = iowait_sum = irq_sum = total_sum = 0
+        for cpu_id in range(self.size):
+            if not (self.current_seen[cpu_id] and self.previous_seen[cpu_id]):
+                continue
+            offset = cpu_id * COLUMNS
+            total = 0
+            for index in range(offset, offset + COLUMNS):
+                deltas[index] = current[index] - previous[index]
+                total += deltas[index]
+            cpu_ids.append(cpu_id)
+            if total <= 0:
+                self.busy[cpu_id] = self.iowait[cpu_id] = self.irq[cpu_id] = 0.0
+                continue
+            iowait = deltas[offset + IOWAIT]
+            idle = deltas[offset + IDLE] + iowait
+            irq = deltas[offset + IRQ] + deltas[offset + SOFTIRQ]
+            self.busy[cpu_id] = 100 * (total - idle) / total
+            self.iowait[cpu_id] = 100 * iowait / total
+            self.irq[cpu_id] = 100 * irq / total
+            busy_sum += total - idle
+            iowait_sum += iowait
+            irq_sum += irq
+            total_sum += total
+
+        self.cpu_ids = cpu_ids
+        if total_sum:
+            self.busy_average = 100 * busy_sum / total_sum
+            self.iowait_average = 100 * iowait_sum / total_sum
+            self.irq_average = 100 * irq_sum / total_sum
+        else:
+            self.busy_average = self.iowait_average = self.irq_average = 0.0
+
+    # Snapshot views
+    def average(self) -> float:
+        return round(self.busy_average, 1)
+
+    def maximum(self) -> float:
+        return round(max((self.busy[cpu_id] for cpu_id in self.cpu_ids), default=0.0), 1)
+
+    def per_cpu(self, values: array = None) -> dict:
+        '''Returns dict of cpu_id: value (busy by default) of the last sample'''
+        values = self.busy if values is None else values
+        return {cpu_id: round(values[cpu_id], 1) for cpu_id in self.cpu_ids}
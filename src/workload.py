@@ -0,0 +1,77 @@
+from time import monotonic
+
+import log
+
+'''
+This module holds the WorkloadGovernor class, which watches the cpu utilization history
+of SystemStatus for sustained bursts (compiles, test runs) and temporarily lifts the
+battery limits of the active profile so bursts finish sooner (race-to-idle).
+'''
+
+
+class WorkloadGovernor:
+    '''
+    Burst detection state machine: idle -> pending -> boosted -> cooldown -> idle
+    idle: utilization below bat_boost_threshold
+    pending: utilization above threshold, for less than bat_boost_trigger ms
+    boosted: lasts at least bat_boost_min_time ms, until utilization drops below bat_boost_release
+    cooldown: no boosting for bat_boost_cooldown ms
+    '''
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.boosted = False
+        self.changed = False
+        self.burst_start = None
+        self.boost_start = None
+        self.cooldown_end = None
+        self.boosts = 0
+
+    def reset(self):
+        self.changed = self.boosted
+        self.boosted = False
+        self.burst_start = None
+        self.boost_start = None
+
+    def state(self) -> str:
+        if self.boosted:
+            return 'boosted'
+        elif self.cooldown_end is not None and self.clock() < self.cooldown_end:
+            return 'cooldown'
+        elif self.burst_start is not None:
+            return 'pending'
+        return 'idle'
+
+    def update(self, profile, status) -> bool:
+        '''
+        Steps the state machine with the latest cpu_util_avg of status
+        returns True while the battery limits of profile should be lifted
+        '''
+        if status['ac_power'] or not profile.bat_boost:
+            self.reset()
+            return False
+
+        now = self.clock()
+        utilization = status['cpu_util_avg']
+        self.changed = False
+        if self.boosted:
+            if utilization < profile.bat_boost_release:
+                if (now - self.boost_start) * 1000 >= profile.bat_boost_min_time:
+                    self.boosted = False
+                    self.changed = True
+                    self.boost_start = None
+                    self.cooldown_end = now + profile.bat_boost_cooldown / 1000
+                    log.info(f'Workload burst over (utilization {utilization}%), restoring battery limits.')
+        elif self.cooldown_end is not None and now < self.cooldown_end:
+            self.burst_start = None
+        elif utilization >= profile.bat_boost_threshold:
+            if self.burst_start is None:
+                self.burst_start = now
+            if (now - self.burst_start) * 1000 >= profile.bat_boost_trigger:
+                self.boosted = self.changed = True
+                self.boost_start = now
+                self.burst_start = None
+                self.boosts += 1
+                log.info(f'Workload burst detected (utilization {utilization}%), lifting battery limits.')
+        else:
+            self.burst_start = None
+        return self.boosted